@@ -1,18 +1,27 @@
 
 import os
 import json
+import hashlib
 import pandas as pd
 import re
 import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 import streamlit as st
 
 # Gemini-specific imports
 import google.generativeai as genai
-from pdf2image import convert_from_bytes
 from PIL import Image
 
+# Shared with the root app; `pip install -e .` from the repository root
+from page_cache import page_fingerprints, shared_cache
+from document import Document
+from prompts import get_prompt
+from normalize import RATE_COLUMNS, to_number, to_rates
+
 # Load environment variables from .env
 load_dotenv()
 
@@ -24,44 +33,133 @@ if not GENIEMI_API_KEY:
 
 genai.configure(api_key=GENIEMI_API_KEY)
 
-# Function to convert PDF to images
-def convert_pdf_to_images(uploaded_pdf):
-    try:
-        images = convert_from_bytes(uploaded_pdf.read())
-        return images
-    except Exception as e:
-        st.error(f"Error converting PDF to images: {e}")
-        return []
+# Vision request tuning
+RENDER_DPI = 150                 # enough for printed invoice text, far smaller than 300 DPI scans
+MAX_IMAGE_SIDE = 1600            # longest side in pixels after downsampling
+MAX_IMAGE_BYTES = 300 * 1024     # target JPEG size per page
+MAX_PAGES_PER_REQUEST = 8        # pages of one invoice sent together in a single request
+MAX_CONCURRENT_REQUESTS = 4      # invoices processed in parallel
+REQUESTS_PER_MINUTE = 15         # Gemini free-tier limit for gemini-1.5-flash
+GEMINI_MODEL = 'gemini-1.5-flash'
+
+
+class RateLimiter:
+    """
+    Spaces calls evenly so that at most `per_minute` start in any minute, across threads.
+    """
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# Single model client and rate limiter shared by every request and Streamlit rerun
+@st.cache_resource
+def get_gemini_model():
+    return genai.GenerativeModel(GEMINI_MODEL)
+
+
+@st.cache_resource
+def get_rate_limiter():
+    return RateLimiter(REQUESTS_PER_MINUTE)
 
-# Function to call the Gemini API
-def call_gemini_api(image, prompt):
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content([
-            {
-                "mime_type": "image/jpeg",
-                "data": image  # Correct key: 'data' instead of 'content'
-            },
-            {
-                "mime_type": "text/plain",
-                "text": prompt  # Correct key: 'text' instead of 'content'
-            }
-        ])
-        return response.text
-    except Exception as e:
-        st.error(f"Error during Gemini API call: {e}")
-        return None
-
-# Function to extract data from a single image using Gemini
-def extract_data_from_image(image, prompt):
-    # Convert PIL Image to bytes
-    img_byte_arr = io.BytesIO()
-    image.save(img_byte_arr, format='JPEG')
-    img_bytes = img_byte_arr.getvalue()
-    
-    # Get Gemini response
-    response = call_gemini_api(img_bytes, prompt)
-    return response
+
+# Function to convert PDF pages (1-based, inclusive) to images, rendered in process by PyMuPDF
+def convert_pdf_to_images(pdf_bytes, first_page=None, last_page=None):
+    with Document.from_bytes(pdf_bytes) as document:
+        first_page = first_page or 1
+        last_page = last_page or document.page_count
+        return [image for _, image in document.render(range(first_page, last_page + 1), dpi=RENDER_DPI)]
+
+# Downsample and re-encode one page until it fits the byte budget
+def compress_image(image, max_bytes=MAX_IMAGE_BYTES, max_side=MAX_IMAGE_SIDE):
+    image = image.convert("RGB")
+    image.thumbnail((max_side, max_side))
+    while True:
+        for quality in (85, 70, 55, 40):
+            img_byte_arr = io.BytesIO()
+            image.save(img_byte_arr, format='JPEG', quality=quality, optimize=True)
+            if img_byte_arr.tell() <= max_bytes:
+                return img_byte_arr.getvalue()
+        if max(image.size) <= 600:
+            # Smaller than this the text becomes unreadable; send the lowest quality we have
+            return img_byte_arr.getvalue()
+        image = image.resize((int(image.width * 0.8), int(image.height * 0.8)))
+
+# Function to call the Gemini API with all pages of one invoice in a single request
+def call_gemini_api(model, rate_limiter, images, prompt):
+    rate_limiter.wait()
+    parts = [{"mime_type": "image/jpeg", "data": image} for image in images]
+    parts.append(prompt.render())
+    response = model.generate_content(
+        parts,
+        generation_config={"response_mime_type": "application/json"}
+    )
+    return response.text
+
+# Parse a model response into a dict, tolerating ```json fences or surrounding text
+def parse_response(llm_response):
+    match = re.search(r'\{.*\}', llm_response or '', re.DOTALL)
+    if not match:
+        raise ValueError("No JSON object found in the response.")
+    return json.loads(match.group(0))
+
+# Keep the first non-empty value for each field across the page groups of one invoice
+def merge_page_results(results):
+    merged = {}
+    for result in results:
+        for field, value in result.items():
+            if value not in (None, "", [], {}) and merged.get(field) in (None, "", [], {}):
+                merged[field] = value
+            else:
+                merged.setdefault(field, value)
+    return merged
+
+# Cache key of one request: the model, the prompt version and the fingerprints of the pages sent together
+def group_cache_key(prompt, page_keys):
+    hasher = hashlib.sha256(f"{GEMINI_MODEL}\n{prompt.id}".encode('utf-8'))
+    for page_key in page_keys:
+        hasher.update(page_key.encode('utf-8'))
+    return hasher.hexdigest()
+
+# Extract one invoice record from all pages of a PDF; runs in a worker thread, so no st.* calls.
+# Page groups answered before (a re-uploaded invoice, a shared cover page) come from the page cache
+# and are neither rendered nor sent to Gemini again.
+def extract_invoice(model, rate_limiter, file_name, pdf_bytes, prompt):
+    page_keys = page_fingerprints(pdf_bytes)
+    if not page_keys:
+        return None, f"No pages found in {file_name}."
+
+    cache = shared_cache()
+    results, uploaded, cached = [], 0, 0
+    for start in range(0, len(page_keys), MAX_PAGES_PER_REQUEST):
+        group = page_keys[start:start + MAX_PAGES_PER_REQUEST]
+        key = group_cache_key(prompt, group)
+        llm_response = cache.get("vision", key)
+        if llm_response is None:
+            images = convert_pdf_to_images(pdf_bytes, first_page=start + 1, last_page=start + len(group))
+            pages = [compress_image(image) for image in images]
+            llm_response = call_gemini_api(model, rate_limiter, pages, prompt)
+            results.append(parse_response(llm_response))
+            # Stored only once it parses, so a malformed answer is asked again next time
+            cache.put("vision", key, llm_response)
+            uploaded += sum(map(len, pages))
+        else:
+            results.append(parse_response(llm_response))
+            cached += len(group)
+    record = merge_page_results(results)
+    record['Prompt Version'] = prompt.id
+    return record, (f"{len(page_keys)} pages, {cached} from cache, "
+                                         f"{uploaded // 1024} KB uploaded")
 
 # Function to process multiple PDF files and extract invoice data into a DataFrame
 def create_docs(user_pdf_list):
@@ -90,63 +188,45 @@ def create_docs(user_pdf_list):
         'GSTIN Recipient': pd.Series(dtype='str'),
     })
     
-    # Define the prompt for Gemini
-    prompt_template = '''Extract the following fields from the invoice image:
-- Invoice No.
-- Quantity
-- Date
-- Amount
-- Total
-- Email
-- Address
-- Taxable Value
-- SGST Amount
-- CGST Amount
-- IGST Amount
-- SGST Rate
-- CGST Rate
-- IGST Rate
-- Tax Amount
-- Tax Rate
-- Final Amount
-- Invoice Date
-- Place of Supply
-- Place of Origin
-- GSTIN Supplier
-- GSTIN Recipient
-
-Provide the output in JSON format.
-'''
+    # The prompt comes from the registry, with the same fields as the other extractors
+    prompt = get_prompt("invoice_extraction_vision")
     
-    for file in user_pdf_list:
-        st.write(f"Processing {file.name}...")
-        try:
-            images = convert_pdf_to_images(file)
-            if not images:
-                st.warning(f"No images extracted from {file.name}. Skipping.")
-                continue
-            
-            for page_number, image in enumerate(images, start=1):
-                st.write(f"Processing page {page_number} of {file.name}...")
-                
-                llm_response = extract_data_from_image(image, prompt_template)
-                if not llm_response:
-                    st.error(f"Failed to extract data from page {page_number} of {file.name}.")
+    # Invoices are extracted concurrently; results are shown here in upload order
+    model = get_gemini_model()
+    rate_limiter = get_rate_limiter()
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        futures = [
+            (file.name, executor.submit(extract_invoice, model, rate_limiter, file.name,
+                                        file.getvalue(), prompt))
+            for file in user_pdf_list
+        ]
+        rows = []
+        for file_name, future in futures:
+            try:
+                data_dict, message = future.result()
+                if data_dict is None:
+                    st.warning(f"{message} Skipping.")
                     continue
+                st.write(f"Extracted Data from {file_name} ({message}): {data_dict}")
+                rows.append(data_dict)
+            except json.JSONDecodeError as e:
+                st.error(f"Error parsing JSON from {file_name}: {e}")
+            except Exception as e:
+                st.error(f"An error occurred while processing {file_name}: {e}")
 
-                # Attempt to parse the JSON response
-                try:
-                    data_dict = json.loads(llm_response)
-                    st.write(f"Extracted Data from page {page_number} of {file.name}: {data_dict}")
-                except json.JSONDecodeError as e:
-                    st.error(f"Error parsing JSON from page {page_number} of {file.name}: {e}")
-                    continue
+    # Add the extracted data to the DataFrame, one row per invoice
+    float_columns = df.columns[df.dtypes == 'float64']
+    if rows:
+        df = pd.concat([df, pd.DataFrame(rows)], ignore_index=True)
 
-                # Add the extracted data to the DataFrame
-                df = pd.concat([df, pd.DataFrame([data_dict])], ignore_index=True)
-                st.write("*******DONE******")
-        except Exception as e:
-            st.error(f"An error occurred while processing {file.name}: {e}")
+    # Gemini returns "₹1,483.32" or "9%"; enforce the float columns declared above instead of leaving strings.
+    # A rate cell can list several rates ("9, 14"), which no float holds; it keeps them as text.
+    for column in float_columns:
+        if column in RATE_COLUMNS:
+            df[column] = [float('nan') if rates is pd.NA else rates[0] if len(rates) == 1
+                          else ", ".join(f"{rate:g}" for rate in rates) for rates in to_rates(df[column])]
+        else:
+            df[column] = to_number(df[column])
 
     # Save the DataFrame to an Excel file
     output_excel_file = "extracted_invoice_data.xlsx"
@@ -1,14 +1,19 @@
 import os
 import streamlit as st
 import pdfplumber
-from pdf2image import convert_from_path
 import pytesseract
 from PIL import Image
-import tempfile
 import re
 import json
 from llama_cpp import Llama
 
+# Shared with the root app; `pip install -e .` from the repository root
+from document import Document
+from prompts import get_prompt
+
+# Registry prompt asking for the shared invoice schema as a JSON object
+EXTRACTION_PROMPT = get_prompt("invoice_extraction_completion")
+
 # Set page configuration
 st.set_page_config(page_title="Invoice Data Extraction", layout="wide")
 
@@ -27,10 +32,10 @@ def load_llama_model():
 llm = load_llama_model()
 
 # Helper functions
-def extract_text_from_pdf(file):
+def extract_text_from_pdf(document):
     text = ""
     try:
-        with pdfplumber.open(file) as pdf:
+        with pdfplumber.open(document.stream()) as pdf:
             for page in pdf.pages:
                 extracted = page.extract_text()
                 if extracted:
@@ -40,20 +45,19 @@ def extract_text_from_pdf(file):
         return ""
     return text
 
-def extract_text_via_ocr(file):
+def extract_text_via_ocr(document):
     text = ""
-    with tempfile.TemporaryDirectory() as path:
-        try:
-            images = convert_from_path(file, output_folder=path)
-        except Exception as e:
-            st.error(f"Error converting PDF to images: {e}")
-            return ""
-        for img in images:
+    try:
+        images = document.render()
+        for _, img in images:
             try:
                 text += pytesseract.image_to_string(img) + "\n"
             except Exception as e:
                 st.error(f"Error with OCR on image: {e}")
                 return ""
+    except Exception as e:
+        st.error(f"Error converting PDF to images: {e}")
+        return ""
     return text
 
 def preprocess_text(text):
@@ -62,36 +66,7 @@ def preprocess_text(text):
     return text
 
 def extract_invoice_data(text):
-    prompt = f"""
-You are a model designed to extract invoice information. Please strictly extract and return the invoice information in the following JSON format, and nothing else:
-
-JSON Format:
-{{
-    "Invoice Number": "",
-    "Invoice Date": "",
-    "Due Date": "",
-    "Total Amount": "",
-    "Vendor Name": "",
-    "Vendor Address": "",
-    "Buyer Name": "",
-    "Buyer Address": "",
-    "GSTIN Number": "",
-    "Bank Details": {{
-        "Name": "",
-        "Account Number": "",
-        "IFSC Code": ""
-    }},
-    "Payment Terms": ""
-}}
-
-Extract the information strictly from the invoice text provided below:
-
-\"\"\" 
-{text} 
-\"\"\"
-
-Ensure that the JSON is valid and strictly adheres to the format. Return no additional explanations.
-"""
+    prompt = EXTRACTION_PROMPT.render(text)
     response = llm(
         prompt,
         max_tokens=1024,
@@ -126,17 +101,14 @@ uploaded_file = st.file_uploader("Choose a PDF file", type=["pdf"])
 
 if uploaded_file is not None:
     with st.spinner("Processing..."):
-        # Save uploaded file to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            tmp_file.write(uploaded_file.read())
-            tmp_file_path = tmp_file.name
-
-        # Attempt to extract text directly
-        text = extract_text_from_pdf(tmp_file_path)
+        # The upload stays in memory: pdfplumber and the renderer read the same buffer, nothing goes to disk
+        with Document.from_upload(uploaded_file) as document:
+            # Attempt to extract text directly
+            text = extract_text_from_pdf(document)
 
-        # If no text found, perform OCR
-        if not text.strip():
-            text = extract_text_via_ocr(tmp_file_path)
+            # If no text found, perform OCR
+            if not text.strip():
+                text = extract_text_via_ocr(document)
 
         text = preprocess_text(text)
 
@@ -169,6 +141,7 @@ if uploaded_file is not None:
                     extracted_data = None
 
                 if extracted_data:
+                    extracted_data['Prompt Version'] = EXTRACTION_PROMPT.id
                     st.subheader("Extracted Invoice Data")
                     st.json(extracted_data)
 
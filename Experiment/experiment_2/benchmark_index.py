@@ -0,0 +1,102 @@
+
+import argparse
+import timeit
+
+import box
+import numpy as np
+import yaml
+
+from llm.embeddings import load_embedding_model
+from llm.local_index import LocalVectorIndex
+
+with open('config.yml', 'r', encoding='utf8') as ymlfile:
+    cfg = box.Box(yaml.safe_load(ymlfile))
+
+DEFAULT_QUERIES = [
+    'What is the invoice number value?',
+    'What is the invoice date value?',
+    'What is the invoice client name, address and tax ID?',
+    'What is the invoice seller name, address and tax ID?',
+    'What is the invoice IBAN value?',
+    'retrieve invoice gross worth total amount',
+]
+
+
+def time_searches(search, query_embeddings, top_k):
+    """
+    Runs one search per query and returns (result id lists, latencies in ms).
+    """
+    results, latencies = [], []
+    for query_embedding in query_embeddings:
+        start = timeit.default_timer()
+        ids = search(query_embedding, top_k)
+        latencies.append((timeit.default_timer() - start) * 1000)
+        results.append(ids)
+    return results, np.array(latencies)
+
+
+def recall_at_k(results, truth):
+    hits = [len(set(r) & set(t)) / max(len(t), 1) for r, t in zip(results, truth)]
+    return float(np.mean(hits)) if hits else 0.0
+
+
+def run_benchmark(queries, top_k, sample):
+    flat = LocalVectorIndex.load(cfg.LOCAL_INDEX_PATH, index_type='flat')
+    if not len(flat):
+        print(f"No local index at {cfg.LOCAL_INDEX_PATH}, run ingest.py first.")
+        return
+
+    model = load_embedding_model(cfg.EMBEDDINGS, cfg.EMBEDDING_NUM_THREADS)
+    if sample:
+        # Chunk texts make realistic queries with a known nearest neighbour
+        rng = np.random.default_rng(0)
+        rows = rng.choice(len(flat), min(sample, len(flat)), replace=False)
+        queries = queries + [flat.docs[row]['content'][:200] for row in rows]
+    query_embeddings = model.encode(queries, convert_to_numpy=True)
+
+    backends = {'flat': lambda q, k: [doc['id'] for doc, _ in flat.search(q, k)]}
+
+    ivf = LocalVectorIndex.load(cfg.LOCAL_INDEX_PATH, index_type='ivf',
+                                nlist=cfg.LOCAL_INDEX_NLIST, nprobe=cfg.LOCAL_INDEX_NPROBE)
+    backends['ivf'] = lambda q, k: [doc['id'] for doc, _ in ivf.search(q, k)]
+
+    try:
+        hnsw = LocalVectorIndex.load(cfg.LOCAL_INDEX_PATH, index_type='hnsw')
+        backends['hnsw'] = lambda q, k: [doc['id'] for doc, _ in hnsw.search(q, k)]
+    except ImportError:
+        print("hnswlib not installed, skipping the hnsw backend.")
+
+    try:
+        from haystack.document_stores import WeaviateDocumentStore
+
+        vector_store = WeaviateDocumentStore(
+            host=cfg.WEAVIATE_HOST,
+            port=cfg.WEAVIATE_PORT,
+            embedding_dim=cfg.WEAVIATE_EMBEDDING_DIM
+        )
+        backends['weaviate'] = lambda q, k: [
+            doc.id for doc in vector_store.query_by_embedding(q, top_k=k, return_embedding=False)
+        ]
+    except Exception as e:
+        print(f"Weaviate unavailable, skipping it: {e}")
+
+    truth, _ = time_searches(backends['flat'], query_embeddings, top_k)
+
+    print(f"{len(queries)} queries, top_k={top_k}, {len(flat)} chunks")
+    print(f"{'backend':<10}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for name, search in backends.items():
+        results, latencies = time_searches(search, query_embeddings, top_k)
+        print(f"{name:<10}{recall_at_k(results, truth):>10.3f}"
+              f"{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 95):>10.2f}"
+              f"{latencies.mean():>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('queries', nargs='*', help='Queries to benchmark (defaults to the sample invoice questions)')
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--sample', type=int, default=100,
+                        help='Also use this many random chunks as queries')
+    args = parser.parse_args()
+
+    run_benchmark(args.queries or DEFAULT_QUERIES, args.top_k, args.sample)
@@ -0,0 +1,165 @@
+
+import hashlib
+import json
+import os
+import timeit
+
+import numpy as np
+
+
+def chunk_hash(text, model_name):
+    # The model name is part of the key so switching EMBEDDINGS never serves stale vectors
+    return hashlib.sha256(f"{model_name}\0{text}".encode('utf8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent chunk-hash -> float32 vector cache.
+
+    Vectors live in a memory-mapped ``<path>.npy`` file (one row per chunk) and the
+    hash -> row mapping in ``<path>.json``, so a lookup never loads the whole matrix.
+    """
+
+    def __init__(self, path, dim):
+        self.vectors_path = path + '.npy'
+        self.index_path = path + '.json'
+        self.dim = dim
+        self.index = {}
+        self.vectors = None
+
+        if os.path.exists(self.index_path) and os.path.exists(self.vectors_path):
+            with open(self.index_path, 'r', encoding='utf8') as f:
+                self.index = json.load(f)
+            self.vectors = np.load(self.vectors_path, mmap_mode='r+')
+            if self.vectors.shape[1] != dim:
+                raise ValueError(f"Embedding cache {self.vectors_path} has dim "
+                                 f"{self.vectors.shape[1]}, expected {dim}")
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key):
+        return np.array(self.vectors[self.index[key]])
+
+    def add(self, keys, vectors):
+        new_keys = [key for key in keys if key not in self.index]
+        if not new_keys:
+            return
+        rows = dict(zip(keys, vectors))
+        needed = len(self.index) + len(new_keys)
+        if self.vectors is None or needed > self.vectors.shape[0]:
+            self._grow(needed)
+        for key in new_keys:
+            row = len(self.index)
+            self.vectors[row] = rows[key]
+            self.index[key] = row
+
+    def _grow(self, min_rows):
+        # Double the capacity so appends stay amortised O(1) across runs
+        old_rows = 0 if self.vectors is None else self.vectors.shape[0]
+        capacity = max(min_rows, 2 * old_rows, 1024)
+        os.makedirs(os.path.dirname(self.vectors_path) or '.', exist_ok=True)
+        tmp_path = self.vectors_path + '.tmp.npy'
+        grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                          shape=(capacity, self.dim))
+        if old_rows:
+            grown[:old_rows] = self.vectors
+        grown.flush()
+        del grown
+        self.vectors = None
+        os.replace(tmp_path, self.vectors_path)
+        self.vectors = np.load(self.vectors_path, mmap_mode='r+')
+
+    def flush(self):
+        if self.vectors is None:
+            return
+        # Vectors first, then the index that points at them
+        self.vectors.flush()
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+
+def load_embedding_model(model_name, num_threads=0):
+    """
+    Loads the sentence-transformers model used for both ingest and querying.
+
+    Parameters:
+        model_name (str): Hugging Face model id, e.g. cfg.EMBEDDINGS.
+        num_threads (int): torch intra-op threads; 0 keeps the torch default.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    return SentenceTransformer(model_name, device='cpu')
+
+
+def embed_texts(texts, model, model_name, cache=None, batch_size=32, num_workers=1):
+    """
+    Embeds chunk texts, reusing cached vectors and only encoding unseen chunks.
+
+    Parameters:
+        texts (list): Chunk texts to embed.
+        model (SentenceTransformer): Model returned by load_embedding_model.
+        model_name (str): Name used in the cache key.
+        cache (EmbeddingCache or None): Persistent cache, skipped when None.
+        batch_size (int): Encoder batch size.
+        num_workers (int): Number of encoder processes; 1 encodes in-process.
+
+    Returns:
+        tuple: (embeddings (np.ndarray of shape (len(texts), dim)), stats (dict))
+    """
+    start = timeit.default_timer()
+    keys = [chunk_hash(text, model_name) for text in texts]
+
+    # Identical chunks (e.g. repeated headers) are only encoded once per run
+    missing = {}
+    for key, text in zip(keys, texts):
+        if (cache is None or key not in cache) and key not in missing:
+            missing[key] = text
+
+    encoded = {}
+    if missing:
+        missing_keys = list(missing)
+        missing_texts = [missing[key] for key in missing_keys]
+        if num_workers > 1:
+            pool = model.start_multi_process_pool(target_devices=['cpu'] * num_workers)
+            try:
+                vectors = model.encode_multi_process(missing_texts, pool, batch_size=batch_size)
+            finally:
+                model.stop_multi_process_pool(pool)
+        else:
+            vectors = model.encode(missing_texts, batch_size=batch_size,
+                                   convert_to_numpy=True, show_progress_bar=False)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        encoded = dict(zip(missing_keys, vectors))
+        if cache is not None:
+            cache.add(missing_keys, vectors)
+            cache.flush()
+
+    if keys:
+        embeddings = np.stack([encoded[key] if key in encoded else cache.get(key) for key in keys])
+    else:
+        embeddings = np.empty((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+    elapsed = timeit.default_timer() - start
+    stats = {
+        'chunks': len(texts),
+        'embedded': len(encoded),
+        'cache_hits': len(texts) - sum(1 for key in keys if key in encoded),
+        'seconds': elapsed,
+        'chunks_per_sec': len(texts) / elapsed if elapsed > 0 else 0.0,
+    }
+    return embeddings, stats
+
+
+def format_throughput(stats):
+    return (f"Embedded {stats['embedded']} of {stats['chunks']} chunks "
+            f"({stats['cache_hits']} from cache) in {stats['seconds']:.2f} seconds "
+            f"- {stats['chunks_per_sec']:.1f} chunks/s")
@@ -0,0 +1,110 @@
+import json
+import os
+import re
+import timeit
+
+from haystack.nodes import PromptTemplate
+from llm.wrapper import cfg
+from prompts import get_prompt
+
+# Registry prompt (prompts.yaml) asking for the fields of config.INVOICE_FIELDS
+EXTRACTION_PROMPT = "invoice_extraction_rag"
+# Haystack's placeholder for the retrieved chunks, put where the prompt takes the document
+HAYSTACK_DOCUMENTS = "{join(documents)}"
+
+
+def parse_fields(raw_text, fields):
+    """
+    Parses the model output into a dict holding exactly the schema fields.
+
+    Parameters:
+        raw_text (str): The generated text.
+        fields (list): The schema field names.
+
+    Returns:
+        dict: field -> value; missing or unparsable fields map to "".
+    """
+    data = {}
+    match = re.search(r'\{.*\}', raw_text or '', re.DOTALL)
+    if match:
+        try:
+            data = json.loads(match.group(0))
+        except json.JSONDecodeError:
+            data = {}
+    return {field: data.get(field, "") if isinstance(data, dict) else "" for field in fields}
+
+
+class FieldExtractor:
+    """
+    Extracts every schema field of one ingested invoice with a single retrieval and a
+    single generation, instead of one retrieval and one generation per field question.
+    """
+
+    def __init__(self, rag_pipeline, prompt_name=EXTRACTION_PROMPT, top_k=None):
+        self.retriever = rag_pipeline.get_node("Retriever")
+        self.prompt_node = rag_pipeline.get_node("PromptNode")
+        self.prompt = get_prompt(prompt_name)
+        self.fields = self.prompt.fields
+        self.top_k = top_k or cfg.EXTRACTION_TOP_K
+        # One query naming every field pulls the chunks that hold any of them
+        self.query = 'Invoice ' + ', '.join(self.fields)
+        self.prompt_template = PromptTemplate(prompt=self.prompt.render(HAYSTACK_DOCUMENTS))
+        self.retrieval_cache = {}
+
+    def _file_hash(self, file_name):
+        # Keying the cache on the ingested content hash drops entries when a file is re-ingested
+        if not os.path.exists(cfg.INGEST_MANIFEST_PATH):
+            return None
+        with open(cfg.INGEST_MANIFEST_PATH, 'r', encoding='utf8') as f:
+            return json.load(f).get(file_name, {}).get('sha256')
+
+    def retrieve(self, file_name):
+        """
+        Returns (documents, cached) for one ingested file, retrieving at most once per file version.
+        """
+        key = (file_name, self._file_hash(file_name), self.top_k)
+        if key in self.retrieval_cache:
+            return self.retrieval_cache[key], True
+        documents = self.retriever.retrieve(
+            query=self.query,
+            top_k=self.top_k,
+            filters={'file_name': [file_name]}
+        )
+        self.retrieval_cache[key] = documents
+        return documents, False
+
+    def extract(self, file_name):
+        """
+        Extracts all fields of one invoice.
+
+        Parameters:
+            file_name (str): Name of the ingested PDF inside DATA_PATH.
+
+        Returns:
+            dict: file_name, fields, raw model output, the prompt's id, cache flag and timings in seconds.
+        """
+        start = timeit.default_timer()
+        documents, cached = self.retrieve(file_name)
+        retrieved = timeit.default_timer()
+
+        raw_output = ''
+        if documents:
+            output, _ = self.prompt_node.run(
+                query=self.query,
+                documents=documents,
+                prompt_template=self.prompt_template
+            )
+            results = output.get('results', [])
+            raw_output = results[0] if results else ''
+        end = timeit.default_timer()
+
+        return {
+            'file_name': file_name,
+            'fields': parse_fields(raw_output, self.fields),
+            'raw_output': raw_output,
+            'prompt_version': self.prompt.id,
+            'retrieval_cached': cached,
+            'retrieval_seconds': retrieved - start,
+            'generation_seconds': end - retrieved,
+            'total_seconds': end - start,
+        }
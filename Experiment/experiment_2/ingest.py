@@ -1,60 +1,194 @@
 
-from haystack.nodes import PDFToTextConverter, PreProcessor, EmbeddingRetriever
+from haystack.nodes import PDFToTextConverter, PreProcessor
 from haystack.document_stores import WeaviateDocumentStore
 from haystack.pipelines import DocumentSearchPipeline
 import box
 import yaml
 import timeit
+import hashlib
+import json
+import uuid
 import os
+from llm.embeddings import EmbeddingCache, load_embedding_model, embed_texts, format_throughput
+from llm.local_index import LocalVectorIndex
 
 with open('config.yml', 'r', encoding='utf8') as ymlfile:
     cfg = box.Box(yaml.safe_load(ymlfile))
 
+
+def file_sha256(file_path, chunk_size=1 << 20):
+    # Stream the file so large scans are never held in memory just to hash them
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stable_doc_id(file_name, file_hash, chunk_index):
+    # Weaviate only accepts UUIDs as object ids, so derive a deterministic one from the
+    # file's path under DATA_PATH, its content hash and the chunk position inside it.
+    # The path keeps two copies of one file apart: each is its own manifest entry, and
+    # removing or changing one must not delete the other's vectors.
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{file_name}:{file_hash}:{chunk_index}"))
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path):
+    # Write to a temp file first so an interrupted run never leaves a half written manifest
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def diff_manifest(manifest, file_hashes, split_config):
+    """
+    Compares the previous manifest with the current files in DATA_PATH.
+
+    Parameters:
+        manifest (dict): file name -> {"sha256": str, "split": list, "doc_ids": list} from the last run.
+        file_hashes (dict): file name -> sha256 of the files currently on disk.
+        split_config (list): [split_length, split_overlap]; a file split differently is re-ingested.
+
+    Returns:
+        tuple: (added (list), changed (list), removed (list)) file names.
+    """
+    added = [name for name in file_hashes if name not in manifest]
+    changed = [name for name in file_hashes
+               if name in manifest and (manifest[name]['sha256'] != file_hashes[name]
+                                        or manifest[name].get('split') != split_config)]
+    removed = [name for name in manifest if name not in file_hashes]
+    return sorted(added), sorted(changed), sorted(removed)
+
+
 def run_ingest():
     file_list = [os.path.join(cfg.DATA_PATH, f) for f in os.listdir(cfg.DATA_PATH) if
                 os.path.isfile(os.path.join(cfg.DATA_PATH, f)) and not f.startswith('.')]
 
     start = timeit.default_timer()
 
-    vector_store = WeaviateDocumentStore(
-        host=cfg.WEAVIATE_HOST,
-        port=cfg.WEAVIATE_PORT,
-        embedding_dim=cfg.WEAVIATE_EMBEDDING_DIM
-    )
+    manifest = load_manifest(cfg.INGEST_MANIFEST_PATH)
+    file_hashes = {os.path.basename(file_path): file_sha256(file_path) for file_path in file_list}
+    split_config = [cfg.PRE_PROCESSOR_SPLIT_LENGTH, cfg.PRE_PROCESSOR_SPLIT_OVERLAP]
+    added, changed, removed = diff_manifest(manifest, file_hashes, split_config)
+    if manifest and not os.path.exists(os.path.join(cfg.LOCAL_INDEX_PATH, 'index.json')):
+        # Stores ingested before the local index existed: rebuild it from every known file
+        changed = sorted(set(changed) | (set(file_hashes) & set(manifest)))
 
-    # Initialize PDF converter
-    converter = PDFToTextConverter()
-
-    # Convert PDFs to documents
-    docs = []
-    for file_path in file_list:
-        try:
-            documents = converter.convert(file_path=file_path, meta=None)
-            docs.extend(documents)
-        except Exception as e:
-            print(f"Error converting {file_path}: {e}")
-
-    # Preprocess documents
-    preprocessor = PreProcessor(
-        clean_empty_lines=True,
-        clean_whitespace=False,
-        clean_header_footer=False,
-        split_by="word",
-        language="en",
-        split_length=cfg.PRE_PROCESSOR_SPLIT_LENGTH,
-        split_overlap=cfg.PRE_PROCESSOR_SPLIT_OVERLAP,
-        split_respect_sentence_boundary=True,
-    )
+    print(f"Ingest plan: {len(added)} new, {len(changed)} changed, {len(removed)} removed, "
+          f"{len(file_hashes) - len(added) - len(changed)} unchanged")
+
+    if not (added or changed or removed):
+        print("Nothing to ingest, vector store is up to date.")
+        return
 
-    preprocessed_docs = preprocessor.process(docs)
-    vector_store.write_documents(preprocessed_docs)
+    vector_store = None
+    if cfg.VECTOR_BACKEND == 'weaviate':
+        vector_store = WeaviateDocumentStore(
+            host=cfg.WEAVIATE_HOST,
+            port=cfg.WEAVIATE_PORT,
+            embedding_dim=cfg.WEAVIATE_EMBEDDING_DIM
+        )
 
-    # Initialize Retriever
-    retriever = EmbeddingRetriever(
-        document_store=vector_store,
-        embedding_model=cfg.EMBEDDINGS
+    # The local index is always kept in sync so queries can fall back to it without Weaviate
+    local_index = LocalVectorIndex.load(
+        cfg.LOCAL_INDEX_PATH,
+        index_type=cfg.LOCAL_INDEX_TYPE,
+        nlist=cfg.LOCAL_INDEX_NLIST,
+        nprobe=cfg.LOCAL_INDEX_NPROBE,
+        mmap=False
     )
-    vector_store.update_embeddings(retriever)
+
+    # Drop the vectors of removed files and of the old version of changed files
+    stale_ids = [doc_id for name in removed + changed for doc_id in manifest[name]['doc_ids']]
+    if stale_ids:
+        if vector_store is not None:
+            vector_store.delete_documents(ids=stale_ids)
+        local_index.delete(stale_ids)
+    for name in removed:
+        del manifest[name]
+
+    to_convert = added + changed
+    if to_convert:
+        # Initialize PDF converter
+        converter = PDFToTextConverter()
+
+        # Convert only new or changed PDFs to documents
+        docs = []
+        for name in to_convert:
+            file_path = os.path.join(cfg.DATA_PATH, name)
+            try:
+                documents = converter.convert(
+                    file_path=file_path,
+                    meta={'file_name': name, 'file_hash': file_hashes[name]}
+                )
+                docs.extend(documents)
+            except Exception as e:
+                print(f"Error converting {file_path}: {e}")
+
+        # Preprocess documents
+        preprocessor = PreProcessor(
+            clean_empty_lines=True,
+            clean_whitespace=False,
+            clean_header_footer=False,
+            split_by="word",
+            language="en",
+            split_length=cfg.PRE_PROCESSOR_SPLIT_LENGTH,
+            split_overlap=cfg.PRE_PROCESSOR_SPLIT_OVERLAP,
+            split_respect_sentence_boundary=True,
+        )
+
+        preprocessed_docs = preprocessor.process(docs)
+
+        # Assign stable ids so a re-run upserts the same objects instead of duplicating them
+        doc_ids = {}
+        for doc in preprocessed_docs:
+            name = doc.meta['file_name']
+            chunk_ids = doc_ids.setdefault(name, [])
+            doc.id = stable_doc_id(name, doc.meta['file_hash'], len(chunk_ids))
+            chunk_ids.append(doc.id)
+
+        # Embed only the new chunks; update_embeddings() would re-embed the whole store.
+        # Chunks whose text was already embedded on an earlier run come from the cache.
+        if preprocessed_docs:
+            model = load_embedding_model(cfg.EMBEDDINGS, cfg.EMBEDDING_NUM_THREADS)
+            cache = EmbeddingCache(cfg.EMBEDDING_CACHE_PATH, cfg.WEAVIATE_EMBEDDING_DIM)
+            embeddings, stats = embed_texts(
+                [doc.content for doc in preprocessed_docs],
+                model,
+                cfg.EMBEDDINGS,
+                cache=cache,
+                batch_size=cfg.EMBEDDING_BATCH_SIZE,
+                num_workers=cfg.EMBEDDING_NUM_WORKERS
+            )
+            print(format_throughput(stats))
+            for doc, embedding in zip(preprocessed_docs, embeddings):
+                doc.embedding = embedding
+            if vector_store is not None:
+                vector_store.write_documents(preprocessed_docs, duplicate_documents='overwrite')
+            local_index.upsert(
+                [{'id': doc.id, 'content': doc.content, 'meta': doc.meta} for doc in preprocessed_docs],
+                embeddings
+            )
+
+        for name in to_convert:
+            if name in doc_ids:
+                manifest[name] = {'sha256': file_hashes[name], 'split': split_config,
+                                  'doc_ids': doc_ids[name]}
+            else:
+                # Conversion failed; forget the file so the next run retries it
+                manifest.pop(name, None)
+
+    local_index.build()
+    local_index.save(cfg.LOCAL_INDEX_PATH)
+    save_manifest(manifest, cfg.INGEST_MANIFEST_PATH)
 
     end = timeit.default_timer()
     print(f"Time to prepare embeddings: {end - start} seconds")
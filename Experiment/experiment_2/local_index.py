@@ -0,0 +1,171 @@
+
+import json
+import os
+
+import numpy as np
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def kmeans(vectors, n_clusters, n_iter=20, seed=0):
+    # Plain Lloyd iterations on unit vectors; good enough to partition a few hundred thousand chunks
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(n_clusters):
+            members = vectors[assignments == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+        centroids = normalize(centroids)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class LocalVectorIndex:
+    """
+    In-process cosine-similarity index over the ingested chunk embeddings.
+
+    The index directory holds ``vectors.npy`` (unit-normalised float32, memory-mapped on load),
+    ``docs.jsonl`` (id, content and meta per row) and, depending on ``index_type``,
+    ``ivf.npz`` or ``hnsw.bin``. ``flat`` is exact; ``ivf`` and ``hnsw`` trade recall for latency.
+    """
+
+    def __init__(self, index_type='flat', nlist=16, nprobe=4):
+        if index_type not in ('flat', 'ivf', 'hnsw'):
+            raise ValueError(f"Unknown local index type: {index_type}")
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.docs = []
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.centroids = None
+        self.assignments = None
+        self.hnsw = None
+
+    def __len__(self):
+        return len(self.docs)
+
+    def upsert(self, docs, embeddings):
+        """
+        Adds or replaces chunks.
+
+        Parameters:
+            docs (list): dicts with "id", "content" and "meta" keys.
+            embeddings (np.ndarray): one row per doc.
+        """
+        embeddings = normalize(embeddings)
+        self.delete([doc['id'] for doc in docs])
+        if len(self.vectors) == 0:
+            self.vectors = embeddings
+        else:
+            self.vectors = np.vstack([self.vectors, embeddings])
+        self.docs.extend(docs)
+
+    def delete(self, ids):
+        ids = set(ids)
+        keep = [row for row, doc in enumerate(self.docs) if doc['id'] not in ids]
+        if len(keep) == len(self.docs):
+            return
+        self.docs = [self.docs[row] for row in keep]
+        self.vectors = np.asarray(self.vectors[keep], dtype=np.float32)
+
+    def build(self):
+        # (Re)build the approximate structure after upserts/deletes
+        self.centroids, self.assignments, self.hnsw = None, None, None
+        if not len(self.docs):
+            return
+        if self.index_type == 'ivf':
+            self.centroids, self.assignments = kmeans(np.asarray(self.vectors), self.nlist)
+        elif self.index_type == 'hnsw':
+            import hnswlib
+
+            self.hnsw = hnswlib.Index(space='ip', dim=self.vectors.shape[1])
+            self.hnsw.init_index(max_elements=len(self.docs), ef_construction=200, M=16)
+            self.hnsw.add_items(np.asarray(self.vectors), np.arange(len(self.docs)))
+
+    def matching_rows(self, filters):
+        # filters follow the haystack convention: meta key -> list of accepted values
+        return np.array([row for row, doc in enumerate(self.docs)
+                         if all(doc['meta'].get(key) in values for key, values in filters.items())],
+                        dtype=np.int64)
+
+    def search(self, query_embedding, top_k=5, filters=None):
+        """
+        Returns the top_k (doc, score) pairs for one query embedding, best first.
+        With filters, only chunks whose meta matches are scanned (exactly, whatever the index type).
+        """
+        if not len(self.docs):
+            return []
+        query = normalize(query_embedding).reshape(-1)
+        top_k = min(top_k, len(self.docs))
+
+        if filters:
+            rows = self.matching_rows(filters)
+            if not len(rows):
+                return []
+        elif self.index_type == 'hnsw' and self.hnsw is not None:
+            self.hnsw.set_ef(max(top_k * 4, 50))
+            labels, distances = self.hnsw.knn_query(query, k=top_k)
+            # hnswlib's 'ip' space returns 1 - inner product
+            return [(self.docs[row], float(1.0 - dist)) for row, dist in zip(labels[0], distances[0])]
+        elif self.index_type == 'ivf' and self.centroids is not None:
+            probe = np.argsort(-(self.centroids @ query))[:self.nprobe]
+            rows = np.flatnonzero(np.isin(self.assignments, probe))
+        else:
+            rows = np.arange(len(self.docs))
+
+        scores = self.vectors[rows] @ query
+        k = min(top_k, len(rows))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(self.docs[rows[i]], float(scores[i])) for i in best]
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'vectors.npy'), np.asarray(self.vectors, dtype=np.float32))
+        with open(os.path.join(path, 'docs.jsonl'), 'w', encoding='utf8') as f:
+            for doc in self.docs:
+                f.write(json.dumps(doc) + '\n')
+        with open(os.path.join(path, 'index.json'), 'w', encoding='utf8') as f:
+            json.dump({'index_type': self.index_type, 'nlist': self.nlist, 'nprobe': self.nprobe}, f)
+        if self.centroids is not None:
+            np.savez(os.path.join(path, 'ivf.npz'), centroids=self.centroids, assignments=self.assignments)
+        if self.hnsw is not None:
+            self.hnsw.save_index(os.path.join(path, 'hnsw.bin'))
+
+    @classmethod
+    def load(cls, path, index_type=None, nlist=16, nprobe=4, mmap=True):
+        """
+        Loads an index written by save(). The vectors are memory-mapped unless mmap is False.
+        If index_type differs from the one on disk, the approximate structure is rebuilt in memory.
+        """
+        index = cls(index_type or 'flat', nlist, nprobe)
+        meta_path = os.path.join(path, 'index.json')
+        if not os.path.exists(meta_path):
+            return index
+        with open(meta_path, 'r', encoding='utf8') as f:
+            saved = json.load(f)
+        index.index_type = index_type or saved['index_type']
+        with open(os.path.join(path, 'docs.jsonl'), 'r', encoding='utf8') as f:
+            index.docs = [json.loads(line) for line in f if line.strip()]
+        index.vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r' if mmap else None)
+
+        ivf_path = os.path.join(path, 'ivf.npz')
+        hnsw_path = os.path.join(path, 'hnsw.bin')
+        if index.index_type == saved['index_type'] == 'ivf' and os.path.exists(ivf_path):
+            ivf = np.load(ivf_path)
+            index.centroids, index.assignments = ivf['centroids'], ivf['assignments']
+        elif index.index_type == saved['index_type'] == 'hnsw' and os.path.exists(hnsw_path):
+            import hnswlib
+
+            index.hnsw = hnswlib.Index(space='ip', dim=index.vectors.shape[1])
+            index.hnsw.load_index(hnsw_path, max_elements=len(index.docs))
+        else:
+            index.build()
+        return index
@@ -1,30 +1,81 @@
 import timeit
 import argparse
-from llm.wrapper import setup_rag_pipeline
+import json
+import urllib.request
+
+
+def post_json(url, payload):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode('utf8'),
+        headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def print_result(result):
+    print(f'\nAnswer:\n {result["answer"]}')
+    print('='*50)
+
+    print(f"Time to retrieve context: {result['retrieval_seconds']}")
+    print(f"Time to generate answer: {result['generation_seconds']}")
+    print(f"Time to retrieve answer: {result['total_seconds']}")
+
+
+def print_extraction(result):
+    print(f'\nFields extracted from {result["file_name"]} ({result["prompt_version"]}):')
+    print(json.dumps(result['fields'], indent=2))
+    print('='*50)
+
+    cached = ' (cached)' if result['retrieval_cached'] else ''
+    print(f"Time to retrieve context: {result['retrieval_seconds']}{cached}")
+    print(f"Time to generate fields: {result['generation_seconds']}")
+    print(f"Time to extract invoice: {result['total_seconds']}")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('input',
                         type=str,
-                        default='What is the invoice number value?',
-                        help='Enter the query to pass into the LLM')
+                        nargs='+',
+                        default=['What is the invoice number value?'],
+                        help='Enter the query to pass into the LLM; several queries are answered in one pass')
+    parser.add_argument('--url',
+                        type=str,
+                        default=None,
+                        help='Send the queries to a running server.py (e.g. http://127.0.0.1:8008) '
+                             'instead of building the pipeline in this process')
+    parser.add_argument('--top-k', type=int, default=None)
+    parser.add_argument('--extract',
+                        action='store_true',
+                        help='Treat the inputs as ingested PDF file names and extract every '
+                             'invoice field of each in a single generation')
     args = parser.parse_args()
 
-    start = timeit.default_timer()
-    rag_pipeline = setup_rag_pipeline()
-
-    json_response = rag_pipeline.run(query=args.input, params={"Retriever": {"top_k": 5}})
+    if args.url:
+        if args.extract:
+            response = post_json(args.url.rstrip('/') + '/extract', {'file_names': args.input})
+        else:
+            response = post_json(args.url.rstrip('/') + '/batch', {'queries': args.input, 'top_k': args.top_k})
+        results = response['results']
+    else:
+        from llm.wrapper import setup_rag_pipeline, run_query
 
-    answers = json_response['answers']
-    answer = 'No answer found'
-    for ans in answers:
-        answer = ans.answer
-        break
+        start = timeit.default_timer()
+        rag_pipeline = setup_rag_pipeline()
+        print(f"Time to set up pipeline: {timeit.default_timer() - start}")
 
-    end = timeit.default_timer()
+        if args.extract:
+            from llm.extract_fields import FieldExtractor
 
-    print(f'\nAnswer:\n {answer}')
-    print('='*50)
+            extractor = FieldExtractor(rag_pipeline, top_k=args.top_k)
+            results = [extractor.extract(file_name) for file_name in args.input]
+        else:
+            results = [run_query(rag_pipeline, query, args.top_k) for query in args.input]
 
-    print(f"Time to retrieve answer: {end - start}")
\ No newline at end of file
+    for result in results:
+        if args.extract:
+            print_extraction(result)
+        else:
+            print_result(result)
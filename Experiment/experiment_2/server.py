@@ -0,0 +1,110 @@
+import argparse
+import json
+import threading
+import timeit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm.wrapper import setup_rag_pipeline, run_query, cfg
+from llm.extract_fields import FieldExtractor
+
+
+class QueryService:
+    """
+    Builds the RAG pipeline once and answers queries against it for the life of the process.
+    """
+
+    def __init__(self):
+        start = timeit.default_timer()
+        self.pipeline = setup_rag_pipeline()
+        self.extractor = FieldExtractor(self.pipeline)
+        self.setup_seconds = timeit.default_timer() - start
+        # A single llama.cpp context cannot run two generations at once
+        self.lock = threading.Lock()
+        self.queries_served = 0
+
+    def query(self, query, top_k=None):
+        with self.lock:
+            result = run_query(self.pipeline, query, top_k)
+            self.queries_served += 1
+        return result
+
+    def batch(self, queries, top_k=None):
+        # Holds the model for the whole batch so one invoice's field questions run back to back
+        start = timeit.default_timer()
+        with self.lock:
+            results = [run_query(self.pipeline, query, top_k) for query in queries]
+            self.queries_served += len(results)
+        return {'results': results, 'total_seconds': timeit.default_timer() - start}
+
+    def extract(self, file_names):
+        # One retrieval and one generation per invoice, whatever the number of fields
+        start = timeit.default_timer()
+        with self.lock:
+            results = [self.extractor.extract(file_name) for file_name in file_names]
+            self.queries_served += len(results)
+        return {'results': results, 'total_seconds': timeit.default_timer() - start}
+
+    def health(self):
+        return {'setup_seconds': self.setup_seconds, 'queries_served': self.queries_served}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, self.service.health())
+        else:
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send_json(400, {'error': f'Invalid JSON body: {e}'})
+            return
+
+        top_k = payload.get('top_k')
+        try:
+            if self.path == '/query' and payload.get('query'):
+                self._send_json(200, self.service.query(payload['query'], top_k))
+            elif self.path == '/batch' and payload.get('queries'):
+                self._send_json(200, self.service.batch(payload['queries'], top_k))
+            elif self.path == '/extract' and payload.get('file_names'):
+                self._send_json(200, self.service.extract(payload['file_names']))
+            else:
+                self._send_json(400, {'error': 'POST /query needs "query", POST /batch needs "queries", '
+                                               'POST /extract needs "file_names"'})
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+
+
+def serve(host, port):
+    QueryHandler.service = QueryService()
+    print(f"Pipeline ready in {QueryHandler.service.setup_seconds:.2f} seconds")
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    print(f"Serving RAG queries on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default=cfg.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=cfg.SERVER_PORT)
+    args = parser.parse_args()
+
+    serve(args.host, args.port)
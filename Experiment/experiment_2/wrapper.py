@@ -1,10 +1,16 @@
 
 from haystack.document_stores.weaviate import WeaviateDocumentStore
 from haystack.nodes import (AnswerParser, PromptTemplate, EmbeddingRetriever, PromptNode)
+from haystack.nodes.base import BaseComponent
 from haystack.pipelines import Pipeline
+from haystack.schema import Document
 from llm.prompts import prompt_template
 from llm.llm import setup_llm
+from llm.embeddings import load_embedding_model
+from llm.local_index import LocalVectorIndex
 import box
+import os
+import timeit
 import yaml
 
 # Import config vars
@@ -12,6 +18,63 @@ with open('config.yml', 'r', encoding='utf8') as ymlfile:
     cfg = box.Box(yaml.safe_load(ymlfile))
 
 
+class LocalIndexRetriever(BaseComponent):
+    """
+    Retriever node that serves top_k search from a LocalVectorIndex in-process,
+    so queries need neither a Weaviate server nor a network hop.
+    """
+    outgoing_edges = 1
+
+    def __init__(self, index, embedding_model, top_k=5):
+        super().__init__()
+        self.index = index
+        self.embedding_model = embedding_model
+        self.top_k = top_k
+
+    def retrieve(self, query, top_k=None, filters=None):
+        query_embedding = self.embedding_model.encode([query], convert_to_numpy=True)[0]
+        return [
+            Document(id=doc['id'], content=doc['content'], meta=doc['meta'], score=score)
+            for doc, score in self.index.search(query_embedding, top_k or self.top_k, filters)
+        ]
+
+    def run(self, query, top_k=None):
+        return {"documents": self.retrieve(query, top_k)}, "output_1"
+
+    def run_batch(self, queries, top_k=None):
+        return {"documents": [self.retrieve(query, top_k) for query in queries]}, "output_1"
+
+
+def load_local_index():
+    return LocalVectorIndex.load(
+        cfg.LOCAL_INDEX_PATH,
+        index_type=cfg.LOCAL_INDEX_TYPE,
+        nlist=cfg.LOCAL_INDEX_NLIST,
+        nprobe=cfg.LOCAL_INDEX_NPROBE
+    )
+
+
+def setup_document_store():
+    """
+    Returns the Weaviate document store, or None when queries should be served
+    from the local index (VECTOR_BACKEND: 'local', or Weaviate is unreachable
+    and a local index has been ingested).
+    """
+    if cfg.VECTOR_BACKEND == 'local':
+        return None
+    try:
+        return WeaviateDocumentStore(
+            host=cfg.WEAVIATE_HOST,
+            port=cfg.WEAVIATE_PORT,
+            embedding_dim=cfg.WEAVIATE_EMBEDDING_DIM
+        )
+    except Exception as e:
+        if not os.path.exists(os.path.join(cfg.LOCAL_INDEX_PATH, 'index.json')):
+            raise
+        print(f"Weaviate unavailable ({e}), falling back to the local vector index.")
+        return None
+
+
 def setup_prompt():
     return PromptTemplate(prompt=prompt_template, output_parser=AnswerParser())
 
@@ -25,20 +88,22 @@ def setup_retriever(model, prompt, document_store):
         default_prompt_template=prompt
     )
 
-    retriever = EmbeddingRetriever(
-        document_store=document_store,
-        embedding_model=cfg.EMBEDDINGS
-    )
+    if document_store is None:
+        retriever = LocalIndexRetriever(
+            index=load_local_index(),
+            embedding_model=load_embedding_model(cfg.EMBEDDINGS, cfg.EMBEDDING_NUM_THREADS)
+        )
+    else:
+        retriever = EmbeddingRetriever(
+            document_store=document_store,
+            embedding_model=cfg.EMBEDDINGS
+        )
 
     return prompt_node, retriever
 
 
 def setup_rag_pipeline():
-    document_store = WeaviateDocumentStore(
-        host=cfg.WEAVIATE_HOST,
-        port=cfg.WEAVIATE_PORT,
-        embedding_dim=cfg.WEAVIATE_EMBEDDING_DIM
-    )
+    document_store = setup_document_store()
 
     prompt = setup_prompt()
     model = setup_llm()
@@ -49,3 +114,34 @@ def setup_rag_pipeline():
     rag_pipeline.add_node(component=prompt_node, name="PromptNode", inputs=["Retriever"])
 
     return rag_pipeline
+
+
+def run_query(rag_pipeline, query, top_k=None):
+    """
+    Answers one query on an already built pipeline, timing retrieval and
+    generation separately so the numbers exclude pipeline setup.
+
+    Returns:
+        dict: query, answer and retrieval/generation/total seconds.
+    """
+    retriever = rag_pipeline.get_node("Retriever")
+    prompt_node = rag_pipeline.get_node("PromptNode")
+
+    start = timeit.default_timer()
+    documents = retriever.retrieve(query=query, top_k=top_k or cfg.RETRIEVER_TOP_K)
+    retrieved = timeit.default_timer()
+    output, _ = prompt_node.run(query=query, documents=documents)
+    end = timeit.default_timer()
+
+    answer = 'No answer found'
+    for ans in output.get('answers', []):
+        answer = ans.answer
+        break
+
+    return {
+        'query': query,
+        'answer': answer,
+        'retrieval_seconds': retrieved - start,
+        'generation_seconds': end - retrieved,
+        'total_seconds': end - start,
+    }
@@ -1,13 +1,11 @@
 import streamlit as st
-import pandas as pd
-import fitz 
-from pdf2image import convert_from_path
-import pytesseract
 from io import BytesIO
-import re
 import time
 from utils import extract_text_from_pdf,extract_text_from_image, safe_float, process_invoice_text
 
+# Shared with the root app; `pip install -e .` from the repository root
+from document import Document
+
 
 
 # Streamlit app 
@@ -17,19 +15,24 @@ st.write("Upload invoices (PDFs) and receive detailed extraction with accuracy s
 uploaded_files = st.file_uploader("Upload PDF files", type="pdf", accept_multiple_files=True)
 
 if uploaded_files:
+    # pandas is only needed once there is something to tabulate; the bare upload page loads faster without it
+    import pandas as pd
+
     extracted_data = []
     start_time = time.time()
 
     for pdf_file in uploaded_files:
         extraction_status = {}
+        # Read once: PyMuPDF, the renderer and the models all work on this one buffer
+        document = Document.from_upload(pdf_file)
         try:
-            extracted_text, success, message = extract_text_from_pdf(pdf_file)
+            extracted_text, success, message = extract_text_from_pdf(document)
             extraction_status['method'] = 'PyMuPDF'
             extraction_status['success'] = success
             extraction_status['message'] = message
 
             if not success:
-                extracted_text, success, message = extract_text_from_image(pdf_file)
+                extracted_text, success, message = extract_text_from_image(document)
                 extraction_status['method'] = 'OCR'
                 extraction_status['success'] = success
                 extraction_status['message'] = message
@@ -45,6 +48,8 @@ if uploaded_files:
             st.error(f"Error processing file {pdf_file.name}: {str(e)}")
             extraction_status['success'] = False
             extraction_status['message'] = str(e)
+        finally:
+            document.close()
 
     #Calculating total processing time
     processing_time = time.time() - start_time
@@ -56,14 +61,26 @@ if uploaded_files:
         st.write("Extracted Data with Accuracy Scores:")
         st.dataframe(df)
 
-        #Export to Excel
+        #Export to Parquet (typed and columnar, keeps the rate lists and score dicts as nested columns)
         output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False)
+        df.to_parquet(output, index=False, compression='zstd')
 
         st.download_button(
-            label="Download Excel file",
+            label="Download Parquet file",
             data=output.getvalue(),
-            file_name="extracted_invoices_with_accuracy.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            file_name="extracted_invoices_with_accuracy.parquet",
+            mime="application/vnd.apache.parquet"
         )
+
+        #Excel is slow and memory-hungry for large batches, so only build it on request
+        if st.checkbox("Also prepare an Excel file"):
+            output = BytesIO()
+            with pd.ExcelWriter(output, engine='openpyxl') as writer:
+                df.to_excel(writer, index=False)
+
+            st.download_button(
+                label="Download Excel file",
+                data=output.getvalue(),
+                file_name="extracted_invoices_with_accuracy.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
@@ -0,0 +1,239 @@
+"""
+CPU inference engine for LayoutLMv3 token classification on invoice pages.
+
+PyMuPDF renders the pages, Tesseract supplies the words and their boxes, pages go through the processor and the model in
+batches under torch.inference_mode(), and the model's Linear layers can be quantised to int8
+(dynamic quantisation, no calibration data needed) for roughly 2x faster CPU inference.
+
+Needs torch and transformers (optional; not in requirements.txt). The classification head of the
+base checkpoint is untrained, so the fields are only meaningful with a checkpoint fine-tuned on
+invoices with B-/I- labels such as B-INVOICE_NO; point LAYOUTLM_MODEL at it.
+
+Usage:
+    engine = LayoutLMEngine(quantize=True)
+    result = engine.extract(pdf_bytes)
+
+    python layoutlm_engine.py invoice.pdf --quantize
+"""
+import argparse
+import os
+import time
+
+# Shared with the root app; `pip install -e .` from the repository root
+from document import Document
+
+# ===========================
+# 1. Configuration
+# ===========================
+
+MODEL_NAME = os.getenv("LAYOUTLM_MODEL", "microsoft/layoutlmv3-base")
+
+# Tesseract needs ~300 dpi on scans; the model itself resizes every page to 224x224
+OCR_DPI = 300
+# Pages per forward pass; larger batches help throughput until the 512-token pages no longer fit in cache
+BATCH_SIZE = 8
+MAX_LENGTH = 512
+# Tesseract confidence (0-100) below which a "word" is usually speckle or a table rule
+MIN_WORD_CONFIDENCE = 30
+
+# Entity labels of the fine-tuned checkpoint mapped to schema fields; other labels are kept as they are
+LABEL_FIELDS = {
+    'INVOICE_NO': 'Invoice No.',
+    'INVOICE_DATE': 'Invoice Date',
+    'DATE': 'Date',
+    'QUANTITY': 'Quantity',
+    'AMOUNT': 'Amount',
+    'TOTAL': 'Total',
+    'EMAIL': 'Email',
+    'ADDRESS': 'Address',
+    'TAXABLE_VALUE': 'Taxable Value',
+    'SGST_AMOUNT': 'SGST Amount',
+    'CGST_AMOUNT': 'CGST Amount',
+    'IGST_AMOUNT': 'IGST Amount',
+    'SGST_RATE': 'SGST Rate',
+    'CGST_RATE': 'CGST Rate',
+    'IGST_RATE': 'IGST Rate',
+    'TAX_AMOUNT': 'Tax Amount',
+    'TAX_RATE': 'Tax Rate',
+    'FINAL_AMOUNT': 'Final Amount',
+    'PLACE_OF_SUPPLY': 'Place of Supply',
+    'PLACE_OF_ORIGIN': 'Place of Origin',
+    'GSTIN_SUPPLIER': 'GSTIN Supplier',
+    'GSTIN_RECIPIENT': 'GSTIN Recipient',
+}
+
+# ===========================
+# 2. Pages, Words and Boxes
+# ===========================
+
+
+def render_pages(pdf_bytes, dpi=OCR_DPI):
+    """
+    RGB page images, rendered in process by PyMuPDF from the bytes (or a memoryview of them).
+    """
+    with Document.from_bytes(pdf_bytes) as document:
+        return [image for _, image in document.render(dpi=dpi)]
+
+
+def page_words(image, min_confidence=MIN_WORD_CONFIDENCE):
+    """
+    Tesseract words of a page with their boxes scaled to LayoutLM's 0-1000 page coordinates.
+
+    Returns:
+        tuple: (words, boxes) where each box is [x0, y0, x1, y1].
+    """
+    import pytesseract
+
+    data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    width, height = image.size
+    words, boxes = [], []
+    for text, confidence, left, top, box_width, box_height in zip(
+            data['text'], data['conf'], data['left'], data['top'], data['width'], data['height']):
+        if not text.strip() or float(confidence) < min_confidence:
+            continue
+        words.append(text.strip())
+        boxes.append([
+            min(1000, max(0, int(1000 * left / width))),
+            min(1000, max(0, int(1000 * top / height))),
+            min(1000, max(0, int(1000 * (left + box_width) / width))),
+            min(1000, max(0, int(1000 * (top + box_height) / height))),
+        ])
+    return words, boxes
+
+
+def group_entities(word_labels):
+    """
+    Joins consecutive B-/I- tagged words into field values; the first occurrence of a field wins.
+
+    Parameters:
+        word_labels (list): (word, label) pairs in reading order, labels like "B-INVOICE_NO" or "O".
+
+    Returns:
+        dict: schema field -> value.
+    """
+    fields = {}
+    current, words = None, []
+
+    def close():
+        if current and words:
+            fields.setdefault(LABEL_FIELDS.get(current, current), " ".join(words))
+
+    for word, label in word_labels:
+        prefix, _, entity = label.partition('-')
+        if prefix == 'I' and entity == current:
+            words.append(word)
+            continue
+        close()
+        current, words = (entity, [word]) if prefix in ('B', 'I') else (None, [])
+    close()
+    return fields
+
+# ===========================
+# 3. Inference Engine
+# ===========================
+
+
+class LayoutLMEngine:
+    """
+    LayoutLMv3 token classification with batched, gradient-free CPU inference.
+
+    Parameters:
+        model_name (str): Fine-tuned LayoutLMv3 token classification checkpoint.
+        quantize (bool): Dynamically quantise the Linear layers to int8.
+        batch_size (int): Pages per forward pass.
+        num_threads (int, optional): torch intra-op threads; defaults to torch's choice (all cores).
+    """
+
+    def __init__(self, model_name=MODEL_NAME, quantize=False, batch_size=BATCH_SIZE, num_threads=None):
+        import torch
+        from transformers import AutoProcessor, LayoutLMv3ForTokenClassification
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.torch = torch
+        self.batch_size = batch_size
+        # Words and boxes come from page_words, so the processor's own OCR pass is switched off
+        self.processor = AutoProcessor.from_pretrained(model_name, apply_ocr=False)
+        model = LayoutLMv3ForTokenClassification.from_pretrained(model_name).eval()
+        if quantize:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+        self.id2label = model.config.id2label
+
+    def fields(self):
+        """
+        Schema fields this checkpoint can tag.
+        """
+        entities = {label.partition('-')[2] for label in self.id2label.values() if label != 'O'}
+        return sorted(LABEL_FIELDS.get(entity, entity) for entity in entities if entity)
+
+    def predict(self, pages):
+        """
+        Labels every word of every page.
+
+        Parameters:
+            pages (list): (image, words, boxes) per page, from any number of documents.
+
+        Returns:
+            list: Per page, (word, label) pairs in reading order; words beyond MAX_LENGTH tokens are dropped.
+        """
+        results = [[] for _ in pages]
+        # Blank pages have nothing to tag and would make the processor fail
+        runnable = [index for index, (_, words, _) in enumerate(pages) if words]
+        for start in range(0, len(runnable), self.batch_size):
+            chunk = runnable[start:start + self.batch_size]
+            encoding = self.processor(
+                [pages[index][0] for index in chunk],
+                [pages[index][1] for index in chunk],
+                boxes=[pages[index][2] for index in chunk],
+                truncation=True, padding='longest', max_length=MAX_LENGTH, return_tensors='pt')
+            with self.torch.inference_mode():
+                predictions = self.model(**encoding).logits.argmax(-1).tolist()
+            for row, index in enumerate(chunk):
+                words = pages[index][1]
+                seen = set()
+                # A word split into several tokens is labelled by its first token
+                for token, word_id in enumerate(encoding.word_ids(batch_index=row)):
+                    if word_id is None or word_id in seen:
+                        continue
+                    seen.add(word_id)
+                    results[index].append((words[word_id], self.id2label[predictions[row][token]]))
+        return results
+
+    def extract(self, pdf_bytes):
+        """
+        Renders, OCRs and tags one PDF.
+
+        Returns:
+            dict: "fields" (schema field -> value), "text" (OCR words page by page),
+                "pages" and "seconds".
+        """
+        start = time.perf_counter()
+        pages = [(image, *page_words(image)) for image in render_pages(pdf_bytes)]
+        word_labels = [pair for page in self.predict(pages) for pair in page]
+        return {
+            'fields': group_entities(word_labels),
+            'text': "\n".join(" ".join(words) for _, words, _ in pages),
+            'pages': len(pages),
+            'seconds': time.perf_counter() - start,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tag invoice fields in PDFs with LayoutLMv3 on CPU.")
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--quantize', action='store_true', help='int8 dynamic quantisation of Linear layers')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    engine = LayoutLMEngine(args.model, args.quantize, args.batch_size, args.threads)
+    total_pages, total_seconds = 0, 0.0
+    for path in args.paths:
+        with open(path, 'rb') as f:
+            result = engine.extract(f.read())
+        total_pages += result['pages']
+        total_seconds += result['seconds']
+        print(f"{os.path.basename(path)}: {result['fields']}")
+    print(f"\n{total_pages} pages in {total_seconds:.2f}s ({total_pages / total_seconds:.2f} pages/s)")
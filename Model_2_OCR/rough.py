@@ -1,58 +1,49 @@
 import streamlit as st
-import pandas as pd
-import fitz  # PyMuPDF
-from pdf2image import convert_from_path
-import pytesseract
 from io import BytesIO
 import re
 import time
-from transformers import LayoutLMv3ForTokenClassification, LayoutLMv3Tokenizer, LayoutLMv3FeatureExtractor
-import torch
-from PIL import Image
 
-# Load the pre-trained LayoutLM model and tokenizer
-tokenizer = LayoutLMv3Tokenizer.from_pretrained("microsoft/layoutlmv3-base")
-model = LayoutLMv3ForTokenClassification.from_pretrained("microsoft/layoutlmv3-base")
+# Shared with the root app; `pip install -e .` from the repository root
+from document import Document
+
+# Load the LayoutLM engine once per server process, and only when a scanned PDF first needs it;
+# torch and transformers alone take seconds to import
+@st.cache_resource
+def load_layoutlm():
+    from layoutlm_engine import LayoutLMEngine
+
+    return LayoutLMEngine(quantize=True)
 
 # Function to extract text from PDF using PyMuPDF
-def extract_text_from_pdf(pdf_file):
+def extract_text_from_pdf(document):
     try:
-        doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
         text = ""
-        for page in doc:
+        for page in document.fitz():
             text += page.get_text()
         return text, True, "Text extracted successfully."
     except Exception as e:
         return "", False, f"Error extracting text using PyMuPDF: {str(e)}"
 
 # Function to apply OCR using Tesseract for scanned PDFs
-def extract_text_from_image(pdf_file):
+def extract_text_from_image(document):
     try:
-        images = convert_from_path(pdf_file, dpi=300)
+        import pytesseract
+
         text = ""
-        for img in images:
+        for _, img in document.render(dpi=300):
             text += pytesseract.image_to_string(img)
         return text, True, "OCR applied successfully."
     except Exception as e:
         return "", False, f"Error extracting text using OCR: {str(e)}"
 
 # New function to extract structured data using LayoutLMv3 model
-def extract_data_with_layoutlm(pdf_file):
+def extract_data_with_layoutlm(document):
     try:
-        images = convert_from_path(pdf_file, dpi=300)
-        all_text = ""
-
-        for img in images:
-            img = img.convert("RGB")  # Convert to RGB format for LayoutLM
-            pixel_values = LayoutLMv3FeatureExtractor().encode_plus(img, return_tensors="pt")['pixel_values']
-            outputs = model(pixel_values=pixel_values)
-            logits = outputs.logits
-            tokens = tokenizer.convert_ids_to_tokens(logits.argmax(dim=-1).squeeze().tolist())
-            all_text += " ".join(tokens)
-
-        return all_text, True, "Text extracted using LayoutLMv3."
+        result = load_layoutlm().extract(document.buffer)
+        message = f"Text extracted using LayoutLMv3 ({result['pages'] / result['seconds']:.2f} pages/s)."
+        return result['text'], result['fields'], True, message
     except Exception as e:
-        return "", False, f"Error extracting text using LayoutLM: {str(e)}"
+        return "", {}, False, f"Error extracting text using LayoutLM: {str(e)}"
 
 # Function to process extracted text into desired format (as before)
 def safe_float(value):
@@ -152,22 +143,29 @@ st.write("Upload invoices (PDFs) and receive detailed extraction with accuracy s
 uploaded_files = st.file_uploader("Upload PDF files", type="pdf", accept_multiple_files=True)
 
 if uploaded_files:
+    # pandas is only needed once there is something to tabulate; the bare upload page loads faster without it
+    import pandas as pd
+
     extracted_data = []
     start_time = time.time()
 
     for pdf_file in uploaded_files:
         extraction_status = {}
+        # Read once: PyMuPDF, the renderer and the models all work on this one buffer
+        document = Document.from_upload(pdf_file)
 
         try:
             # First, try to extract text using PyMuPDF
-            extracted_text, success, message = extract_text_from_pdf(pdf_file)
+            extracted_text, success, message = extract_text_from_pdf(document)
             extraction_status['method'] = 'PyMuPDF'
             extraction_status['success'] = success
             extraction_status['message'] = message
 
-            if not success:
+            layout_fields = {}
+            # PyMuPDF "succeeds" with no text on scans, so an empty result also goes to the layout model
+            if not success or not extracted_text.strip():
                 # Try LayoutLM deep learning model for OCR
-                extracted_text, success, message = extract_data_with_layoutlm(pdf_file)
+                extracted_text, layout_fields, success, message = extract_data_with_layoutlm(document)
                 extraction_status['method'] = 'LayoutLMv3'
                 extraction_status['success'] = success
                 extraction_status['message'] = message
@@ -176,6 +174,7 @@ if uploaded_files:
                 # Process extracted text into structured data
                 invoice_data, accuracy_scores = process_invoice_text(extracted_text)
                 invoice_data['extraction_status'] = extraction_status
+                invoice_data['layout_fields'] = layout_fields
                 invoice_data['accuracy_scores'] = accuracy_scores
                 extracted_data.append(invoice_data)
             else:
@@ -185,6 +184,8 @@ if uploaded_files:
             st.error(f"Error processing file {pdf_file.name}: {str(e)}")
             extraction_status['success'] = False
             extraction_status['message'] = str(e)
+        finally:
+            document.close()
 
     # Calculate total processing time
     processing_time = time.time() - start_time
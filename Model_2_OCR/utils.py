@@ -1,44 +1,29 @@
-import streamlit as st
-import pandas as pd
-import fitz  
-from pdf2image import convert_from_path
-import pytesseract
-from io import BytesIO
 import re
-import time
 
 
-#to extract text from PDF using PyMuPDF
-def extract_text_from_pdf(pdf_file):
+#to extract text from PDF using PyMuPDF; documents are document.Document objects
+def extract_text_from_pdf(document):
     try:
-        doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
         text = ""
-        for page in doc:
+        for page in document.fitz():
             text += page.get_text()
         return text, True, "Text extracted successfully."
     except Exception as e:
         return "", False, f"Error extracting text using PyMuPDF: {str(e)}"
 
 #to apply OCR using Tesseract for scanned PDFs
-def extract_text_from_image(pdf_file):
+def extract_text_from_image(document):
     try:
-        images = convert_from_path(pdf_file, dpi=300)
+        # Only scanned PDFs need Tesseract
+        import pytesseract
+
         text = ""
-        for img in images:
+        for _, img in document.render(dpi=300):
             text += pytesseract.image_to_string(img)
         return text, True, "OCR applied successfully."
     except Exception as e:
         return "", False, f"Error extracting text using OCR: {str(e)}"
 
-#to process extracted text into desired format
-def safe_float(value):
-    try:
-        return float(value.replace(',', '').replace('₹', '').strip())
-    except ValueError:
-        return 0.0
-
-import re
-
 def safe_float(value):
     """Convert string to float safely by removing commas and ₹ symbols."""
     try:
@@ -46,6 +31,7 @@ def safe_float(value):
     except ValueError:
         return 0.0
 
+#to process extracted text into desired format
 def process_invoice_text(text):
     # Initialize variables and their confidence levels
     accuracy_scores = {}
@@ -159,9 +145,14 @@ def process_invoice_text(text):
     if discount_match:
         total_discount = safe_float(discount_match.group(1))
 
-    # Calculating total tax amount
+    # Calculating total tax amount, cross-checked against the totals instead of trusted blindly:
+    # taxable + taxes - discount = final, within ₹1 of rounding as in reconcile.total_reconciles
     tax_amount = sgst_amount + cgst_amount + igst_amount
-    accuracy_scores['tax_amount'] = 1
+    reconciles = abs(taxable_value + tax_amount - total_discount - final_amount) <= 1
+    accuracy_scores['tax_amount'] = 1 if reconciles else 0.5
+    if cgst_matches and sgst_matches and abs(cgst_amount - sgst_amount) > 1:
+        # Intra-state invoices charge CGST and SGST in equal halves
+        accuracy_scores['cgst_amount'] = accuracy_scores['sgst_amount'] = 0.5
 
     # Calculate overall trust score (average of individual scores)
     overall_trust_score = sum(accuracy_scores.values()) / len(accuracy_scores)
@@ -1,17 +1,20 @@
 import os
-import requests
 import json
-import pandas as pd
 import re
 import logging
 import time
-from pypdf import PdfReader
-from pdf2image import convert_from_bytes
-import pytesseract
 import streamlit as st
 from dotenv import load_dotenv
-from PIL import Image
-from io import BytesIO
+from instrumentation import span, recorder, write_prometheus
+from jobs import JobQueue, batch_finished
+from pipeline import Pipeline, Stage, extract_page_text, ocr_missing_pages, close_document
+from document import Document
+from config import INVOICE_FIELDS
+from prompts import get_prompt
+
+# Streamlit re-runs this script on every interaction, and the upload page needs none of the
+# extraction backends (pypdf, PyMuPDF/Tesseract, requests) or the pandas/Arrow stages, so those
+# are imported where they are first used. `python -m benchmarks.import_budget` keeps this honest.
 
 # ===========================
 # 1. Configuration and Setup
@@ -30,6 +33,11 @@ load_dotenv()
 # Set API key and endpoint
 GPT4V_KEY = os.getenv("GPT4V_KEY")
 GPT4V_ENDPOINT = os.getenv("GPT4V_ENDPOINT")
+# The deployment behind the endpoint, priced from config.MODEL_PRICES in the cost ledger
+GPT4V_MODEL = os.getenv("GPT4V_MODEL", "gpt-4")
+# A cheaper deployment a batch switches to as it nears its budget (optional)
+GPT4V_FALLBACK_ENDPOINT = os.getenv("GPT4V_FALLBACK_ENDPOINT")
+GPT4V_FALLBACK_MODEL = os.getenv("GPT4V_FALLBACK_MODEL", "gpt-4o-mini")
 
 if not GPT4V_KEY or not GPT4V_ENDPOINT:
     st.error("API key or endpoint not found in the environment variables.")
@@ -41,6 +49,29 @@ headers = {
     "api-key": GPT4V_KEY,
 }
 
+# Prometheus text file refreshed after every batch (per-stage latency histograms)
+METRICS_FILE = "invoice_metrics.prom"
+
+# Extracted records are streamed here as each document finishes; CSV and Excel are converted from it on request
+OUTPUT_FILE = "extracted_invoice_data.parquet"
+
+# prompts.yaml entry used for extraction; its id is stamped on every record as "Prompt Version"
+EXTRACTION_PROMPT = "invoice_extraction"
+
+# Invoices whose amounts or GSTIN fail the consistency checks are sent to the model once more
+REEXTRACT_INCONSISTENT = True
+EXPORT_FORMATS = {
+    "CSV": ("extracted_invoice_data.csv", "text/csv"),
+    "Excel": ("extracted_invoice_data.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+# How often the page re-checks a background batch while workers are still running
+JOB_POLL_SECONDS = 2
+
+# Per-batch spend limit in USD and token rate limit; unset means no limit
+BATCH_BUDGET_USD = float(os.getenv("BATCH_BUDGET_USD") or 0) or None
+MAX_TOKENS_PER_MINUTE = int(os.getenv("MAX_TOKENS_PER_MINUTE") or 0) or None
+
 
 
 # ==============================
@@ -57,104 +88,151 @@ def get_pdf_text(pdf_doc):
     Returns:
         str: The extracted text from the PDF.
     """
-    text = ""
     try:
-        pdf_reader = PdfReader(pdf_doc)
-        num_pages = len(pdf_reader.pages)
-        for page_number, page in enumerate(pdf_reader.pages, start=1):
-            extracted_text = page.extract_text()
-            if extracted_text and len(extracted_text.strip()) > 50:  # Threshold for text extraction
-                text += extracted_text + "\n"
-                logging.info(f"Text extracted from page {page_number} using PdfReader.")
-            else:
-                # If text extraction is insufficient, use OCR
-                logging.info(f"Insufficient text on page {page_number}. Applying OCR.")
-                pdf_doc.seek(0)  # Reset file pointer to read bytes
-                pdf_bytes = pdf_doc.read()
-                images = convert_from_bytes(pdf_bytes, first_page=page_number, last_page=page_number)
-                for image in images:
-                    ocr_text = pytesseract.image_to_string(image, config='--psm 6')  # Assume a single uniform block of text
-                    if ocr_text and len(ocr_text.strip()) > 10:  # Threshold for OCR text
-                        text += ocr_text + "\n"
-                        logging.info(f"OCR text extracted from page {page_number}.")
+        with Document.from_upload(pdf_doc) as document:
+            item = {'name': document.name, 'document': document}
+            extract_page_text(item)
+            ocr_missing_pages(item)
     except Exception as e:
+        # Logged only: this runs outside the Streamlit script thread, where st.* calls are dropped
         logging.error(f"Error extracting text from PDF: {e}")
-        st.error(f"Error extracting text from PDF: {e}")
-    return text
+        return ""
+    return item['raw_text']
 
-def call_openai_api(pages_data):
+def budget_guard(cost_batch=None):
+    """
+    The budget guard for a batch's API calls: the configured deployment, then the fallback one.
+    
+    Parameters:
+        cost_batch (str, optional): Ledger batch the calls are charged to; None for unbatched calls,
+            which are recorded but never limited.
+    
+    Returns:
+        BudgetGuard: The guard, recording into the shared cost ledger.
+    """
+    from ledger import BudgetGuard, shared_ledger
+
+    tiers = [(GPT4V_MODEL, GPT4V_ENDPOINT)]
+    if GPT4V_FALLBACK_ENDPOINT:
+        tiers.append((GPT4V_FALLBACK_MODEL, GPT4V_FALLBACK_ENDPOINT))
+    if cost_batch is None:
+        return BudgetGuard(shared_ledger(), None, tiers)
+    return BudgetGuard(shared_ledger(), cost_batch, tiers, max_cost=BATCH_BUDGET_USD,
+                       max_tokens_per_minute=MAX_TOKENS_PER_MINUTE)
+
+def call_openai_api(pages_data, doc=None, feedback=None, stage="extract_fields", guard=None, retry=0, deadline=None,
+                    notices=None):
     """
     Calls the OpenAI GPT-4 API to extract invoice data in JSON format.
     
     Parameters:
         pages_data (str): The extracted text from the PDF.
+        doc (str, optional): Document name used to label the timing spans.
+        feedback (list, optional): Consistency checks a previous extraction failed, passed back to the model.
+        stage (str): Stage the call is charged to in the cost ledger.
+        guard (BudgetGuard, optional): Picks the deployment and records the call; see budget_guard().
+        retry (int): Attempt number after rate limiting, recorded in the ledger.
+        deadline (float, optional): time.monotonic() by which the document must be done; bounds
+            the request timeout and the rate-limit waits.
+        notices (list, optional): Collects ("error" or "warning", message) pairs for the caller to
+            show; this runs on pipeline worker threads, where Streamlit calls are dropped.
     
     Returns:
         str or None: The raw extracted data from the API if successful; otherwise, None.
+    
+    Raises:
+        BudgetExceeded: The batch has spent its budget; no call was made.
+        TimeoutError: The document's time budget ran out; no call was made.
     """
-    prompt_template = '''Extract the following fields from the invoice data: 
-- Invoice No.
-- Quantity
-- Date
-- Amount
-- Total
-- Email
-- Address
-- Taxable Value
-- SGST Amount
-- CGST Amount
-- IGST Amount
-- SGST Rate
-- CGST Rate
-- IGST Rate
-- Tax Amount
-- Tax Rate
-- Final Amount
-- Invoice Date
-- Place of Supply
-- Place of Origin
-- GSTIN Supplier
-- GSTIN Recipient
-
-**Provide the output strictly in valid JSON format with no additional text, explanations, or comments. 
-Ensure all keys are correctly spelled and correspond to the field names above. 
-Do not include any trailing commas or syntax errors.**
-
-Here is the invoice data:
-{pages}
-'''
-    prompt = prompt_template.format(pages=pages_data) #placeholders are "pages"
-
-    data = {
-        "messages": [
-            {"role": "system", "content": "You are a helpful and accurate assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        "max_tokens": 1000,  #for  detailed extraction , increase 
-        "temperature": 0.3    #lower temperature for more deterministic output
-    }
+    import requests
+    from concurrency import shared_hedge_policy, shared_limiter
+
+    def remaining():
+        return None if deadline is None else deadline - time.monotonic()
+
+    if deadline is not None and remaining() <= 0:
+        raise TimeoutError(f"{doc} ran out of its {DOCUMENT_BUDGET_SECONDS}s budget.")
+
+    guard = guard or budget_guard()
+    # Waits out the tokens-per-minute limit for no longer than the document has left
+    model, endpoint = guard.tier(deadline)
+    limiter = shared_limiter("llm_requests", LLM_WORKERS, maximum=LLM_MAX_IN_FLIGHT)
+
+    with span("prompt_build", doc=doc) as s:
+        # The compiled prompt's static prefix comes first, so the provider can cache it across invoices
+        prompt = get_prompt(EXTRACTION_PROMPT)
+        extra = ""
+        if feedback:
+            extra = ("\nA previous extraction of this invoice failed these consistency checks: "
+                     f"{', '.join(feedback)}. Re-read the amounts, tax lines and GSTINs carefully.\n")
+        messages = prompt.messages(pages_data, extra)
+
+        data = {
+            "messages": messages,
+            "max_tokens": 1000,  #for  detailed extraction , increase 
+            "temperature": 0.3    #lower temperature for more deterministic output
+        }
+        s.set(bytes=len(messages[-1]["content"].encode('utf-8')), prefix_tokens=prompt.prefix_tokens)
+
+    def send(hedge):
+        # Hedges go out only when the adaptive limit has room, so they never push past it;
+        # a first attempt waits for a slot for no longer than the document has left
+        slot = limiter.try_acquire() if hedge else limiter.acquire(timeout=remaining())
+        if slot is None:
+            if hedge:
+                return None
+            raise TimeoutError(f"{doc} ran out of its {DOCUMENT_BUDGET_SECONDS}s budget waiting for a request slot.")
+        read_timeout = REQUEST_TIMEOUT if deadline is None else max(min(REQUEST_TIMEOUT, remaining()), 0.001)
+        call_stage = f"{stage}_hedge" if hedge else stage
+        start = time.perf_counter()
+        try:
+            with span("llm_call", doc=doc, model=model, hedge=int(hedge)) as s:
+                response = requests.post(endpoint, headers=headers, json=data, timeout=(CONNECT_TIMEOUT, read_timeout))
+                if response.status_code in PUSH_BACK_STATUSES:
+                    slot.pushed_back()
+                s.set(bytes=len(response.content))
+                usage = response.json().get("usage") if response.status_code == 200 else None
+                if usage:
+                    s.set(prompt_tokens=usage.get("prompt_tokens", 0),
+                          completion_tokens=usage.get("completion_tokens", 0),
+                          cached_tokens=(usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0))
+        except Exception:
+            guard.record(doc, call_stage, model, None, time.perf_counter() - start, retry, 'error')
+            raise
+        finally:
+            limiter.release(slot, time.perf_counter() - start)
+        status = {200: 'ok', 429: 'rate_limited'}.get(response.status_code, 'error')
+        guard.record(doc, call_stage, model, usage, time.perf_counter() - start, retry, status)
+        # A hedge that did not get an answer leaves the first attempt to decide
+        return response if response.status_code == 200 or not hedge else None
 
     try:
-        response = requests.post(GPT4V_ENDPOINT, headers=headers, json=data)
+        response = shared_hedge_policy("llm_requests", HEDGE_FRACTION, max_workers=2 * LLM_MAX_IN_FLIGHT).run(send)
         if response.status_code == 200:
             response_json = response.json()
             llm_extracted_data = response_json.get("choices", [])[0].get("message", {}).get("content", "")
             logging.info(f"Raw API response for data extraction: {llm_extracted_data}")
             return llm_extracted_data
-        elif response.status_code == 429:
-            # Rate limit exceeded
-            logging.warning("Rate limit exceeded. Retrying after 10 seconds...")
-            st.warning("Rate limit exceeded. Retrying after 10 seconds...")
-            time.sleep(10)  # Wait for 10 seconds before retrying
-            return call_openai_api(pages_data)
-        else:
-            logging.error(f"API call failed: {response.status_code} - {response.text}")
-            st.error(f"Error during API call: {response.status_code} - {response.text}")
-            return None
+    except TimeoutError:
+        raise
     except Exception as e:
         logging.error(f"Exception during API call: {e}")
-        st.error(f"An error occurred during API call: {e}")
+        if notices is not None:
+            notices.append(("error", f"An error occurred during API call: {e}"))
         return None
+    if response.status_code == 429:
+        # Rate limit exceeded; waited out only if the document has the time
+        if deadline is not None and deadline - time.monotonic() < 10:
+            raise TimeoutError(f"{doc} ran out of its {DOCUMENT_BUDGET_SECONDS}s budget while rate limited.")
+        logging.warning("Rate limit exceeded. Retrying after 10 seconds...")
+        if notices is not None:
+            notices.append(("warning", "Rate limit exceeded. Retrying after 10 seconds..."))
+        time.sleep(10)  # Wait for 10 seconds before retrying
+        return call_openai_api(pages_data, doc, feedback, stage, guard, retry + 1, deadline, notices)
+    logging.error(f"API call failed: {response.status_code} - {response.text}")
+    if notices is not None:
+        notices.append(("error", f"Error during API call: {response.status_code} - {response.text}"))
+    return None
 
 def validate_data(field, value):
     """
@@ -208,113 +286,390 @@ def extract_json(raw_text):
     else:
         return None
 
+def reconcile_record(pages_data, data_dict, doc=None, guard=None, deadline=None, notices=None):
+    """
+    Cross-checks the extracted amounts, tax lines and GSTIN. When they do not add up, asks the
+    model once more with the failed checks and keeps whichever answer is more consistent.
+    
+    Parameters:
+        pages_data (str): The extracted text from the PDF, for the re-extraction.
+        data_dict (dict): The parsed extraction.
+        doc (str, optional): Document name used to label the timing spans.
+        guard (BudgetGuard, optional): Budget guard of the batch; a spent budget keeps the first answer.
+        deadline (float, optional): The document's time.monotonic() deadline; past it the first answer is kept.
+        notices (list, optional): Collects the re-extraction call's errors; see call_openai_api().
+    
+    Returns:
+        tuple: (data_dict, consistency score between 0 and 1, list of failed check names)
+    """
+    import pandas as pd
+    from ledger import BudgetExceeded
+    from reconcile import reconcile_invoices, failed_checks
+
+    with span("reconcile", doc=doc):
+        checks = reconcile_invoices(pd.DataFrame([data_dict]))
+    score, failures = float(checks['confidence'].iat[0]), failed_checks(checks).iat[0]
+    if not REEXTRACT_INCONSISTENT or not checks['needs_review'].iat[0]:
+        return data_dict, score, failures
+
+    logging.info(f"{doc} failed consistency checks {failures}; re-extracting.")
+    try:
+        raw = call_openai_api(pages_data, doc, feedback=failures, stage="reextract", guard=guard, deadline=deadline,
+                              notices=notices)
+    except (BudgetExceeded, TimeoutError) as e:
+        logging.warning(f"{doc} not re-extracted: {e}")
+        return data_dict, score, failures
+    json_text = extract_json(raw) if raw else None
+    if not json_text:
+        return data_dict, score, failures
+    try:
+        retry_dict = json.loads(json_text)
+    except json.JSONDecodeError:
+        return data_dict, score, failures
+    with span("reconcile", doc=doc):
+        retry_checks = reconcile_invoices(pd.DataFrame([retry_dict]))
+    retry_score = float(retry_checks['confidence'].iat[0])
+    if retry_score > score:
+        return retry_dict, retry_score, failed_checks(retry_checks).iat[0]
+    return data_dict, score, failures
+
 # ===========================================
 # 3. Core Function to Process PDF Files
 # ===========================================
 
-def create_docs(user_pdf_list):
+# Columns of the result table: the schema fields plus the trust assessment and the prompt that produced them
+RESULT_COLUMNS = INVOICE_FIELDS + ['Confidence', 'Trust', 'Consistency Score', 'Prompt Version']
+
+
+# Documents each stage works on at once. OCR fans the pages out to a process pool; the API stages are
+# threads waiting on the network; the dedup stages each keep one SQLite connection
+TEXT_WORKERS = 2
+OCR_WORKERS = 2
+OCR_PROCESSES = os.cpu_count() or 1
+LLM_WORKERS = 4
+# API requests in flight start at LLM_WORKERS and adapt up to LLM_MAX_IN_FLIGHT (concurrency.py): they grow while
+# latency holds and halve on 429/503 or a latency spike. The API stages get enough threads to reach it
+LLM_MAX_IN_FLIGHT = 32
+# Responses that mean the provider wants fewer requests
+PUSH_BACK_STATUSES = (429, 503)
+
+# Seconds to connect and to wait for an answer; a stuck connection fails the call instead of the session
+CONNECT_TIMEOUT = 10
+REQUEST_TIMEOUT = 120
+# Seconds a document may take from entering the pipeline to its last API call; later calls are not made
+DOCUMENT_BUDGET_SECONDS = 300
+# Share of API calls that may be hedged: resent once they outlive the p95 latency, the first answer winning
+HEDGE_FRACTION = 0.05
+
+# Keys of a pipeline item that make up the result reported to the UI and stored by jobs.py
+RESULT_KEYS = ('status', 'message', 'stage', 'duplicate', 'record', 'raw_text', 'raw_response', 'failures', 'validation',
+               'notices')
+
+
+def mark_duplicate(item, stage, duplicate):
+    item['status'] = 'duplicate'
+    item['stage'] = stage
+    item['duplicate'] = duplicate
+    item['message'] = f"{duplicate['kind']} of `{duplicate['duplicate_of']}`"
+
+
+def check_file_stage(item, dedup_index):
     """
-    Processes multiple PDF files to extract invoice data and compile it into a DataFrame.
+    Stage: exact re-uploads are caught from the file hash, before any OCR. Starts the document's time budget.
+    """
+    item.setdefault('deadline', time.monotonic() + DOCUMENT_BUDGET_SECONDS)
+    if 'document' not in item:
+        item['document'] = Document.from_upload(item.pop('file'), item['name'])
+    item['sha'], duplicate = dedup_index.check_file(item['document'].buffer)
+    # The same file twice in one batch is caught here too, before either copy is registered
+    in_batch = item.get('in_batch', {})
+    if duplicate is None and item['sha'] in in_batch:
+        duplicate = {'kind': 'identical file', 'duplicate_of': in_batch[item['sha']], 'batch': dedup_index.batch_id}
+    in_batch.setdefault(item['sha'], item['name'])
+    if duplicate and item.get('resume_batch') and duplicate.get('batch') == item['resume_batch']:
+        duplicate = None
+    if item['skip_duplicates'] and duplicate:
+        mark_duplicate(item, 'before OCR', duplicate)
+
+
+def check_text_stage(item, dedup_index):
+    """
+    Stage: rescans and re-exports of a known invoice are caught from the text, before the LLM call.
+    """
+    duplicate = dedup_index.check_text(item['raw_text'], item['sha'])
+    if item['skip_duplicates'] and duplicate:
+        mark_duplicate(item, 'before LLM', duplicate)
+
+
+def extract_fields_stage(item, guard=None):
+    """
+    Stage: asks the model for the invoice fields and parses its JSON.
+    """
+    from ledger import BudgetExceeded
+
+    file_name = item['name']
+    try:
+        llm_extracted_data = call_openai_api(item['raw_text'], file_name, guard=guard, deadline=item.get('deadline'),
+                                             notices=item.setdefault('notices', []))
+    except BudgetExceeded as e:
+        logging.warning(f"Batch budget spent; {file_name} paused: {e}")
+        item['status'] = 'paused'
+        item['message'] = f"`{file_name}` not extracted: {e}"
+        return
+    except TimeoutError as e:
+        logging.error(str(e))
+        item['status'] = 'failed'
+        item['message'] = f"`{file_name}` timed out: {e}"
+        return
+    if not llm_extracted_data:
+        logging.error(f"API response failed for {file_name}.")
+        item['status'] = 'failed'
+        item['message'] = f"Failed to extract data from `{file_name}`."
+        return
+
+    # Log the raw extracted data
+    logging.info(f"Raw extracted data for {file_name}: {llm_extracted_data}")
+    item['raw_response'] = llm_extracted_data
+
+    # Extract JSON from the raw response and parse it
+    json_text = extract_json(llm_extracted_data)
+    try:
+        if not json_text:
+            raise json.JSONDecodeError("No JSON found in the API response", llm_extracted_data, 0)
+        with span("json_parse", doc=file_name, bytes=len(json_text.encode('utf-8'))):
+            item['record'] = json.loads(json_text)
+        logging.info(f"Extracted data from {file_name}: {item['record']}")
+    except json.JSONDecodeError as e:
+        logging.error(f"JSON decoding failed for {file_name}: {e}")
+        item['status'] = 'failed'
+        item['message'] = f"Error parsing extracted data from `{file_name}`: Invalid JSON."
+
+
+def validate_fields_stage(item, guard=None):
+    """
+    Stage: reconciles the amounts (re-asking the model when they do not add up), validates each
+    field and adds the confidence and trust assessment.
+    """
+    from reconcile import REVIEW_THRESHOLD
+
+    file_name = item['name']
+    data_dict, consistency, failures = reconcile_record(item['raw_text'], item['record'], file_name, guard,
+                                                        item.get('deadline'), item.setdefault('notices', []))
+
+    validation = []
+    confidence_list = []
+    with span("validation", doc=file_name):
+        for field in INVOICE_FIELDS:
+            is_valid, confidence = validate_data(field, data_dict.get(field, ""))
+            validation.append((field, is_valid))
+            confidence_list.append(confidence)
+
+    data_dict['Confidence'] = "; ".join(confidence_list)
+    data_dict['Consistency Score'] = round(consistency, 3)
+    trusted = "Low Confidence" not in confidence_list and consistency >= REVIEW_THRESHOLD
+    data_dict['Trust'] = "Trusted" if trusted else "Untrusted"
+    data_dict['Source File'] = file_name
+    data_dict['Prompt Version'] = get_prompt(EXTRACTION_PROMPT).id
+    item.update(record=data_dict, failures=failures, validation=validation)
+
+
+def register_stage(item, dedup_index):
+    """
+    Stage: a different file carrying an invoice we already have is not exported twice; everything
+    else is registered so later uploads can be matched against it.
+    """
+    duplicate = dedup_index.check_invoice(item['record'], item['sha'])
+    if item['skip_duplicates'] and duplicate:
+        dedup_index.add(item['sha'], item['name'], text=item['raw_text'])
+        mark_duplicate(item, 'before export', duplicate)
+        return
+    dedup_index.add(item['sha'], item['name'], text=item['raw_text'], record=item['record'])
+    item['status'] = 'extracted'
+    item['message'] = f"Extraction successful for `{item['name']}`."
+
+
+def document_pipeline(batch_id=None, cost_batch=None):
+    """
+    The extraction pipeline: dedup, text layer, OCR, dedup, LLM, validation, registration.
     
     Parameters:
-        user_pdf_list (list): List of uploaded PDF files.
+        batch_id (str, optional): Batch recorded in the dedup index for the files this run registers.
+        cost_batch (str, optional): Ledger batch the API calls are charged to and budgeted against;
+            defaults to batch_id.
     
     Returns:
-        pd.DataFrame: DataFrame containing all extracted invoice data.
+        Pipeline: Run it with items {"name", "file", "skip_duplicates"} (see Pipeline.run); each
+            item's document is closed by the last stage.
     """
-    # Initialize DataFrame with additional columns for confidence and trust
-    df = pd.DataFrame(columns=[
-        'Invoice No.', 'Quantity', 'Date', 'Amount', 'Total',
-        'Email', 'Address', 'Taxable Value', 'SGST Amount',
-        'CGST Amount', 'IGST Amount', 'SGST Rate', 'CGST Rate',
-        'IGST Rate', 'Tax Amount', 'Tax Rate', 'Final Amount',
-        'Invoice Date', 'Place of Supply', 'Place of Origin',
-        'GSTIN Supplier', 'GSTIN Recipient',
-        'Confidence', 'Trust'
+    from dedup import DedupIndex
+
+    def open_index():
+        return DedupIndex(batch_id=batch_id)
+
+    def close_index(dedup_index):
+        dedup_index.close()
+
+    guard = budget_guard(cost_batch or batch_id)
+
+    return Pipeline([
+        Stage("dedup_file", check_file_stage, setup=open_index, teardown=close_index),
+        Stage("pdf_text", extract_page_text, workers=TEXT_WORKERS),
+        Stage("ocr_pages", ocr_missing_pages, workers=OCR_WORKERS, processes=OCR_PROCESSES),
+        Stage("dedup_text", check_text_stage, setup=open_index, teardown=close_index),
+        Stage("extract_fields", extract_fields_stage, workers=LLM_MAX_IN_FLIGHT, setup=lambda: guard),
+        Stage("validate_fields", validate_fields_stage, workers=LLM_MAX_IN_FLIGHT, setup=lambda: guard),
+        Stage("register", register_stage, setup=open_index, teardown=close_index),
+        Stage("close_document", close_document, final=True),
     ])
+
+
+def document_result(item):
+    return {key: item[key] for key in RESULT_KEYS if key in item}
+
+
+def process_document(file_name, pdf_file, dedup_index, skip_duplicates=True, resume_batch=None, cost_batch=None):
+    """
+    Runs one PDF through the extraction pipeline in the calling thread (the background workers in
+    jobs.py are already one process per core).
     
-    # Metrics tracking
-    metrics = {
+    Parameters:
+        file_name (str): Name used in logs, spans and the result.
+        pdf_file (file-like or Document): The PDF; a file object is read once, a Document is used as is.
+        dedup_index (DedupIndex): Index of invoices already extracted.
+        skip_duplicates (bool): Stop at the first duplicate match instead of extracting again.
+        resume_batch (str, optional): Dedup batch id of an earlier attempt at this same document,
+            whose registration must not count as a duplicate.
+        cost_batch (str, optional): Ledger batch the API calls are charged to and budgeted against.
+    
+    Returns:
+        dict: "status" ("extracted", "duplicate", "no_text", "paused" or "failed") and "message", plus when
+            available "record", "raw_text", "raw_response", "duplicate", "failures", "validation" and
+            "notices".
+    """
+    item = {'name': file_name, 'skip_duplicates': skip_duplicates, 'resume_batch': resume_batch}
+    item['document' if isinstance(pdf_file, Document) else 'file'] = pdf_file
+    resources = {'dedup_file': dedup_index, 'dedup_text': dedup_index, 'register': dedup_index}
+    return document_result(document_pipeline(cost_batch=cost_batch).run_inline(item, resources))
+
+
+def results_frame(records):
+    import pandas as pd
+
+    return pd.DataFrame(records).reindex(columns=RESULT_COLUMNS + ['Source File'])
+
+
+def new_metrics():
+    return {
         'total_files': 0,
         'successful_extractions': 0,
-        'field_accuracy': {field: {'correct': 0, 'total': 0} for field in df.columns if field not in ['Confidence', 'Trust']}
+        'duplicates_skipped': 0,
+        'duplicates': [],
+        'field_accuracy': {field: {'correct': 0, 'total': 0} for field in INVOICE_FIELDS},
     }
+
+
+def update_metrics(metrics, file_name, result):
+    """
+    Folds one process_document result into the batch metrics.
+    """
+    metrics['total_files'] += 1
+    if result['status'] == 'duplicate':
+        duplicate = result['duplicate']
+        metrics['duplicates_skipped'] += 1
+        metrics['duplicates'].append({'File': file_name, 'Skipped': result['stage'], 'Match': duplicate['kind'],
+                                      'Duplicate Of': duplicate['duplicate_of']})
+    elif result['status'] == 'extracted':
+        metrics['successful_extractions'] += 1
+        for field, is_valid in result['validation']:
+            metrics['field_accuracy'][field]['total'] += 1
+            if is_valid:
+                metrics['field_accuracy'][field]['correct'] += 1
+
+
+def create_docs(user_pdf_list, export_formats=(), skip_duplicates=True):
+    """
+    Processes multiple PDF files to extract invoice data and compile it into a DataFrame.
     
-    for file in user_pdf_list:
-        metrics['total_files'] += 1
-        st.write(f"### Processing `{file.name}`...")
-        try:
-            raw_data = get_pdf_text(file)
-            if not raw_data.strip():
-                st.warning(f"No text extracted from `{file.name}`. Skipping.")
-                logging.warning(f"No text extracted from {file.name}.")
-                continue
-            
+    Parameters:
+        user_pdf_list (list): List of uploaded PDF files.
+        export_formats (iterable): Extra download formats ("CSV", "Excel") converted from the Parquet output.
+        skip_duplicates (bool): Skip invoices already extracted in this or an earlier batch.
+    
+    Returns:
+        pd.DataFrame: DataFrame containing all extracted invoice data.
+    """
+    from export import InvoiceWriter
+
+    metrics = new_metrics()
+    rows = []
+    writer = InvoiceWriter(OUTPUT_FILE)
+    in_batch = {}
+    items = ({'name': file.name, 'file': file, 'skip_duplicates': skip_duplicates, 'in_batch': in_batch}
+             for file in user_pdf_list)
+
+    # Latency tables and the metrics file cover this batch only; /metrics keeps the process totals
+    recorder.reset()
+    # Documents finish in whatever order their stages allow; each is shown as soon as it is done
+    batch_id = time.strftime('%Y%m%d-%H%M%S')
+    for item in document_pipeline(batch_id).run(items):
+        file_name = item['name']
+        result = document_result(item)
+        update_metrics(metrics, file_name, result)
+        st.write(f"### Processed `{file_name}`")
+        # API errors and rate-limit waits, collected on the worker threads and shown from this one
+        for level, notice in result.get('notices', ()):
+            (st.error if level == 'error' else st.warning)(notice)
+
+        if result.get('raw_text'):
             # Display extracted text for debugging
-            with st.expander(f"🔍 Extracted Text from `{file.name}`", expanded=False):
-                st.text_area("Extracted Text:", raw_data, height=300)
-            
-            llm_extracted_data = call_openai_api(raw_data)
-            if not llm_extracted_data:
-                st.error(f"Failed to extract data from `{file.name}`.")
-                logging.error(f"API response failed for {file.name}.")
-                continue
-
-            # Log the raw extracted data
-            logging.info(f"Raw extracted data for {file.name}: {llm_extracted_data}")
-            
+            with st.expander(f"🔍 Extracted Text from `{file_name}`", expanded=False):
+                st.text_area("Extracted Text:", result['raw_text'], height=300)
+        if result.get('raw_response'):
             # Display raw extracted data for debugging
-            with st.expander(f"📄 Raw Extracted Data from `{file.name}`", expanded=False):
-                st.code(llm_extracted_data, language='json')
-
-            # Extract JSON from the raw response
-            json_text = extract_json(llm_extracted_data)
-            if not json_text:
-                logging.error(f"No JSON found in the API response for {file.name}.")
-                st.error(f"Error parsing extracted data from `{file.name}`: Invalid JSON.")
+            with st.expander(f"📄 Raw Extracted Data from `{file_name}`", expanded=False):
+                st.code(result['raw_response'], language='json')
+
+        if result['status'] == 'duplicate':
+            st.info(f"Skipping `{file_name}` ({result['stage']}): {result['message']}.")
+            logging.info(f"Skipped duplicate {file_name} {result['stage']}: {result['duplicate']}")
+        elif result['status'] == 'no_text':
+            st.warning(f"{result['message']} Skipping.")
+        elif result['status'] == 'paused':
+            st.warning(result['message'])
+        elif result['status'] == 'failed':
+            st.error(result['message'])
+            if result.get('raw_response'):
                 st.write("**Please ensure that the GPT-4 API returns valid JSON.**")
-                continue
+        else:
+            if result['failures']:
+                st.warning(f"`{file_name}` failed consistency checks: {', '.join(result['failures'])}")
+            # Stream the record to the Parquet output and keep it for the on-screen table
+            with span("export", doc=file_name):
+                writer.write(result['record'])
+            rows.append(result['record'])
+            st.success(f"**Extraction successful for `{file_name}`.** ✅")
+            logging.info(f"Extraction successful for {file_name}.")
 
-            # Parse the JSON text
-            try:
-                data_dict = json.loads(json_text)
-                logging.info(f"Extracted data from {file.name}: {data_dict}")
-            except json.JSONDecodeError as e:
-                logging.error(f"JSON decoding failed for {file.name}: {e}")
-                st.error(f"Error parsing extracted data from `{file.name}`: Invalid JSON.")
-                st.write("**Please ensure that the GPT-4 API returns valid JSON.**")
-                continue
+    try:
+        with span("export", rows=len(rows)):
+            writer.close()
+        logging.info(f"{writer.rows_written} records saved to {OUTPUT_FILE}.")
+    except Exception as e:
+        logging.error(f"Failed to save extracted data to {OUTPUT_FILE}: {e}")
+        st.error(f"Failed to save extracted data: {e}")
 
-            # Validate each field and assess confidence
-            confidence_list = []
-            trust_list = []
-            for field in df.columns:
-                if field in ['Confidence', 'Trust']:
-                    continue
-                value = data_dict.get(field, "")
-                is_valid, confidence = validate_data(field, value)
-                confidence_list.append(confidence)
-                trust = "Trusted" if confidence in ["High Confidence", "Medium Confidence"] else "Untrusted"
-                trust_list.append(trust)
-                
-                # Update metrics
-                metrics['field_accuracy'][field]['total'] += 1
-                if is_valid:
-                    metrics['field_accuracy'][field]['correct'] += 1
-
-            # Add confidence and trust assessment
-            data_dict['Confidence'] = "; ".join(confidence_list)
-            data_dict['Trust'] = "Trusted" if "Low Confidence" not in confidence_list else "Untrusted"
-
-            # Append the extracted data to the DataFrame
-            df = pd.concat([df, pd.DataFrame([data_dict])], ignore_index=True)
-            metrics['successful_extractions'] += 1
-            st.success(f"**Extraction successful for `{file.name}`.** ✅")
-            logging.info(f"Extraction successful for {file.name}.")
+    df = results_frame(rows)
+    show_batch_report(df, metrics, export_formats, cost_batch=batch_id)
+    return df
 
-        except Exception as e:
-            logging.error(f"An error occurred while processing {file.name}: {e}")
-            st.error(f"An error occurred while processing `{file.name}`: {e}")
+
+def show_batch_report(df, metrics, export_formats=(), cost_batch=None):
+    """
+    Shows the batch metrics, consistency summary, stage latencies and API cost, and offers the downloads.
+    """
+    import pandas as pd
+    from export import convert_export
+    from reconcile import reconcile_invoices, summarise
 
     # Calculate accuracy rates
     accuracy_rates = {}
@@ -325,43 +680,63 @@ def create_docs(user_pdf_list):
         else:
             accuracy_rates[field] = "N/A"
 
-    # Save the DataFrame to an Excel file
-    output_excel_file = "extracted_invoice_data.xlsx"
-    try:
-        df.to_excel(output_excel_file, index=False)
-        logging.info("DataFrame successfully saved to Excel.")
-    except Exception as e:
-        logging.error(f"Failed to save DataFrame to Excel: {e}")
-        st.error(f"Failed to save extracted data to Excel: {e}")
-
     # Display metrics
     st.write("### 📊 Extraction Performance Metrics")
     st.write(f"**Total Files Processed:** {metrics['total_files']}")
     st.write(f"**Successful Extractions:** {metrics['successful_extractions']}")
+    st.write(f"**Duplicates Skipped:** {metrics['duplicates_skipped']}")
+    if metrics['duplicates']:
+        st.dataframe(pd.DataFrame(metrics['duplicates']))
     
     metrics_df = pd.DataFrame.from_dict(accuracy_rates, orient='index', columns=['Accuracy Rate'])
     metrics_df.index.name = 'Field'
     st.write("**Per-Field Accuracy Rates:**")
     st.dataframe(metrics_df.style.highlight_max(color='lightgreen'))
 
+    # Consistency checks over the whole batch at once
+    if not df.empty:
+        st.write("**Consistency Checks (pass rate where applicable):**")
+        st.dataframe(summarise(reconcile_invoices(df)))
+
+    # Per-stage latency, to tell OCR-bound batches from API-bound ones
+    if recorder.stages:
+        st.write("**Per-Stage Latency (seconds):**")
+        st.dataframe(pd.DataFrame(recorder.summary()).set_index('stage'))
+        with st.expander("⏱️ Per-Document Stage Latency", expanded=False):
+            st.dataframe(pd.DataFrame(recorder.summary(per_document=True)))
+    if cost_batch:
+        show_batch_cost(cost_batch, metrics['total_files'])
+    try:
+        write_prometheus(METRICS_FILE)
+    except OSError as e:
+        logging.error(f"Failed to write metrics file: {e}")
+
     # Provide download options
-    with open(output_excel_file, "rb") as f:
-        excel_data = f.read()
-    st.download_button(
-        "📥 Download Extracted Data as Excel",
-        data=excel_data,
-        file_name=output_excel_file,
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
-    
-    # Additionally, allow downloading as CSV
-    csv = df.to_csv(index=False).encode('utf-8')
-    st.download_button(
-        "📥 Download Extracted Data as CSV",
-        data=csv,
-        file_name="extracted_invoice_data.csv",
-        mime="text/csv"
-    )
+    with open(OUTPUT_FILE, "rb") as f:
+        st.download_button(
+            "📥 Download Extracted Data as Parquet",
+            data=f,
+            file_name=OUTPUT_FILE,
+            mime="application/vnd.apache.parquet"
+        )
+
+    # CSV and Excel only when asked for; both are streamed from the Parquet file
+    for export_format in export_formats:
+        file_name, mime = EXPORT_FORMATS[export_format]
+        try:
+            with span("export_convert", format=export_format):
+                convert_export(OUTPUT_FILE, file_name)
+        except Exception as e:
+            logging.error(f"Failed to convert extracted data to {export_format}: {e}")
+            st.error(f"Failed to convert extracted data to {export_format}: {e}")
+            continue
+        with open(file_name, "rb") as f:
+            st.download_button(
+                f"📥 Download Extracted Data as {export_format}",
+                data=f,
+                file_name=file_name,
+                mime=mime
+            )
 
     # Display trust assessment summary
     trusted = df['Trust'].value_counts().get('Trusted', 0)
@@ -369,8 +744,6 @@ def create_docs(user_pdf_list):
     st.write(f"**Trusted Data Points:** {trusted}")
     st.write(f"**Untrusted Data Points:** {untrusted}")
 
-    return df
-
 # ===========================================
 # 4. Streamlit Application Interface
 # ===========================================
@@ -390,26 +763,116 @@ def main():
         accept_multiple_files=True
     )
 
+    export_formats = st.multiselect(
+        "Also export as (Parquet is always written)",
+        options=list(EXPORT_FORMATS),
+        default=[]
+    )
+
+    skip_duplicates = st.checkbox("Skip invoices already extracted in earlier batches", value=True)
+
+    background = st.checkbox(
+        "Process in background workers (start them with `python -m jobs worker`)", value=False)
+
     if st.button("🚀 Extract Data"):
-        if pdf_files:
-            with st.spinner('Processing your invoices...'):
-                df = create_docs(pdf_files)
-                
-                if not df.empty:
-                    st.write("### 📈 Extracted Data:")
-                    st.dataframe(df)
-    
-                    # Provide a summary of trust assessments
-                    trusted = df['Trust'].value_counts().get('Trusted', 0)
-                    untrusted = df['Trust'].value_counts().get('Untrusted', 0)
-                    st.write(f"**Trusted Data Points:** {trusted}")
-                    st.write(f"**Untrusted Data Points:** {untrusted}")
-                    
-                    st.success("✅ Extraction complete!")
-                else:
-                    st.warning("⚠️ No data extracted from the uploaded PDFs.")
-        else:
+        if not pdf_files:
             st.error("❌ Please upload at least one PDF file.")
+        elif background:
+            queue = JobQueue()
+            batch_id = time.strftime('%Y%m%d-%H%M%S')
+            for file in pdf_files:
+                queue.enqueue(batch_id, file.name, file.getbuffer(), skip_duplicates)
+            queue.close()
+            st.session_state['job_batch'] = batch_id
+            st.session_state['job_export_formats'] = export_formats
+        else:
+            with st.spinner('Processing your invoices...'):
+                df = create_docs(pdf_files, export_formats, skip_duplicates)
+                show_extracted(df)
+
+    # The batch id survives reruns, so the page keeps polling until the workers are done
+    if 'job_batch' in st.session_state:
+        show_job_batch(st.session_state['job_batch'], st.session_state['job_export_formats'])
+
+
+def show_extracted(df):
+    if not df.empty:
+        st.write("### 📈 Extracted Data:")
+        st.dataframe(df)
+
+        # Provide a summary of trust assessments
+        trusted = df['Trust'].value_counts().get('Trusted', 0)
+        untrusted = df['Trust'].value_counts().get('Untrusted', 0)
+        st.write(f"**Trusted Data Points:** {trusted}")
+        st.write(f"**Untrusted Data Points:** {untrusted}")
+
+        st.success("✅ Extraction complete!")
+    else:
+        st.warning("⚠️ No data extracted from the uploaded PDFs.")
+
+
+def show_batch_cost(cost_batch, documents):
+    """
+    Shows what a batch's API calls cost, in total, per 1,000 invoices and per stage and model.
+    """
+    import pandas as pd
+    from ledger import shared_ledger
+
+    summary = shared_ledger().batch_summary(cost_batch, documents)
+    if not summary['calls']:
+        return
+    st.write("### 💰 API Cost")
+    st.write(f"**Cost:** ${summary['cost_usd']:.4f} · **Per 1,000 Invoices:** ${summary['cost_per_1k_documents']:.2f}")
+    st.write(f"**Tokens:** {summary['prompt_tokens']} prompt ({summary['cached_tokens']} cached), "
+             f"{summary['completion_tokens']} completion · **Retries:** {summary['retries']}")
+    st.dataframe(pd.DataFrame(summary['by_stage']).set_index(['stage', 'model']))
+
+
+def show_job_batch(batch_id, export_formats=()):
+    """
+    Shows the progress of a background batch and, once every job has finished, its results.
+    """
+    import pandas as pd
+    from export import InvoiceWriter
+
+    queue = JobQueue()
+    jobs = queue.batch_jobs(batch_id)
+    counts = queue.batch_counts(batch_id)
+    queue.close()
+    # The workers' spans are recorded in their own processes; none here belong to this batch
+    recorder.reset()
+
+    st.write(f"### 🗂️ Background Batch `{batch_id}`")
+    st.write(" · ".join(f"**{state.title()}:** {count}" for state, count in sorted(counts.items())))
+    st.dataframe(pd.DataFrame([{
+        'Job': job['id'],
+        'File': job['file_name'],
+        'State': job['state'],
+        'Attempts': f"{job['attempts']}/{job['max_attempts']}",
+        'Outcome': job['result']['message'] if job['result'] else job['error'] or '',
+    } for job in jobs]))
+
+    if not batch_finished(counts):
+        st.info("⏳ Waiting for the background workers...")
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
+
+    # Results are exported from the job table, so a finished batch can be reloaded at any time
+    metrics = new_metrics()
+    rows = []
+    with InvoiceWriter(OUTPUT_FILE) as writer:
+        for job in jobs:
+            if job['state'] == 'failed':
+                metrics['total_files'] += 1
+                st.error(f"`{job['file_name']}` failed after {job['attempts']} attempts: {job['error']}")
+                continue
+            update_metrics(metrics, job['file_name'], job['result'])
+            if job['result']['status'] == 'extracted':
+                writer.write(job['result']['record'])
+                rows.append(job['result']['record'])
+    df = results_frame(rows)
+    show_batch_report(df, metrics, export_formats, cost_batch=batch_id)
+    show_extracted(df)
 
 # ===========================================
 # 5. Run the Application
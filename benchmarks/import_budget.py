@@ -0,0 +1,96 @@
+"""
+Start-up cost of the Streamlit apps: cold start (fresh interpreter, first script run) and
+rerun (the script executed again with its modules already imported, which is what Streamlit
+does on every widget interaction).
+
+Each app runs in its own subprocess in Streamlit's bare mode, so nothing is uploaded and only
+the page itself is built. The slowest top-level imports are listed to show what to defer next.
+
+Usage (from the repository root):
+    python -m benchmarks.import_budget
+    python -m benchmarks.import_budget --cold-budget 0.8 --rerun-budget 0.05
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+# Fresh interpreter to first page, and one rerun; both exclude starting the Streamlit server itself
+COLD_START_BUDGET_S = 1.0
+RERUN_BUDGET_S = 0.1
+
+# Apps as Streamlit runs them: script path and the directory it is started from
+APPS = {
+    'gpt': ('app.py', '.'),
+    'regex': (os.path.join('Model_2_OCR', 'app.py'), 'Model_2_OCR'),
+    'layoutlm': (os.path.join('Model_2_OCR', 'rough.py'), 'Model_2_OCR'),
+}
+
+_PROBE = """
+import json, runpy, sys, time
+sys.path.insert(0, '.')
+start = time.perf_counter()
+runpy.run_path({script!r}, run_name='__main__')
+cold = time.perf_counter() - start
+start = time.perf_counter()
+runpy.run_path({script!r}, run_name='__main__')
+rerun = time.perf_counter() - start
+print('BUDGET ' + json.dumps({{'cold_s': cold, 'rerun_s': rerun}}))
+"""
+
+_IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def measure_app(script, cwd, top=5):
+    """
+    Runs one app twice in a fresh interpreter.
+
+    Returns:
+        dict: cold_s, rerun_s and the slowest top-level imports as (module, seconds),
+            or an "error" when the app cannot start here (e.g. an optional backend is missing).
+    """
+    env = dict(os.environ, GPT4V_KEY=os.environ.get('GPT4V_KEY', 'budget'),
+               GPT4V_ENDPOINT=os.environ.get('GPT4V_ENDPOINT', 'http://127.0.0.1:9'))
+    probe = _PROBE.format(script=os.path.relpath(os.path.abspath(script), os.path.abspath(cwd)))
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', probe], cwd=cwd, env=env,
+                               capture_output=True, text=True)
+    result = next((json.loads(line[len('BUDGET '):]) for line in completed.stdout.splitlines()
+                   if line.startswith('BUDGET ')), None)
+    if result is None:
+        last_error = [line for line in completed.stderr.splitlines() if not line.startswith('import time:')]
+        return {'error': last_error[-1] if last_error else f"exit code {completed.returncode}"}
+
+    imports = []
+    for line in completed.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        # Indentation is the import depth; depth 0 are the modules the script imported itself
+        if match and len(match.group(3)) <= 1:
+            imports.append((match.group(4), int(match.group(2)) / 1e6))
+    result['slowest_imports'] = sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold start and rerun time of the Streamlit apps.")
+    parser.add_argument('--apps', nargs='+', choices=sorted(APPS), default=list(APPS))
+    parser.add_argument('--cold-budget', type=float, default=COLD_START_BUDGET_S)
+    parser.add_argument('--rerun-budget', type=float, default=RERUN_BUDGET_S)
+    args = parser.parse_args()
+
+    over_budget = []
+    for name in args.apps:
+        script, cwd = APPS[name]
+        result = measure_app(script, cwd)
+        if 'error' in result:
+            print(f"{name:<10} skipped: {result['error']}")
+            continue
+        status = 'ok'
+        if result['cold_s'] > args.cold_budget or result['rerun_s'] > args.rerun_budget:
+            status = 'OVER BUDGET'
+            over_budget.append(name)
+        print(f"{name:<10} cold {result['cold_s']:.3f}s  rerun {result['rerun_s']:.3f}s  {status}")
+        for module, seconds in result['slowest_imports']:
+            print(f"{'':<12}{module:<28}{seconds:.3f}s")
+    sys.exit(1 if over_budget else 0)
@@ -0,0 +1,152 @@
+"""
+Local stand-in for the LLM endpoints, replaying canned answers built from the corpus ground truth.
+
+It speaks both shapes used in this repo:
+    - chat completions ({"messages": [...]}) like the Azure OpenAI GPT4V_ENDPOINT in app.py
+    - plain completions ({"prompt": "..."}) like llama.cpp, returning {"choices": [{"text": ...}]}
+
+Latency and HTTP 429 throttling are configurable so rate-limit handling can be benchmarked offline.
+
+Usage:
+    python -m benchmarks.mock_llm_server --corpus benchmarks/corpus --latency-ms 800 --rate-429 0.05
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.synthetic_invoices import load_ground_truth
+
+
+def canned_answer(prompt, records_by_number):
+    """
+    Builds the JSON answer for a prompt from the ground truth of the invoice it mentions.
+    Unknown invoices (e.g. OCR mangled the number) get an empty object, like a confused model.
+    """
+    match = re.search(r'INV-\d+', prompt)
+    record = records_by_number.get(match.group(0)) if match else None
+    if record is None:
+        return {}
+    return {field: value for field, value in record.items() if field not in ('file_name', 'kind')}
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    records_by_number = {}
+    latency_ms = 0.0
+    jitter_ms = 0.0
+    rate_429 = 0.0
+    rng = random.Random(0)
+    lock = threading.Lock()
+    stats = {'requests': 0, 'throttled': 0}
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': {'message': 'Invalid JSON body'}})
+            return
+
+        with self.lock:
+            self.stats['requests'] += 1
+            throttled = self.rng.random() < self.rate_429
+            if throttled:
+                self.stats['throttled'] += 1
+            delay = max(0.0, self.rng.gauss(self.latency_ms, self.jitter_ms)) / 1000.0
+
+        if throttled:
+            self._send_json(429, {'error': {'code': '429', 'message': 'Rate limit exceeded'}},
+                            headers={'Retry-After': '1'})
+            return
+        time.sleep(delay)
+
+        if 'messages' in payload:
+            prompt = '\n'.join(message.get('content', '') for message in payload['messages'])
+        else:
+            prompt = payload.get('prompt', '')
+        content = json.dumps(canned_answer(prompt, self.records_by_number))
+        usage = {
+            'prompt_tokens': len(prompt) // 4,
+            'completion_tokens': len(content) // 4,
+            'total_tokens': len(prompt) // 4 + len(content) // 4,
+        }
+
+        if 'messages' in payload:
+            self._send_json(200, {
+                'object': 'chat.completion',
+                'model': 'mock-gpt',
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': content}}],
+                'usage': usage,
+            })
+        else:
+            self._send_json(200, {
+                'object': 'text_completion',
+                'model': 'mock-llama',
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'text': content}],
+                'usage': usage,
+            })
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(ground_truth, host='127.0.0.1', port=0, latency_ms=0.0, jitter_ms=0.0,
+                      rate_429=0.0, seed=0):
+    """
+    Starts the mock endpoint on a daemon thread.
+
+    Parameters:
+        ground_truth (list): Records from synthetic_invoices.load_ground_truth.
+        port (int): 0 picks a free port.
+        latency_ms, jitter_ms (float): Mean and standard deviation of the simulated response time.
+        rate_429 (float): Probability that a request is answered with HTTP 429.
+
+    Returns:
+        tuple: (server, url) - call server.shutdown() when done.
+    """
+    handler = type('BoundMockLLMHandler', (MockLLMHandler,), {
+        'records_by_number': {record['Invoice No.']: record for record in ground_truth},
+        'latency_ms': latency_ms,
+        'jitter_ms': jitter_ms,
+        'rate_429': rate_429,
+        'rng': random.Random(seed),
+        'lock': threading.Lock(),
+        'stats': {'requests': 0, 'throttled': 0},
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1/chat/completions"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve canned LLM answers for the benchmark corpus.")
+    parser.add_argument('--corpus', default='benchmarks/corpus')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=800.0)
+    parser.add_argument('--jitter-ms', type=float, default=200.0)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, url = start_mock_server(load_ground_truth(args.corpus), args.host, args.port,
+                                    args.latency_ms, args.jitter_ms, args.rate_429)
+    print(f"Mock LLM endpoint on {url} (set GPT4V_ENDPOINT to this URL)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
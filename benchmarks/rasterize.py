@@ -0,0 +1,114 @@
+"""
+Page rasterisation throughput: pdf2image (a pdftoppm subprocess and PPM files per call) against
+PyMuPDF rendering in process (document.Document), to NumPy arrays as the OCR path consumes them.
+
+Each backend runs in a fresh process, so peak RSS is its own; pdftoppm's memory is reported
+separately as the peak of its child processes.
+
+Usage (from the repository root):
+    python -m benchmarks.rasterize
+    python -m benchmarks.rasterize --dpi 300 --scanned-only --backends pdf2image fitz-gray
+"""
+import argparse
+import glob
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from benchmarks.synthetic_invoices import generate_corpus
+
+# ===========================
+# 1. Backends
+# ===========================
+
+
+def render_pdf2image(path, dpi, colorspace):
+    import numpy as np
+    from pdf2image import convert_from_path
+
+    for image in convert_from_path(path, dpi=dpi, grayscale=colorspace == 'gray'):
+        yield np.asarray(image)
+
+
+def render_fitz(path, dpi, colorspace):
+    from document import Document
+
+    with Document.from_path(path) as document:
+        for _, array in document.render_arrays(dpi=dpi, colorspace=colorspace):
+            yield array
+
+
+# Backend name -> (renderer, colourspace)
+BACKENDS = {
+    'pdf2image': (render_pdf2image, 'rgb'),
+    'pdf2image-gray': (render_pdf2image, 'gray'),
+    'fitz': (render_fitz, 'rgb'),
+    'fitz-gray': (render_fitz, 'gray'),
+}
+
+# ===========================
+# 2. Measurement
+# ===========================
+
+
+def run_backend(name, paths, dpi):
+    """
+    Child-process entry point: renders every page of every path once and times it.
+    """
+    renderer, colorspace = BACKENDS[name]
+    pages = pixels = 0
+    start = time.perf_counter()
+    try:
+        for path in paths:
+            for array in renderer(path, dpi, colorspace):
+                pages += 1
+                pixels += array.size
+    except Exception as e:
+        return {'backend': name, 'error': f"{type(e).__name__}: {e}"}
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'backend': name,
+        'pages': pages,
+        'seconds': elapsed,
+        'pages_per_sec': pages / elapsed if elapsed else 0.0,
+        'megapixels': pixels / 1e6,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20,
+        'peak_child_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2 ** 20,
+    }
+
+
+def run_rasterize_benchmark(paths, backends, dpi):
+    results = []
+    for name in backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            results.append(pool.submit(run_backend, name, paths, dpi).result())
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare pdf2image and PyMuPDF page rasterisation.")
+    parser.add_argument('--corpus', default=os.path.join('benchmarks', 'corpus'))
+    parser.add_argument('--count', type=int, default=50, help='Invoices to generate if the corpus is missing')
+    parser.add_argument('--scanned-fraction', type=float, default=0.3)
+    parser.add_argument('--scanned-only', action='store_true', help='Only the image-only scans, as OCR sees them')
+    parser.add_argument('--dpi', type=int, default=200)
+    parser.add_argument('--backends', nargs='+', choices=sorted(BACKENDS), default=list(BACKENDS))
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.corpus, 'ground_truth.jsonl')):
+        generate_corpus(args.corpus, args.count, args.scanned_fraction)
+    paths = sorted(glob.glob(os.path.join(args.corpus, '*_scan.pdf' if args.scanned_only else '*.pdf')))
+
+    print(f"{len(paths)} documents at {args.dpi} dpi\n")
+    print(f"{'backend':<16}{'pages':>7}{'seconds':>9}{'pages/s':>9}{'peak RSS MB':>13}{'child RSS MB':>14}")
+    for result in run_rasterize_benchmark(paths, args.backends, args.dpi):
+        if 'error' in result:
+            print(f"{result['backend']:<16}skipped: {result['error']}")
+            continue
+        print(f"{result['backend']:<16}{result['pages']:>7}{result['seconds']:>9.2f}{result['pages_per_sec']:>9.2f}"
+              f"{result['peak_rss_mb']:>13.1f}{result['peak_child_rss_mb']:>14.1f}")
@@ -0,0 +1,301 @@
+"""
+End-to-end benchmark of the invoice extractors on the synthetic corpus.
+
+For each extractor (regex = Model_2_OCR, gpt = root app.py, llama = Experiment/experiment_2 prompt)
+it reports throughput, per-stage latency, peak memory and field accuracy against ground truth.
+LLM calls go to the local mock endpoint, so runs are offline, repeatable and free.
+The LayoutLMv3 engine (Model_2_OCR/layoutlm_engine.py, fp32 and int8) runs only when listed in
+--extractors, since it needs torch and transformers.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmark --count 50 --latency-ms 800 --rate-429 0.05
+    python -m benchmarks.run_benchmark --extractors regex gpt layoutlm layoutlm-int8
+"""
+import argparse
+import importlib
+import json
+import os
+import re
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from config import INVOICE_FIELDS
+from evaluation import evaluate, field_accuracy, evaluate_benchmark_results
+from benchmarks.synthetic_invoices import generate_corpus, load_ground_truth
+from benchmarks.mock_llm_server import start_mock_server
+
+EXTRACTORS = ('regex', 'gpt', 'llama')
+# Need torch and transformers, so they only run when asked for
+OPTIONAL_EXTRACTORS = ('layoutlm', 'layoutlm-int8')
+
+# Imported before the clock starts so throughput measures extraction, not module loading
+EXTRACTOR_MODULES = {
+    'regex': ['Model_2_OCR.utils'],
+    'gpt': ['app'],
+    'llama': ['pdfplumber', 'pytesseract', 'fitz', 'requests'],
+    'layoutlm': ['Model_2_OCR.layoutlm_engine', 'torch', 'transformers', 'pytesseract', 'fitz'],
+    'layoutlm-int8': ['Model_2_OCR.layoutlm_engine', 'torch', 'transformers', 'pytesseract', 'fitz'],
+}
+
+# Output keys of Model_2_OCR/utils.process_invoice_text mapped to schema fields
+REGEX_FIELD_MAP = {
+    'invoice_number': 'Invoice No.',
+    'invoice_date': 'Invoice Date',
+    'email': 'Email',
+    'place_of_supply': 'Place of Supply',
+    'place_of_origin': 'Place of Origin',
+    'gstin': 'GSTIN Supplier',
+    'taxable_value': 'Taxable Value',
+    'cgst_amount': 'CGST Amount',
+    'sgst_amount': 'SGST Amount',
+    'igst_amount': 'IGST Amount',
+    'tax_amount': 'Tax Amount',
+    'final_amount': 'Final Amount',
+}
+
+
+# ==============================
+# 1. Scoring
+# ==============================
+
+
+def score(records, ground_truth):
+    """
+    Returns exact and normalised accuracy, overall and per field, over the fields each extractor claims to produce.
+    """
+    scores = evaluate(records, ground_truth)
+    per_field = field_accuracy(scores)
+    return {
+        'overall': float(scores['normalised'].mean()) if len(scores) else 0.0,
+        'exact': float(scores['exact'].mean()) if len(scores) else 0.0,
+        'per_field': per_field['normalised'].to_dict(),
+    }
+
+# ==============================
+# 2. Extractors (run in a child process each)
+# ==============================
+
+
+def run_regex(paths, span):
+    from Model_2_OCR.utils import extract_text_from_pdf, extract_text_from_image, process_invoice_text
+    from document import Document
+
+    records = []
+    for path in paths:
+        name = os.path.basename(path)
+        with Document.from_path(path) as document:
+            with span("text_extract", doc=name):
+                text, success, _ = extract_text_from_pdf(document)
+            if not text.strip():
+                # PyMuPDF "succeeds" with no text on scans; fall back to OCR like a user would
+                with span("ocr", doc=name):
+                    text, success, _ = extract_text_from_image(document)
+        with span("field_extract", doc=name):
+            data, _ = process_invoice_text(text)
+        fields = {REGEX_FIELD_MAP[key]: value for key, value in data.items() if key in REGEX_FIELD_MAP}
+        records.append({'file_name': name, 'fields': fields, 'fields_supported': list(REGEX_FIELD_MAP.values())})
+    return records
+
+
+def run_gpt(paths, span):
+    import app
+
+    records = []
+    for path in paths:
+        name = os.path.basename(path)
+        with open(path, 'rb') as f:
+            text = app.get_pdf_text(f)
+        fields = {}
+        raw = app.call_openai_api(text, name) if text.strip() else None
+        json_text = app.extract_json(raw) if raw else None
+        if json_text:
+            with span("json_parse", doc=name):
+                try:
+                    fields = json.loads(json_text)
+                except json.JSONDecodeError:
+                    fields = {}
+        records.append({'file_name': name, 'fields': fields, 'fields_supported': list(INVOICE_FIELDS)})
+    return records
+
+
+def run_llama(paths, span):
+    import pdfplumber
+    import pytesseract
+    import requests
+    from document import Document
+    from prompts import get_prompt
+
+    endpoint = os.environ['BENCHMARK_LLM_ENDPOINT']
+    prompt = get_prompt("invoice_extraction_completion")
+    records = []
+    for path in paths:
+        name = os.path.basename(path)
+        with Document.from_path(path) as document:
+            with span("text_extract", doc=name), pdfplumber.open(document.stream()) as pdf:
+                text = "\n".join(page.extract_text() or "" for page in pdf.pages)
+            if not text.strip():
+                with span("ocr", doc=name):
+                    text = "\n".join(pytesseract.image_to_string(image) for _, image in document.render())
+        text = re.sub(r'\s+', ' ', text)
+        with span("llm_call", doc=name) as s:
+            response = requests.post(endpoint, json={'prompt': prompt.render(text),
+                                                     'max_tokens': 1024, 'temperature': 0.0}, timeout=120)
+            if response.status_code == 200:
+                usage = response.json().get('usage', {})
+                s.set(prompt_tokens=usage.get('prompt_tokens', 0),
+                      completion_tokens=usage.get('completion_tokens', 0))
+        fields = {}
+        if response.status_code == 200:
+            with span("json_parse", doc=name):
+                match = re.search(r'\{.*\}', response.json()['choices'][0]['text'], re.DOTALL)
+                fields = json.loads(match.group(0)) if match else {}
+        records.append({'file_name': name, 'fields': fields, 'fields_supported': prompt.fields})
+    return records
+
+
+def run_layoutlm(paths, span, quantize=False):
+    from Model_2_OCR.layoutlm_engine import LayoutLMEngine, render_pages, page_words, group_entities
+
+    with span("model_load"):
+        engine = LayoutLMEngine(quantize=quantize)
+    fields_supported = engine.fields()
+    records = []
+    # Pages of several documents share a forward pass, as a batch job would run them
+    for start in range(0, len(paths), engine.batch_size):
+        chunk = paths[start:start + engine.batch_size]
+        pages, owners = [], []
+        for path in chunk:
+            name = os.path.basename(path)
+            with open(path, 'rb') as f, span("page_render", doc=name):
+                images = render_pages(f.read())
+            for image in images:
+                with span("ocr", doc=name, pixels=image.width * image.height):
+                    pages.append((image, *page_words(image)))
+                owners.append(name)
+        with span("layout_model", pages=len(pages)):
+            labelled = engine.predict(pages)
+        for path in chunk:
+            name = os.path.basename(path)
+            word_labels = [pair for owner, page in zip(owners, labelled) if owner == name for pair in page]
+            with span("field_extract", doc=name):
+                fields = group_entities(word_labels)
+            records.append({'file_name': name, 'fields': fields, 'fields_supported': fields_supported})
+    return records
+
+
+def count_pages(paths):
+    from pypdf import PdfReader
+
+    return sum(len(PdfReader(path).pages) for path in paths)
+
+
+def run_extractor(name, paths, endpoint):
+    """
+    Child-process entry point: runs one extractor and measures it in isolation.
+    """
+    os.environ['GPT4V_KEY'] = 'benchmark'
+    os.environ['GPT4V_ENDPOINT'] = endpoint
+    os.environ['BENCHMARK_LLM_ENDPOINT'] = endpoint.replace('/chat/completions', '/completions')
+    from instrumentation import span, recorder
+    import pipeline
+
+    # Every run measures extraction from scratch, not the page cache of an earlier run
+    pipeline.USE_PAGE_CACHE = False
+    runner = {
+        'regex': run_regex,
+        'gpt': run_gpt,
+        'llama': run_llama,
+        'layoutlm': run_layoutlm,
+        'layoutlm-int8': lambda paths, span: run_layoutlm(paths, span, quantize=True),
+    }[name]
+    for module in EXTRACTOR_MODULES[name]:
+        importlib.import_module(module)
+    tracemalloc.start()
+    start = time.perf_counter()
+    records = runner(paths, span)
+    elapsed = time.perf_counter() - start
+    _, peak_python = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    pages = count_pages(paths)
+
+    return {
+        'extractor': name,
+        'documents': len(paths),
+        'pages': pages,
+        'seconds': elapsed,
+        'docs_per_sec': len(paths) / elapsed if elapsed else 0.0,
+        'pages_per_sec': pages / elapsed if elapsed else 0.0,
+        'peak_python_mb': peak_python / 2 ** 20,
+        'peak_rss_mb': max_rss / 2 ** 20,
+        'stages': recorder.summary(),
+        'records': records,
+    }
+
+# ==============================
+# 3. Runner
+# ==============================
+
+
+def run_benchmark(corpus_dir, extractors, latency_ms=0.0, jitter_ms=0.0, rate_429=0.0):
+    ground_truth = load_ground_truth(corpus_dir)
+    paths = [os.path.join(corpus_dir, record['file_name']) for record in ground_truth]
+    server, endpoint = start_mock_server(ground_truth, latency_ms=latency_ms, jitter_ms=jitter_ms,
+                                         rate_429=rate_429)
+    results = []
+    try:
+        for name in extractors:
+            # A fresh process per extractor keeps peak RSS and imports from leaking between runs
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                result = pool.submit(run_extractor, name, paths, endpoint).result()
+            result['accuracy'] = score(result['records'], ground_truth)
+            results.append(result)
+    finally:
+        server.shutdown()
+    return results
+
+
+def print_report(results, ground_truth):
+    print(f"\n{'extractor':<14}{'docs':>6}{'docs/s':>9}{'pages/s':>9}{'peak RSS MB':>13}{'peak py MB':>12}"
+          f"{'exact':>8}{'accuracy':>10}")
+    for result in results:
+        print(f"{result['extractor']:<14}{result['documents']:>6}{result['docs_per_sec']:>9.2f}"
+              f"{result['pages_per_sec']:>9.2f}"
+              f"{result['peak_rss_mb']:>13.1f}{result['peak_python_mb']:>12.1f}"
+              f"{result['accuracy']['exact']:>8.1%}{result['accuracy']['overall']:>10.1%}")
+    print("\nAccuracy vs latency and cost")
+    print(evaluate_benchmark_results(results, ground_truth).to_string(index=False))
+    for result in results:
+        print(f"\n[{result['extractor']}] per-stage latency (s)")
+        print(f"{'stage':<14}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'total':>9}")
+        for stage in result['stages']:
+            print(f"{stage['stage']:<14}{stage['count']:>7}{stage['p50_s']:>9.3f}{stage['p95_s']:>9.3f}"
+                  f"{stage['p99_s']:>9.3f}{stage['total_s']:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the invoice extractors on a synthetic corpus.")
+    parser.add_argument('--corpus', default=os.path.join('benchmarks', 'corpus'))
+    parser.add_argument('--count', type=int, default=50, help='Invoices to generate if the corpus is missing')
+    parser.add_argument('--scanned-fraction', type=float, default=0.3)
+    parser.add_argument('--extractors', nargs='+', choices=EXTRACTORS + OPTIONAL_EXTRACTORS,
+                        default=list(EXTRACTORS))
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Mean mock LLM latency')
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--rate-429', type=float, default=0.0, help='Share of mock LLM calls throttled')
+    parser.add_argument('--output', default=None, help='Write the full results as JSON')
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.corpus, 'ground_truth.jsonl')):
+        generate_corpus(args.corpus, args.count, args.scanned_fraction)
+
+    results = run_benchmark(args.corpus, args.extractors, args.latency_ms, args.jitter_ms, args.rate_429)
+    print_report(results, load_ground_truth(args.corpus))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, default=str)
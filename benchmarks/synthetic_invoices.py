@@ -0,0 +1,269 @@
+"""
+Synthetic GST invoice corpus with known ground truth for the 22 schema fields.
+
+Digital invoices are laid out like the real ones in OUTPUTS/ (text layer written with PyMuPDF);
+scanned invoices are the same pages rasterised, rotated, blurred and speckled, saved as image-only PDFs.
+
+Usage:
+    python -m benchmarks.synthetic_invoices --count 50 --scanned-fraction 0.3 --output benchmarks/corpus
+"""
+import argparse
+import io
+import json
+import os
+import random
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from config import INVOICE_FIELDS
+from reconcile import GSTIN_ALPHABET, gstin_checksum_valid
+
+STATES = [
+    ('23', 'MADHYA PRADESH', 'Shahdol', '484001'),
+    ('27', 'MAHARASHTRA', 'Pune', '411001'),
+    ('29', 'KARNATAKA', 'Bengaluru', '560001'),
+    ('07', 'DELHI', 'New Delhi', '110001'),
+    ('24', 'GUJARAT', 'Ahmedabad', '380001'),
+]
+ITEMS = ['Face Serum 30ml', 'Sunscreen SPF 50', 'Hair Oil 100ml', 'Moisturiser 50g', 'Night Cream 30g']
+CUSTOMERS = ['Naman', 'Rashu', 'Jitesh Soni', 'Asit', 'Priya Verma', 'Kunal Shah']
+GST_RATES = [5, 12, 18]
+
+# Fonts that carry the rupee sign; base-14 Helvetica does not
+FONT_CANDIDATES = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/Library/Fonts/Arial Unicode.ttf',
+    'C:\\Windows\\Fonts\\arial.ttf',
+]
+
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def money(value):
+    return Decimal(value).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def make_gstin(rng, state_code):
+    pan = ''.join(rng.choice(LETTERS) for _ in range(5)) + f"{rng.randint(0, 9999):04d}" + rng.choice(LETTERS)
+    body = f"{state_code}{pan}{rng.randint(1, 9)}Z"
+    # Valid check digit, so the reconciliation stage's checksum test passes on clean extractions
+    for check in GSTIN_ALPHABET:
+        if gstin_checksum_valid(body + check):
+            return body + check
+
+
+def make_invoice(rng, number):
+    """
+    Builds the ground truth for one invoice. Amounts are exact to the paisa and reconcile:
+    Taxable Value = Amount - discount, Final Amount = Taxable Value + CGST + SGST + IGST.
+    """
+    supplier_state = STATES[0] if rng.random() < 0.6 else rng.choice(STATES)
+    supply_state = supplier_state if rng.random() < 0.7 else rng.choice(STATES)
+    intra_state = supply_state[0] == supplier_state[0]
+
+    quantity = rng.randint(1, 12)
+    unit_price = money(rng.uniform(80, 900))
+    amount = money(quantity * unit_price)
+    discount = money(amount * Decimal(rng.choice([0, 0, 5, 10, 15])) / 100)
+    taxable = amount - discount
+    rate = rng.choice(GST_RATES)
+    if intra_state:
+        cgst = sgst = money(taxable * Decimal(rate) / 200)
+        igst = Decimal('0.00')
+        cgst_rate = sgst_rate = rate / 2
+        igst_rate = 0
+    else:
+        cgst = sgst = Decimal('0.00')
+        igst = money(taxable * Decimal(rate) / 100)
+        cgst_rate = sgst_rate = 0
+        igst_rate = rate
+    tax = cgst + sgst + igst
+    final = taxable + tax
+
+    invoice_date = date(2024, 1, 1) + timedelta(days=rng.randint(0, 365))
+    due_date = invoice_date + timedelta(days=rng.choice([0, 7, 15, 30]))
+    address = f"{rng.randint(1, 200)} MG Road, {supplier_state[2]}, {supplier_state[1]}, {supplier_state[3]}"
+
+    truth = {
+        'Invoice No.': f"INV-{number}",
+        'Quantity': quantity,
+        'Date': invoice_date.strftime('%d/%m/%Y'),
+        'Amount': float(amount),
+        'Total': float(final),
+        'Email': f"billing{rng.randint(1, 99)}@dermaq.in",
+        'Address': address,
+        'Taxable Value': float(taxable),
+        'SGST Amount': float(sgst),
+        'CGST Amount': float(cgst),
+        'IGST Amount': float(igst),
+        'SGST Rate': sgst_rate,
+        'CGST Rate': cgst_rate,
+        'IGST Rate': igst_rate,
+        'Tax Amount': float(tax),
+        'Tax Rate': rate,
+        'Final Amount': float(final),
+        'Invoice Date': invoice_date.strftime('%d %b %Y'),
+        'Place of Supply': f"{supply_state[0]}-{supply_state[1]}",
+        'Place of Origin': supplier_state[1],
+        'GSTIN Supplier': make_gstin(rng, supplier_state[0]),
+        'GSTIN Recipient': make_gstin(rng, supply_state[0]),
+    }
+    extras = {
+        'item': rng.choice(ITEMS),
+        'unit_price': float(unit_price),
+        'discount': float(discount),
+        'due_date': due_date.strftime('%d %b %Y'),
+        'customer': rng.choice(CUSTOMERS),
+        'mobile': f"9{rng.randint(100000000, 999999999)}",
+    }
+    return truth, extras
+
+
+def invoice_lines(truth, extras, rupee):
+    def inr(value):
+        return f"{rupee}{value:,.2f}"
+
+    lines = [
+        'TAX INVOICE',
+        'DermaQ Skincare Pvt Ltd',
+        f"GSTIN {truth['GSTIN Supplier']}",
+        truth['Address'],
+        f"Mobile +91 {extras['mobile']}",
+        f"Email {truth['Email']}",
+        '',
+        f"Invoice #: {truth['Invoice No.']}",
+        f"Invoice Date: {truth['Invoice Date']}",
+        f"Due Date: {extras['due_date']}",
+        'Customer Details:',
+        extras['customer'],
+        f"GSTIN {truth['GSTIN Recipient']}",
+        f"Place of Supply: {truth['Place of Supply']}",
+        f"Date: {truth['Date']}",
+        '',
+        'Item                         Qty     Rate          Amount',
+        f"{extras['item']:<28} {truth['Quantity']:<7} {inr(extras['unit_price']):<13} {inr(truth['Amount'])}",
+        '',
+        f"Taxable Amount {inr(truth['Taxable Value'])}",
+    ]
+    if truth['IGST Amount']:
+        lines.append(f"IGST {truth['IGST Rate']}% {inr(truth['IGST Amount'])}")
+    else:
+        lines.append(f"CGST {truth['CGST Rate']}% {inr(truth['CGST Amount'])}")
+        lines.append(f"SGST {truth['SGST Rate']}% {inr(truth['SGST Amount'])}")
+    lines += [
+        f"Tax Amount {inr(truth['Tax Amount'])} ({truth['Tax Rate']}%)",
+        f"Total Discount -{inr(extras['discount'])}",
+        f"Total {inr(truth['Final Amount'])}",
+    ]
+    return lines
+
+
+def find_font(font_path=None):
+    for candidate in ([font_path] if font_path else []) + FONT_CANDIDATES:
+        if candidate and os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def render_digital(lines, path, font_path):
+    import fitz
+
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)  # A4 in points
+    kwargs = {'fontname': 'inv', 'fontfile': font_path} if font_path else {'fontname': 'helv'}
+    y = 60
+    for line in lines:
+        if line:
+            page.insert_text((50, y), line, fontsize=10, **kwargs)
+        y += 16
+    doc.save(path)
+    doc.close()
+
+
+def render_scanned(digital_path, path, rng, dpi=150):
+    """
+    Rasterises a digital invoice and degrades it like a phone or flatbed scan.
+    """
+    import fitz
+    import numpy as np
+    from PIL import Image, ImageFilter
+
+    doc = fitz.open(digital_path)
+    pix = doc[0].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    image = Image.frombytes('L', (pix.width, pix.height), pix.samples)
+    doc.close()
+
+    image = image.rotate(rng.uniform(-1.5, 1.5), resample=Image.BICUBIC, expand=False, fillcolor=255)
+    image = image.filter(ImageFilter.GaussianBlur(radius=rng.uniform(0.3, 0.9)))
+    pixels = np.asarray(image, dtype=np.int16)
+    noise = np.random.default_rng(rng.randint(0, 2 ** 31)).normal(0, 12, pixels.shape)
+    pixels = np.clip(pixels + noise, 0, 255).astype(np.uint8)
+    image = Image.fromarray(pixels)
+
+    # JPEG round trip adds the block artefacts real scans have
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=rng.randint(45, 75))
+    buffer.seek(0)
+    Image.open(buffer).convert('RGB').save(path, 'PDF', resolution=dpi)
+
+
+def generate_corpus(output_dir, count, scanned_fraction=0.3, seed=0, font_path=None, start_number=1000):
+    """
+    Writes `count` invoices plus ground_truth.jsonl to output_dir.
+
+    Parameters:
+        output_dir (str): Target directory, created if missing.
+        count (int): Number of invoices.
+        scanned_fraction (float): Share of invoices written as noisy image-only scans.
+        seed (int): Random seed; the same seed always produces the same corpus.
+        font_path (str, optional): TTF with a rupee glyph; falls back to "Rs." without one.
+        start_number (int): First invoice number.
+
+    Returns:
+        list: ground-truth records, each with "file_name", "kind" and the 22 fields.
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    font_path = find_font(font_path)
+    rupee = '₹' if font_path else 'Rs.'
+
+    records = []
+    for i in range(count):
+        truth, extras = make_invoice(rng, start_number + i)
+        scanned = rng.random() < scanned_fraction
+        file_name = f"{truth['Invoice No.']}{'_scan' if scanned else ''}.pdf"
+        path = os.path.join(output_dir, file_name)
+        lines = invoice_lines(truth, extras, rupee)
+        if scanned:
+            digital_path = path + '.digital.tmp'
+            render_digital(lines, digital_path, font_path)
+            render_scanned(digital_path, path, rng)
+            os.remove(digital_path)
+        else:
+            render_digital(lines, path, font_path)
+        records.append({'file_name': file_name, 'kind': 'scanned' if scanned else 'digital',
+                        **{field: truth[field] for field in INVOICE_FIELDS}})
+
+    with open(os.path.join(output_dir, 'ground_truth.jsonl'), 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return records
+
+
+def load_ground_truth(corpus_dir):
+    with open(os.path.join(corpus_dir, 'ground_truth.jsonl'), 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic GST invoice corpus with ground truth.")
+    parser.add_argument('--count', type=int, default=50)
+    parser.add_argument('--scanned-fraction', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--font', default=None, help='TTF font with a rupee glyph')
+    parser.add_argument('--output', default=os.path.join('benchmarks', 'corpus'))
+    args = parser.parse_args()
+
+    records = generate_corpus(args.output, args.count, args.scanned_fraction, args.seed, args.font)
+    scanned = sum(1 for record in records if record['kind'] == 'scanned')
+    print(f"Wrote {len(records)} invoices ({scanned} scanned) to {args.output}")
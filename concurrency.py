@@ -0,0 +1,312 @@
+"""
+Adaptive concurrency limits (AIMD): how much work is in flight is learnt from how the work goes.
+
+A limiter admits up to `limit` callers at once. Each finished call reports its latency and whether
+it was pushed back (an HTTP 429, a starved CPU). About once per round of `limit` calls the limiter
+looks at the p95 latency of that round:
+
+    pushed back, or p95 well above the running baseline  ->  limit *= decrease  (multiplicative)
+    otherwise                                              ->  limit += increase  (additive)
+
+so concurrency climbs while the provider keeps up and halves as soon as it stops. Calls started
+before a decrease cannot trigger another one, so a burst of 429s from one round halves the limit
+once, not once per request. The limit is published as the gauge
+invoice_extraction_concurrency_limit{limiter="..."}.
+
+Slow outliers are cut by hedging (HedgePolicy): a call still running after the p95 latency is sent
+once more and whichever answer arrives first is used. Hedges are capped at a small share of calls,
+so they never amount to more than a few percent of extra load.
+
+Usage:
+    limiter = shared_limiter("llm", initial=4, maximum=32)
+    with limiter.slot() as slot:
+        response = requests.post(...)
+        if response.status_code == 429:
+            slot.pushed_back()
+
+    response = shared_hedge_policy("llm", fraction=0.05).run(lambda hedge: send(hedge))
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import lru_cache
+
+from instrumentation import Histogram, recorder
+
+# ===========================
+# 1. Limiter
+# ===========================
+
+# Completions per adjustment never drop below this, so a limit of 1 does not react to a single sample
+MIN_ROUND = 5
+# A round whose p95 exceeds the baseline by this factor counts as a latency spike
+LATENCY_TOLERANCE = 2.0
+# Weight of each round's p95 in the baseline, which follows slow drifts in provider latency
+BASELINE_WEIGHT = 0.1
+
+
+class Slot:
+    """
+    One admitted call; lets the caller report push-back known only from the outcome.
+    """
+
+    def __init__(self, epoch):
+        self.epoch = epoch
+        self.overloaded = False
+
+    def pushed_back(self):
+        self.overloaded = True
+
+
+class AdaptiveLimiter:
+    """
+    Admission control with an AIMD limit.
+
+    Parameters:
+        name (str): Label of the limit gauge.
+        initial (int): Starting limit.
+        minimum, maximum (int): Bounds of the limit.
+        increase (float): Added to the limit after a healthy round.
+        decrease (float): Factor the limit is multiplied by on push-back or a latency spike.
+        latency_tolerance (float): p95 over baseline ratio treated as a spike.
+    """
+
+    def __init__(self, name, initial, minimum=1, maximum=64, increase=1.0, decrease=0.5,
+                 latency_tolerance=LATENCY_TOLERANCE):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.epoch = 0
+        self.baseline = None
+        self.round = Histogram()
+        self.round_size = 0
+        self.round_overloaded = False
+        self.condition = threading.Condition()
+        self._publish()
+
+    def acquire(self, timeout=None):
+        """
+        Waits for room under the limit.
+
+        Parameters:
+            timeout (float, optional): Most seconds to wait; None waits for as long as it takes.
+
+        Returns:
+            Slot, or None when the timeout passed first.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                return None
+            return self._admit()
+
+    def try_acquire(self):
+        """
+        A slot if the limit has room right now, otherwise None; for optional work such as hedges.
+        """
+        with self.condition:
+            return self._admit() if self.in_flight < int(self.limit) else None
+
+    def _admit(self):
+        self.in_flight += 1
+        recorder.gauge("concurrency_in_flight", self.in_flight, limiter=self.name)
+        return Slot(self.epoch)
+
+    def release(self, slot, latency=None):
+        """
+        Ends a call admitted by acquire() and feeds its outcome to the limit.
+
+        Parameters:
+            slot (Slot): What acquire() returned.
+            latency (float, optional): Seconds the call took; None when latency says nothing (CPU work).
+        """
+        with self.condition:
+            self.in_flight -= 1
+            recorder.gauge("concurrency_in_flight", self.in_flight, limiter=self.name)
+            # Calls admitted before the last decrease reflect the old limit, not the current one
+            if slot.epoch == self.epoch:
+                if slot.overloaded:
+                    self.round_overloaded = True
+                if latency is not None:
+                    self.round.observe(latency)
+                self.round_size += 1
+                if self.round_overloaded or self.round_size >= max(MIN_ROUND, int(self.limit)):
+                    self._adjust()
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self, measure_latency=True):
+        """
+        Holds a slot for the duration of the with block, timing it unless measure_latency is False.
+        """
+        slot = self.acquire()
+        start = time.perf_counter()
+        try:
+            yield slot
+        finally:
+            self.release(slot, time.perf_counter() - start if measure_latency else None)
+
+    def _adjust(self):
+        p95 = self.round.percentile(95) if self.round.count else None
+        spike = p95 is not None and self.baseline is not None and p95 > self.baseline * self.latency_tolerance
+        if self.round_overloaded or spike:
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            self.epoch += 1
+        else:
+            self.limit = min(self.maximum, self.limit + self.increase)
+        # Spikes are left out of the baseline so a slow provider keeps being treated as slow
+        if p95 is not None and not spike:
+            self.baseline = p95 if self.baseline is None else (1 - BASELINE_WEIGHT) * self.baseline + BASELINE_WEIGHT * p95
+        self.round = Histogram()
+        self.round_size = 0
+        self.round_overloaded = False
+        self._publish()
+
+    def _publish(self):
+        recorder.gauge("concurrency_limit", int(self.limit), limiter=self.name)
+
+
+@lru_cache(maxsize=None)
+def shared_limiter(name, initial, minimum=1, maximum=64):
+    """
+    One limiter per name and process, shared by every thread that makes that kind of call.
+    """
+    return AdaptiveLimiter(name, initial, minimum, maximum)
+
+# ===========================
+# 2. Hedged Calls
+# ===========================
+
+# Primary calls observed before hedging starts, so the p95 means something
+MIN_HEDGE_SAMPLES = 20
+
+
+class HedgePolicy:
+    """
+    Runs calls with a hedge: a duplicate sent when the first attempt outlives the p95 latency.
+
+    Parameters:
+        name (str): Label of the hedge counters.
+        fraction (float): Most hedges per call, e.g. 0.05; 0 disables hedging.
+        percentile (float): Latency percentile after which a call is hedged.
+        max_workers (int): Threads the attempts run on; at least the calls in flight, times two.
+    """
+
+    def __init__(self, name, fraction, percentile=95, max_workers=64):
+        self.name = name
+        self.fraction = fraction
+        self.percentile = percentile
+        self.latencies = Histogram()
+        self.calls = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"hedge-{name}")
+
+    def delay(self):
+        """
+        Seconds after which a call is hedged, or None while there are too few samples.
+        """
+        with self.lock:
+            if self.latencies.count < MIN_HEDGE_SAMPLES:
+                return None
+            return self.latencies.percentile(self.percentile)
+
+    def _observe(self, start, future):
+        if not future.cancelled() and future.exception() is None:
+            with self.lock:
+                self.latencies.observe(time.perf_counter() - start)
+
+    def _allow_hedge(self):
+        with self.lock:
+            if self.hedges + 1 > self.fraction * self.calls:
+                return False
+            self.hedges += 1
+        recorder.record("hedge", 0.0, hedges=1)
+        return True
+
+    def run(self, call):
+        """
+        Runs call(False) and, if it is still running after delay(), call(True) next to it.
+
+        Parameters:
+            call (callable): Takes hedge (bool). A hedge may return None to say it has nothing to
+                offer (no room under the rate limit, an error response), and then the first attempt
+                is waited for.
+
+        Returns:
+            The first attempt's result, or the hedge's when that arrives first. The losing attempt
+            cannot be interrupted mid-request; it finishes (within its timeout) and is discarded.
+        """
+        with self.lock:
+            self.calls += 1
+        start = time.perf_counter()
+        primary = self.pool.submit(call, False)
+        # Only first attempts shape the latency distribution, whether or not they win
+        primary.add_done_callback(lambda future: self._observe(start, future))
+        delay = self.delay() if self.fraction > 0 else None
+        if delay is None or wait([primary], timeout=delay).done or not self._allow_hedge():
+            return primary.result()
+
+        hedge = self.pool.submit(call, True)
+        done, _ = wait([primary, hedge], return_when=FIRST_COMPLETED)
+        if hedge in done and hedge.exception() is None and hedge.result() is not None:
+            recorder.record("hedge", 0.0, hedge_wins=1)
+            return hedge.result()
+        if primary in done and primary.exception() is None:
+            return primary.result()
+        # One attempt failed; the other is the answer
+        wait([primary, hedge])
+        if hedge.exception() is None and hedge.result() is not None:
+            recorder.record("hedge", 0.0, hedge_wins=1)
+            return hedge.result()
+        return primary.result()
+
+
+@lru_cache(maxsize=None)
+def shared_hedge_policy(name, fraction, percentile=95, max_workers=64):
+    """
+    One hedge policy per name and process, so its latency distribution covers every caller.
+    """
+    return HedgePolicy(name, fraction, percentile, max_workers)
+
+# ===========================
+# 3. CPU Saturation
+# ===========================
+
+# A CPU-bound task that got less than this share of a core while it ran was competing for the CPUs
+MIN_CPU_SHARE = 0.75
+
+
+class CpuMeter:
+    """
+    CPU time used by this process and its finished children (Tesseract runs as one) over a task,
+    against the wall time the task took.
+
+    Usage:
+        meter = CpuMeter()
+        ...
+        starved = meter.share() < MIN_CPU_SHARE
+    """
+
+    def __init__(self):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = _cpu_seconds()
+
+    def share(self):
+        wall = time.perf_counter() - self.start_wall
+        return (_cpu_seconds() - self.start_cpu) / wall if wall > 0 else 1.0
+
+
+def _cpu_seconds():
+    try:
+        import resource
+    except ImportError:
+        # No getrusage (Windows): process time of this process only
+        return time.process_time()
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
@@ -5,3 +5,22 @@ headers = {
     "Content-Type": "application/json",
     "api-key": GPT4V_KEY,
 }
+
+# Invoice schema shared by the extractors, benchmarks and evaluation
+INVOICE_FIELDS = [
+    'Invoice No.', 'Quantity', 'Date', 'Amount', 'Total',
+    'Email', 'Address', 'Taxable Value', 'SGST Amount',
+    'CGST Amount', 'IGST Amount', 'SGST Rate', 'CGST Rate',
+    'IGST Rate', 'Tax Amount', 'Tax Rate', 'Final Amount',
+    'Invoice Date', 'Place of Supply', 'Place of Origin',
+    'GSTIN Supplier', 'GSTIN Recipient',
+]
+
+# USD per 1K tokens; "cached" is the discounted rate for prompt tokens served from the provider's
+# prompt cache (models without one bill them as ordinary prompt tokens)
+MODEL_PRICES = {
+    'gpt-4': {'prompt': 0.03, 'completion': 0.06},
+    'gpt-4o': {'prompt': 0.005, 'completion': 0.015, 'cached': 0.0025},
+    'gpt-4o-mini': {'prompt': 0.00015, 'completion': 0.0006, 'cached': 0.000075},
+    'gemini-1.5-flash': {'prompt': 0.000075, 'completion': 0.0003, 'cached': 0.00001875},
+}
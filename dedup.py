@@ -0,0 +1,204 @@
+import hashlib
+import json
+import re
+import sqlite3
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from normalize import to_dates, to_paise
+
+# ===========================
+# 1. Configuration
+# ===========================
+
+DEDUP_DB = "invoice_dedup.sqlite3"
+
+# MinHash / LSH: 128 permutations in 32 bands of 4 rows makes pairs above ~0.45 Jaccard candidates;
+# candidates are then confirmed on the estimated Jaccard, which OCR noise on a rescan pulls down to ~0.7-0.8
+NUM_PERM = 128
+BANDS = 32
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_SIZE = 7
+NEAR_DUPLICATE_THRESHOLD = 0.7
+
+# Invoices from one template share most of their text, so a near-duplicate must also agree on
+# the tokens that carry digits (invoice number, dates, amounts, GSTIN); different invoices score < 0.2
+NUMERIC_TOKEN_THRESHOLD = 0.6
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# Fixed seed: signatures are stored, so the permutations must be identical across runs
+_rng = np.random.default_rng(20240101)
+_PERM_A = _rng.integers(1, (1 << 61) - 1, NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, (1 << 61) - 1, NUM_PERM, dtype=np.uint64)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    sha256 TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    batch_id TEXT,
+    seen_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS invoices (
+    invoice_key TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    file_name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS signatures (
+    sha256 TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    minhash BLOB NOT NULL,
+    numeric_tokens TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lsh_buckets (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lsh_lookup ON lsh_buckets (band, bucket);
+"""
+
+# ===========================
+# 2. Keys and Signatures
+# ===========================
+
+
+def file_sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def invoice_key(record):
+    """
+    Normalised (GSTIN Supplier, Invoice No., Invoice Date, Final Amount) key, or None when any part is missing.
+    """
+    gstin = re.sub(r'\s+', '', str(record.get('GSTIN Supplier') or '')).upper()
+    number = re.sub(r'\s+', '', str(record.get('Invoice No.') or '')).upper()
+    date = to_dates(pd.Series([record.get('Invoice Date') or record.get('Date')], dtype=object)).iat[0]
+    paise = to_paise(pd.Series([record.get('Final Amount')], dtype=object)).iat[0]
+    if not gstin or not number or pd.isna(date) or pd.isna(paise):
+        return None
+    return f"{gstin}|{number}|{date.date().isoformat()}|{int(paise)}"
+
+
+def _normalise_text(text):
+    return re.sub(r'\s+', ' ', re.sub(r'[^0-9a-z₹.,/\-@ ]', ' ', text.lower())).strip()
+
+
+def numeric_tokens(text):
+    return sorted({token for token in _normalise_text(text).split() if any(ch.isdigit() for ch in token)})
+
+
+def minhash(text):
+    """
+    MinHash signature of the text's character shingles, computed for all permutations at once.
+    """
+    text = _normalise_text(text)
+    if len(text) < SHINGLE_SIZE:
+        text = text.ljust(SHINGLE_SIZE)
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # (a * x + b) mod p for every permutation x shingle pair; uint64 wrap-around is part of the hash
+    with np.errstate(over='ignore'):
+        permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=1)
+
+
+def band_buckets(signature):
+    bands = signature.reshape(BANDS, ROWS_PER_BAND)
+    return [int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=7).digest(), 'big') for band in bands]
+
+
+def _jaccard(a, b):
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+# ===========================
+# 3. Persistent Index
+# ===========================
+
+
+class DedupIndex:
+    """
+    SQLite-backed memory of every invoice already extracted, across uploads and batches.
+
+    Lookups run in pipeline order so each one saves the most work:
+        check_file     - exact file hash, before any text extraction or OCR
+        check_text     - near-duplicate text (rescans, re-exports), before the LLM call
+        check_invoice  - same supplier GSTIN, invoice number, date and final amount, before export
+
+    Usage:
+        index = DedupIndex()
+        duplicate = index.check_file(pdf_bytes)
+        ...
+        index.add(sha, file_name, text=text, record=data_dict)
+    """
+
+    def __init__(self, path=DEDUP_DB, batch_id=None):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.batch_id = batch_id or time.strftime('%Y%m%d-%H%M%S')
+
+    def check_file(self, data):
+        """
+        Returns (sha256, duplicate) where duplicate is None or a dict with kind and duplicate_of.
+        """
+        sha = file_sha256(data)
+        row = self.conn.execute("SELECT file_name, batch_id FROM files WHERE sha256 = ?", (sha,)).fetchone()
+        if row:
+            return sha, {'kind': 'identical file', 'duplicate_of': row[0], 'batch': row[1]}
+        return sha, None
+
+    def check_text(self, text, sha=None):
+        signature = minhash(text)
+        tokens = numeric_tokens(text)
+        candidates = set()
+        for band, bucket in enumerate(band_buckets(signature)):
+            candidates.update(sha256 for (sha256,) in self.conn.execute(
+                "SELECT sha256 FROM lsh_buckets WHERE band = ? AND bucket = ?", (band, bucket)))
+        candidates.discard(sha)
+        best = None
+        for candidate in candidates:
+            file_name, blob, stored_tokens = self.conn.execute(
+                "SELECT file_name, minhash, numeric_tokens FROM signatures WHERE sha256 = ?", (candidate,)).fetchone()
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint64) == signature))
+            if similarity < NEAR_DUPLICATE_THRESHOLD:
+                continue
+            if _jaccard(tokens, json.loads(stored_tokens)) < NUMERIC_TOKEN_THRESHOLD:
+                continue
+            if best is None or similarity > best['similarity']:
+                best = {'kind': 'near-duplicate text', 'duplicate_of': file_name, 'similarity': round(similarity, 3)}
+        return best
+
+    def check_invoice(self, record, sha=None):
+        key = invoice_key(record)
+        if key is None:
+            return None
+        # The same file is the file-hash check's business; here only other files count
+        row = self.conn.execute("SELECT file_name FROM invoices WHERE invoice_key = ? AND sha256 != ?",
+                                (key, sha or '')).fetchone()
+        return {'kind': 'same invoice', 'duplicate_of': row[0]} if row else None
+
+    def add(self, sha, file_name, text=None, record=None):
+        """
+        Registers a successfully extracted document so later uploads can be matched against it.
+        """
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?)",
+                              (sha, file_name, self.batch_id, time.time()))
+            if text:
+                signature = minhash(text)
+                inserted = self.conn.execute("INSERT OR IGNORE INTO signatures VALUES (?, ?, ?, ?)",
+                                             (sha, file_name, signature.tobytes(), json.dumps(numeric_tokens(text))))
+                if inserted.rowcount:
+                    self.conn.executemany(
+                        "INSERT INTO lsh_buckets VALUES (?, ?, ?)",
+                        [(band, bucket, sha) for band, bucket in enumerate(band_buckets(signature))])
+            key = invoice_key(record) if record else None
+            if key:
+                self.conn.execute("INSERT OR IGNORE INTO invoices VALUES (?, ?, ?)", (key, sha, file_name))
+
+    def close(self):
+        self.conn.close()
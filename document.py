@@ -0,0 +1,225 @@
+"""
+One PDF held in memory once and shared, without copies, by everything that reads it.
+
+An upload is wrapped in a memoryview of Streamlit's own buffer and a file on disk is memory-mapped,
+so the bytes are never read twice, spilled to temporary files or copied per page. pypdf and
+pdfplumber read it through a seekable stream over the buffer, PyMuPDF opens the buffer directly,
+and pages are rasterised by PyMuPDF from that same open document, in process: no pdftoppm
+subprocess and no PPM files, as with pdf2image. Pages come out as NumPy arrays (for Tesseract
+or further image processing) or PIL images (for JPEG upload), in RGB or grayscale, whole or
+clipped to a region.
+
+close() (or leaving the with block) releases the buffer, the PyMuPDF document and the mapping
+straight away instead of whenever the garbage collector gets to them; closing twice is harmless.
+
+Usage:
+    with Document.from_upload(uploaded_file) as document:
+        reader = document.pdf_reader()
+        for number, image in document.render([1, 3]):
+            ...
+        for number, array in document.render_arrays(dpi=300, colorspace="gray"):
+            ...
+"""
+import hashlib
+import io
+import mmap
+import os
+
+# ===========================
+# 1. Buffer Stream
+# ===========================
+
+# pdf2image's default, which the OCR paths have always rendered at
+RENDER_DPI = 200
+
+# Colourspace name -> channels; Tesseract binarises internally, so grayscale loses it nothing
+COLORSPACES = {'rgb': 3, 'gray': 1}
+
+
+class BufferStream(io.RawIOBase):
+    """
+    Read-only, seekable file object over a memoryview; reads copy only the bytes asked for.
+    """
+
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, target):
+        chunk = self.view[self.position:self.position + len(target)]
+        target[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.view)}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+# ===========================
+# 2. Document
+# ===========================
+
+
+class Document:
+    """
+    A PDF backed by one shared buffer.
+
+    Parameters:
+        buffer (memoryview): The PDF bytes.
+        name (str, optional): File name for logs and results.
+        path (str, optional): File the buffer maps, so worker processes can map it too.
+    """
+
+    def __init__(self, buffer, name=None, path=None, closers=()):
+        self.buffer = buffer
+        self.name = name
+        self.path = path
+        self._closers = list(closers)
+        self._fitz = None
+        self._sha256 = None
+
+    @classmethod
+    def from_upload(cls, upload, name=None):
+        """
+        Wraps a Streamlit UploadedFile (or any BytesIO) without copying; other file objects are read once.
+        """
+        name = name or getattr(upload, 'name', None)
+        if isinstance(upload, io.BytesIO):
+            return cls(upload.getbuffer(), name)
+        upload.seek(0)
+        return cls(memoryview(upload.read()), name)
+
+    @classmethod
+    def from_path(cls, path, name=None):
+        """
+        Memory-maps a file: pages are loaded by the OS as they are read and shared with other processes.
+        """
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return cls(memoryview(b""), name or os.path.basename(path), path)
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(memoryview(mapping), name or os.path.basename(path), path, closers=[mapping.close])
+
+    @classmethod
+    def from_bytes(cls, data, name=None):
+        return cls(memoryview(data), name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.buffer.nbytes
+
+    @property
+    def sha256(self):
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.buffer).hexdigest()
+        return self._sha256
+
+    def stream(self):
+        """
+        A new seekable file object over the buffer, for pypdf, pdfplumber and the like.
+        """
+        return BufferStream(self.buffer)
+
+    def source(self):
+        """
+        What a worker process needs to open this document again: the path when it is a file
+        (mapped there too, nothing is sent), otherwise the bytes.
+        """
+        return self.path if self.path is not None else self.buffer.tobytes()
+
+    @classmethod
+    def open_source(cls, source, name=None):
+        return cls.from_path(source, name) if isinstance(source, str) else cls.from_bytes(source, name)
+
+    def pdf_reader(self):
+        from pypdf import PdfReader
+
+        return PdfReader(self.stream())
+
+    def fitz(self):
+        """
+        The PyMuPDF document, opened on the buffer on first use and closed with this document.
+        """
+        if self._fitz is None:
+            import fitz  # PyMuPDF
+
+            self._fitz = fitz.open(stream=self.buffer, filetype="pdf")
+        return self._fitz
+
+    @property
+    def page_count(self):
+        return self.fitz().page_count
+
+    def pixmap(self, number, dpi=RENDER_DPI, colorspace='rgb', clip=None):
+        """
+        Rasterises one page into a PyMuPDF pixmap.
+
+        Parameters:
+            number (int): 1-based page number.
+            dpi (int): Resolution.
+            colorspace (str): "rgb" or "gray".
+            clip (tuple, optional): (x0, y0, x1, y1) region of the page in PDF points (1/72 inch,
+                origin top left); only that region is rendered.
+        """
+        import fitz  # PyMuPDF
+
+        if colorspace not in COLORSPACES:
+            raise ValueError(f"Unknown colourspace {colorspace!r}; expected one of {sorted(COLORSPACES)}")
+        page = self.fitz()[number - 1]
+        return page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY if colorspace == 'gray' else fitz.csRGB,
+                               clip=clip, alpha=False)
+
+    def render_arrays(self, page_numbers=None, dpi=RENDER_DPI, colorspace='rgb', clip=None):
+        """
+        Rasterises pages into NumPy arrays, one at a time, so only one page is alive at once.
+
+        Parameters:
+            page_numbers (list, optional): 1-based page numbers; all pages by default.
+            dpi, colorspace, clip: See pixmap().
+
+        Yields:
+            tuple: (page number, uint8 array of shape (height, width, 3) for RGB or (height, width) for gray).
+        """
+        import numpy as np
+
+        for number in page_numbers or range(1, self.page_count + 1):
+            pixmap = self.pixmap(number, dpi, colorspace, clip)
+            array = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+            yield number, array[:, :, 0] if pixmap.n == 1 else array
+
+    def render(self, page_numbers=None, dpi=RENDER_DPI, colorspace='rgb', clip=None):
+        """
+        Like render_arrays, but yields PIL images ("RGB" or "L"), e.g. for JPEG encoding.
+        """
+        from PIL import Image
+
+        for number in page_numbers or range(1, self.page_count + 1):
+            pixmap = self.pixmap(number, dpi, colorspace, clip)
+            mode = "L" if pixmap.n == 1 else "RGB"
+            yield number, Image.frombytes(mode, (pixmap.width, pixmap.height), pixmap.samples)
+
+    def close(self):
+        if self._fitz is not None:
+            self._fitz.close()
+            self._fitz = None
+        if self.buffer is not None:
+            self.buffer.release()
+            self.buffer = None
+        for closer in self._closers:
+            closer()
+        self._closers = []
@@ -0,0 +1,287 @@
+"""
+Scores extractor output against labelled ground truth and relates accuracy to latency and cost.
+
+Usage (from the repository root, on a benchmark run written with --output):
+    python -m evaluation --ground-truth benchmarks/corpus/ground_truth.jsonl --results bench.json --chart tradeoff.png
+"""
+import argparse
+import json
+import re
+from datetime import datetime
+
+import pandas as pd
+
+from config import INVOICE_FIELDS, MODEL_PRICES
+
+# ===========================
+# 1. Field Types
+# ===========================
+
+AMOUNT_FIELDS = {
+    'Amount', 'Total', 'Taxable Value', 'SGST Amount', 'CGST Amount',
+    'IGST Amount', 'Tax Amount', 'Final Amount',
+}
+RATE_FIELDS = {'SGST Rate', 'CGST Rate', 'IGST Rate', 'Tax Rate'}
+QUANTITY_FIELDS = {'Quantity'}
+DATE_FIELDS = {'Date', 'Invoice Date'}
+GSTIN_FIELDS = {'GSTIN Supplier', 'GSTIN Recipient'}
+
+DATE_FORMATS = ('%d/%m/%Y', '%d %b %Y', '%d %B %Y', '%d-%m-%Y', '%Y-%m-%d', '%d.%m.%Y', '%d-%b-%Y', '%b %d, %Y')
+
+
+def field_type(field):
+    if field in AMOUNT_FIELDS:
+        return 'amount'
+    if field in RATE_FIELDS:
+        return 'rate'
+    if field in QUANTITY_FIELDS:
+        return 'quantity'
+    if field in DATE_FIELDS:
+        return 'date'
+    if field in GSTIN_FIELDS:
+        return 'gstin'
+    return 'text'
+
+# ===========================
+# 2. Normalisation
+# ===========================
+
+
+def parse_number(value):
+    """
+    Parses "₹1,483.32", "Rs. 350", "18%" or 1483.32 into a float; None when there is no number.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r'-?\d+(?:\.\d+)?', str(value).replace(',', ''))
+    return float(match.group(0)) if match else None
+
+
+def parse_date(value):
+    text = ' '.join(str(value).split())
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def normalise_text(value):
+    # Case, whitespace and punctuation around separators do not change the meaning of an address or name
+    text = ' '.join(str(value).split()).casefold()
+    return re.sub(r'\s*([,;:\-])\s*', r'\1', text).strip(' .,')
+
+
+def is_blank(value):
+    return value is None or (isinstance(value, (str, list, dict)) and not value) or str(value).strip() == ''
+
+
+def exact_match(expected, actual):
+    if is_blank(actual):
+        return is_blank(expected)
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        return float(expected) == float(actual)
+    candidates = {str(expected).strip()}
+    if isinstance(expected, float):
+        candidates.add(f"{expected:.2f}")
+    return str(actual).strip() in candidates
+
+
+def normalised_match(field, expected, actual, amount_tolerance=0.01, rate_tolerance=0.01):
+    """
+    Type-aware comparison of one field.
+
+    Parameters:
+        field (str): Schema field name, selects the comparison.
+        expected: Ground-truth value.
+        actual: Extracted value (string, number or list, as extractors return them).
+        amount_tolerance (float): Absolute tolerance for amounts, in rupees.
+        rate_tolerance (float): Absolute tolerance for rates and quantities.
+
+    Returns:
+        bool: True if the values mean the same thing.
+    """
+    if is_blank(expected) or is_blank(actual):
+        return is_blank(expected) and is_blank(actual)
+    kind = field_type(field)
+    if kind in ('amount', 'rate', 'quantity'):
+        tolerance = amount_tolerance if kind == 'amount' else rate_tolerance
+        expected_number = parse_number(expected)
+        # Extractors report several line-item rates as a list; it matches when every rate agrees
+        values = actual if isinstance(actual, list) else [actual]
+        numbers = [parse_number(value) for value in values]
+        return expected_number is not None and all(
+            number is not None and abs(number - expected_number) <= tolerance for number in numbers)
+    if kind == 'date':
+        expected_date, actual_date = parse_date(expected), parse_date(actual)
+        if expected_date and actual_date:
+            return expected_date == actual_date
+    if kind == 'gstin':
+        return re.sub(r'\s', '', str(actual)).upper() == re.sub(r'\s', '', str(expected)).upper()
+    return normalise_text(actual) == normalise_text(expected)
+
+# ===========================
+# 3. Evaluation
+# ===========================
+
+
+def evaluate(predictions, ground_truth, fields=None, **tolerances):
+    """
+    Scores predictions field by field.
+
+    Parameters:
+        predictions (list): dicts with "file_name", "fields" and optionally "fields_supported";
+            only supported fields are scored for extractors that cover part of the schema.
+        ground_truth (list): dicts with "file_name" and the schema fields.
+        fields (list, optional): Fields to score; defaults to config.INVOICE_FIELDS.
+        **tolerances: amount_tolerance / rate_tolerance for normalised_match.
+
+    Returns:
+        pd.DataFrame: one row per (file_name, field) with expected, actual, exact and normalised.
+    """
+    fields = fields or INVOICE_FIELDS
+    truth_by_file = {record['file_name']: record for record in ground_truth}
+    rows = []
+    for prediction in predictions:
+        truth = truth_by_file.get(prediction['file_name'])
+        if truth is None:
+            continue
+        scored_fields = [field for field in prediction.get('fields_supported', fields) if field in fields]
+        extracted = prediction.get('fields') or {}
+        for field in scored_fields:
+            expected, actual = truth.get(field, ''), extracted.get(field, '')
+            rows.append({
+                'file_name': prediction['file_name'],
+                'field': field,
+                'expected': expected,
+                'actual': actual,
+                'exact': exact_match(expected, actual),
+                'normalised': normalised_match(field, expected, actual, **tolerances),
+            })
+    return pd.DataFrame(rows, columns=['file_name', 'field', 'expected', 'actual', 'exact', 'normalised'])
+
+
+def field_accuracy(scores):
+    """
+    Per-field exact and normalised accuracy from evaluate() output.
+    """
+    if scores.empty:
+        return pd.DataFrame(columns=['exact', 'normalised', 'documents'])
+    table = scores.groupby('field').agg(exact=('exact', 'mean'), normalised=('normalised', 'mean'),
+                                        documents=('file_name', 'nunique'))
+    return table.reindex([field for field in INVOICE_FIELDS if field in table.index])
+
+
+def estimate_cost(prompt_tokens, completion_tokens, model):
+    price = MODEL_PRICES.get(model)
+    if price is None:
+        return 0.0
+    return prompt_tokens / 1000 * price['prompt'] + completion_tokens / 1000 * price['completion']
+
+
+def summarise_configuration(name, scores, documents, seconds, prompt_tokens=0, completion_tokens=0, model=None):
+    """
+    One row of the accuracy-vs-cost table for a pipeline configuration.
+    """
+    documents = max(documents, 1)
+    return {
+        'configuration': name,
+        'documents': documents,
+        'exact_accuracy': float(scores['exact'].mean()) if len(scores) else 0.0,
+        'normalised_accuracy': float(scores['normalised'].mean()) if len(scores) else 0.0,
+        'seconds_per_doc': seconds / documents,
+        'cost_per_doc': estimate_cost(prompt_tokens, completion_tokens, model) / documents,
+        'cost_per_1k_docs': 1000 * estimate_cost(prompt_tokens, completion_tokens, model) / documents,
+    }
+
+
+def evaluate_benchmark_results(results, ground_truth, model_prices=None, **tolerances):
+    """
+    Builds the accuracy-vs-latency-vs-cost table from benchmarks.run_benchmark results.
+
+    Parameters:
+        results (list): Results from run_benchmark (each with extractor, records, seconds, stages).
+        ground_truth (list): Corpus ground truth.
+        model_prices (dict, optional): extractor name -> MODEL_PRICES key used to price its tokens.
+
+    Returns:
+        pd.DataFrame: one row per configuration.
+    """
+    model_prices = model_prices or {'gpt': 'gpt-4'}
+    rows = []
+    for result in results:
+        scores = evaluate(result['records'], ground_truth, **tolerances)
+        llm_stage = next((stage for stage in result.get('stages', []) if stage['stage'] == 'llm_call'), {})
+        rows.append(summarise_configuration(
+            result['extractor'],
+            scores,
+            result['documents'],
+            result['seconds'],
+            llm_stage.get('prompt_tokens', 0),
+            llm_stage.get('completion_tokens', 0),
+            model_prices.get(result['extractor']),
+        ))
+    return pd.DataFrame(rows)
+
+
+def plot_tradeoff(summary, path):
+    """
+    Saves accuracy vs seconds/doc and accuracy vs cost/1k docs scatter plots, one point per configuration.
+    Needs matplotlib (optional; not in requirements.txt).
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, (ax_latency, ax_cost) = plt.subplots(1, 2, figsize=(11, 4.5))
+    for _, row in summary.iterrows():
+        ax_latency.scatter(row['seconds_per_doc'], row['normalised_accuracy'])
+        ax_latency.annotate(row['configuration'], (row['seconds_per_doc'], row['normalised_accuracy']))
+        ax_cost.scatter(row['cost_per_1k_docs'], row['normalised_accuracy'])
+        ax_cost.annotate(row['configuration'], (row['cost_per_1k_docs'], row['normalised_accuracy']))
+    ax_latency.set_xlabel('Seconds per document')
+    ax_cost.set_xlabel('Cost per 1,000 documents (USD)')
+    for ax in (ax_latency, ax_cost):
+        ax.set_ylabel('Normalised field accuracy')
+        ax.set_ylim(0, 1.05)
+        ax.grid(alpha=0.3)
+    fig.suptitle('Accuracy vs latency and cost per pipeline configuration')
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    from benchmarks.synthetic_invoices import load_ground_truth
+    import os
+
+    parser = argparse.ArgumentParser(description="Score benchmark results against ground truth.")
+    parser.add_argument('--ground-truth', default=os.path.join('benchmarks', 'corpus', 'ground_truth.jsonl'))
+    parser.add_argument('--results', required=True, help='JSON written by benchmarks.run_benchmark --output')
+    parser.add_argument('--amount-tolerance', type=float, default=0.01)
+    parser.add_argument('--gpt-model', default='gpt-4', choices=sorted(MODEL_PRICES))
+    parser.add_argument('--chart', default=None, help='Save the accuracy vs latency/cost chart here')
+    args = parser.parse_args()
+
+    ground_truth = load_ground_truth(os.path.dirname(args.ground_truth))
+    with open(args.results, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+
+    summary = evaluate_benchmark_results(results, ground_truth, {'gpt': args.gpt_model},
+                                         amount_tolerance=args.amount_tolerance)
+    print(summary.to_string(index=False))
+    for result in results:
+        print(f"\n[{result['extractor']}] per-field accuracy")
+        scores = evaluate(result['records'], ground_truth, amount_tolerance=args.amount_tolerance)
+        print(field_accuracy(scores).to_string())
+    if args.chart:
+        try:
+            plot_tradeoff(summary, args.chart)
+            print(f"\nChart saved to {args.chart}")
+        except ImportError:
+            csv_path = os.path.splitext(args.chart)[0] + '.csv'
+            summary.to_csv(csv_path, index=False)
+            print(f"\nmatplotlib is not installed; wrote the table to {csv_path} instead")
@@ -0,0 +1,200 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from config import INVOICE_FIELDS
+from normalize import (
+    AMOUNT_COLUMNS, QUANTITY_COLUMNS, RATE_COLUMNS, DATE_COLUMNS, GSTIN_COLUMNS,
+    RATE_LIST_TYPE, normalize_invoices,
+)
+
+# ===========================
+# 1. Invoice Schema
+# ===========================
+
+# Rows buffered before a row group is appended; large enough for good Parquet compression,
+# small enough that a 100k-invoice batch never holds more than a few MB of records
+ROW_GROUP_SIZE = 1000
+
+
+def _field(field):
+    if field in AMOUNT_COLUMNS:
+        return pa.field(field, pa.int64(), metadata={'unit': 'paise'})
+    if field in QUANTITY_COLUMNS:
+        return pa.field(field, pa.float64())
+    if field in RATE_COLUMNS:
+        return pa.field(field, RATE_LIST_TYPE, metadata={'unit': 'percent'})
+    if field in DATE_COLUMNS:
+        return pa.field(field, pa.date32())
+    if field in GSTIN_COLUMNS:
+        return pa.field(field, pa.dictionary(pa.int32(), pa.string()))
+    return pa.field(field, pa.string())
+
+
+INVOICE_SCHEMA = pa.schema(
+    [pa.field('Source File', pa.string())]
+    + [_field(field) for field in INVOICE_FIELDS]
+    + [pa.field('Confidence', pa.string()), pa.field('Trust', pa.string()),
+       pa.field('Consistency Score', pa.float64()),
+       pa.field('Prompt Version', pa.dictionary(pa.int32(), pa.string()))]
+)
+
+
+def records_to_batch(records, schema=INVOICE_SCHEMA):
+    """
+    Normalises extracted records (LLM strings such as "₹1,483.32" or "01 Feb 2024") into the typed schema.
+    Values that cannot be parsed become nulls instead of failing the batch.
+
+    Parameters:
+        records (list): dicts keyed by schema column names; unknown keys are ignored.
+        schema (pa.Schema): Target schema.
+
+    Returns:
+        pa.RecordBatch: One batch with the schema's columns in order.
+    """
+    frame = normalize_invoices(pd.DataFrame.from_records(records, columns=schema.names))
+    for field in schema:
+        if field.name == 'Consistency Score':
+            frame[field.name] = pd.to_numeric(frame[field.name], errors='coerce')
+        elif pa.types.is_dictionary(field.type) and not isinstance(frame[field.name].dtype, pd.CategoricalDtype):
+            # A column no record of the batch has (older records without a Prompt Version) is all-NaN floats
+            frame[field.name] = frame[field.name].astype('string').astype('category')
+        elif pa.types.is_string(field.type):
+            frame[field.name] = frame[field.name].map(
+                lambda value: None if value is None or value != value else str(value))
+    return pa.RecordBatch.from_pandas(frame, schema=schema, preserve_index=False)
+
+# ===========================
+# 2. Streaming Writer
+# ===========================
+
+
+class InvoiceWriter:
+    """
+    Appends invoice records to a Parquet (.parquet) or Arrow IPC stream (.arrow / .arrows) file
+    one row group at a time, so memory stays flat however many documents a batch has.
+
+    Usage:
+        with InvoiceWriter("extracted_invoice_data.parquet") as writer:
+            for record in records:
+                writer.write(record)
+    """
+
+    def __init__(self, path, schema=INVOICE_SCHEMA, row_group_size=ROW_GROUP_SIZE, compression='zstd'):
+        self.path = path
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.buffer = []
+        self.rows_written = 0
+        if path.endswith('.parquet'):
+            self.writer = pq.ParquetWriter(path, schema, compression=compression)
+        elif path.endswith(('.arrow', '.arrows')):
+            self.sink = pa.OSFile(path, 'wb')
+            # The stream format, unlike the file format, allows each batch its own GSTIN dictionary
+            self.writer = ipc.new_stream(self.sink, schema,
+                                         options=ipc.IpcWriteOptions(compression=compression))
+        else:
+            raise ValueError(f"Unsupported export format for {path}; use .parquet, .arrow or .arrows")
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        batch = records_to_batch(self.buffer, self.schema)
+        if isinstance(self.writer, pq.ParquetWriter):
+            self.writer.write_batch(batch, row_group_size=self.row_group_size)
+        else:
+            self.writer.write_batch(batch)
+        self.rows_written += batch.num_rows
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        if hasattr(self, 'sink'):
+            self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+# ===========================
+# 3. On-Demand Conversions
+# ===========================
+
+
+def read_schema(path):
+    if path.endswith('.parquet'):
+        return pq.read_schema(path)
+    with pa.memory_map(path, 'r') as source:
+        return ipc.open_stream(source).schema
+
+
+def iter_batches(path, batch_size=ROW_GROUP_SIZE):
+    """
+    Yields record batches from a Parquet or Arrow IPC export without loading the whole file.
+    """
+    if path.endswith('.parquet'):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+    else:
+        with pa.memory_map(path, 'r') as source:
+            yield from ipc.open_stream(source)
+
+
+def spreadsheet_batch(batch):
+    """
+    Makes a batch spreadsheet-friendly: paise back to rupees, rate lists as "6,9", dictionaries decoded.
+    """
+    arrays, fields = [], []
+    for field, column in zip(batch.schema, batch.columns):
+        metadata = field.metadata or {}
+        if metadata.get(b'unit') == b'paise':
+            column = pc.divide(pc.cast(column, pa.float64()), 100.0)
+        elif pa.types.is_list(field.type):
+            column = pc.binary_join(pc.cast(column, pa.list_(pa.string())), ',')
+        elif pa.types.is_dictionary(field.type):
+            column = column.dictionary_decode()
+        arrays.append(column)
+        fields.append(pa.field(field.name, column.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def convert_export(path, target_path):
+    """
+    Converts a Parquet/IPC export to CSV or Excel, streaming batch by batch.
+    Excel is written with openpyxl's write-only mode, so rows are never all held in memory.
+
+    Parameters:
+        path (str): Source .parquet / .arrow / .arrows file.
+        target_path (str): Destination .csv or .xlsx file.
+
+    Returns:
+        str: target_path.
+    """
+    schema = spreadsheet_batch(pa.RecordBatch.from_pylist([], schema=read_schema(path))).schema
+    if target_path.endswith('.csv'):
+        with pa_csv.CSVWriter(target_path, schema) as writer:
+            for batch in iter_batches(path):
+                writer.write_batch(spreadsheet_batch(batch))
+    elif target_path.endswith('.xlsx'):
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Invoices')
+        sheet.append(schema.names)
+        for batch in iter_batches(path):
+            for row in zip(*(column.to_pylist() for column in spreadsheet_batch(batch).columns)):
+                sheet.append(list(row))
+        workbook.save(target_path)
+    else:
+        raise ValueError(f"Unsupported conversion target {target_path}; use .csv or .xlsx")
+    return target_path
@@ -0,0 +1,311 @@
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ===========================
+# 1. Histogram Storage
+# ===========================
+
+# Bucket upper bounds in seconds, from sub-millisecond JSON parsing up to multi-minute LLM calls
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Raw samples kept per histogram for exact percentiles; older samples roll off
+MAX_SAMPLES = 10000
+
+
+class Histogram:
+    """
+    Latency histogram with Prometheus-style cumulative buckets plus a bounded
+    window of raw samples for p50/p95/p99.
+    """
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.samples = []
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            self.bucket_counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.samples.append(seconds)
+        if len(self.samples) > MAX_SAMPLES:
+            del self.samples[:len(self.samples) - MAX_SAMPLES]
+
+    def percentile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        # Nearest-rank percentile
+        rank = min(len(ordered) - 1, max(0, math.ceil(q / 100.0 * len(ordered)) - 1))
+        return ordered[rank]
+
+
+class Recorder:
+    """
+    Collects span durations and numeric attributes (tokens, bytes, pages, ...)
+    per stage and per (stage, document), plus gauges such as the current concurrency limits.
+
+    Parameters:
+        parent (Recorder, optional): Also receives everything recorded here, and is not reset with it.
+    """
+
+    def __init__(self, parent=None):
+        self.lock = threading.Lock()
+        self.parent = parent
+        self.gauges = {}
+        self.reset()
+
+    def reset(self):
+        """
+        Drops the recorded spans, e.g. at the start of a batch; gauges hold current values and are kept.
+        """
+        with self.lock:
+            self.stages = {}
+            self.documents = {}
+            self.attributes = {}
+
+    def record(self, stage, seconds, doc=None, **attrs):
+        if self.parent is not None:
+            self.parent.record(stage, seconds, doc, **attrs)
+        with self.lock:
+            self.stages.setdefault(stage, Histogram()).observe(seconds)
+            if doc is not None:
+                self.documents.setdefault((stage, doc), Histogram()).observe(seconds)
+            for name, value in attrs.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    key = (stage, name)
+                    self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        """
+        Sets a gauge to its current value, e.g. gauge("concurrency_limit", 8, limiter="llm").
+        """
+        if self.parent is not None:
+            self.parent.gauge(name, value, **labels)
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def summary(self, per_document=False):
+        """
+        Summarises the recorded spans.
+
+        Parameters:
+            per_document (bool): Return one row per (stage, document) instead of per stage.
+
+        Returns:
+            list: dicts with stage, (document,) count, mean/p50/p95/p99/total seconds and attribute totals.
+        """
+        with self.lock:
+            source = self.documents if per_document else self.stages
+            rows = []
+            for key, histogram in source.items():
+                stage = key[0] if per_document else key
+                row = {'stage': stage}
+                if per_document:
+                    row['document'] = key[1]
+                row.update({
+                    'count': histogram.count,
+                    'mean_s': histogram.total / histogram.count if histogram.count else 0.0,
+                    'p50_s': histogram.percentile(50),
+                    'p95_s': histogram.percentile(95),
+                    'p99_s': histogram.percentile(99),
+                    'total_s': histogram.total,
+                })
+                if not per_document:
+                    for (attr_stage, name), value in self.attributes.items():
+                        if attr_stage == stage:
+                            row[name] = value
+                rows.append(row)
+            return rows
+
+    def to_prometheus(self, prefix='invoice_extraction'):
+        """
+        Renders the stage histograms and attribute totals in the Prometheus text exposition format.
+        """
+        lines = [
+            f'# HELP {prefix}_stage_duration_seconds Duration of pipeline stages.',
+            f'# TYPE {prefix}_stage_duration_seconds histogram',
+        ]
+        with self.lock:
+            for stage, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{stage}"}} {histogram.total}')
+                lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{stage}"}} {histogram.count}')
+            lines.append(f'# HELP {prefix}_stage_attribute_total Totals of numeric span attributes such as tokens and bytes.')
+            lines.append(f'# TYPE {prefix}_stage_attribute_total counter')
+            for (stage, name), value in sorted(self.attributes.items()):
+                lines.append(f'{prefix}_stage_attribute_total{{stage="{stage}",attribute="{name}"}} {value}')
+            for name in sorted({name for name, _ in self.gauges}):
+                lines.append(f'# TYPE {prefix}_{name} gauge')
+                for (gauge_name, labels), value in sorted(self.gauges.items()):
+                    if gauge_name == name:
+                        label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                        lines.append(f'{prefix}_{name}{{{label_text}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# Everything recorded since the process started, for the /metrics endpoint, whose counters must only grow
+totals = Recorder()
+# The current batch: reset at its start, for the batch's latency tables and metrics file
+recorder = Recorder(parent=totals)
+
+# ===========================
+# 2. OpenTelemetry (optional)
+# ===========================
+
+_tracer = None
+_tracer_checked = False
+
+
+def _get_tracer():
+    """
+    Returns an OpenTelemetry tracer exporting to the local collector named by
+    OTEL_EXPORTER_OTLP_ENDPOINT, or None when that variable or the SDK is missing.
+    """
+    global _tracer, _tracer_checked
+    if _tracer_checked:
+        return _tracer
+    _tracer_checked = True
+    endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+    if not endpoint:
+        return None
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        return None
+    provider = TracerProvider(resource=Resource.create({"service.name": "invoice-extraction"}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint.rstrip('/') + '/v1/traces')))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("invoice_extraction")
+    return _tracer
+
+# ===========================
+# 3. Public API
+# ===========================
+
+
+# Spans of the current thread go here instead of to the recorder while captured_spans() is active
+_capture = threading.local()
+
+
+class Span:
+    """
+    Handle yielded by span(); lets the caller attach attributes known only after the work, e.g. tokens.
+    """
+
+    def __init__(self, attrs):
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+@contextmanager
+def span(stage, doc=None, **attrs):
+    """
+    Times a pipeline stage.
+
+    Parameters:
+        stage (str): Stage name, e.g. "ocr" or "llm_call".
+        doc (str or None): Document the work belongs to, for per-document histograms.
+        **attrs: Numeric attributes (tokens, bytes, pages) summed per stage.
+
+    Usage:
+        with span("ocr", doc=file.name, page=3) as s:
+            text = pytesseract.image_to_string(image)
+            s.set(chars=len(text))
+    """
+    handle = Span(dict(attrs))
+    tracer = _get_tracer()
+    otel_span = tracer.start_span(stage) if tracer is not None else None
+    start = time.perf_counter()
+    try:
+        yield handle
+    finally:
+        elapsed = time.perf_counter() - start
+        captured = getattr(_capture, 'spans', None)
+        if captured is not None:
+            captured.append((stage, elapsed, doc, dict(handle.attrs)))
+        else:
+            recorder.record(stage, elapsed, doc, **handle.attrs)
+        if otel_span is not None:
+            if doc is not None:
+                otel_span.set_attribute("document", str(doc))
+            for name, value in handle.attrs.items():
+                if isinstance(value, (str, bool, int, float)):
+                    otel_span.set_attribute(name, value)
+            otel_span.end()
+
+
+@contextmanager
+def captured_spans():
+    """
+    Collects the spans of the with block as (stage, seconds, doc, attrs) tuples instead of recording
+    them. For pool worker processes, whose recorder nobody reads: the task returns the list and the
+    parent passes it to record_spans().
+    """
+    previous = getattr(_capture, 'spans', None)
+    _capture.spans = []
+    try:
+        yield _capture.spans
+    finally:
+        _capture.spans = previous
+
+
+def record_spans(spans):
+    """
+    Records spans collected by captured_spans(), e.g. in another process.
+    """
+    for stage, seconds, doc, attrs in spans:
+        recorder.record(stage, seconds, doc, **attrs)
+
+
+def write_prometheus(path, source=None):
+    """
+    Writes metrics in Prometheus text format, e.g. for node_exporter's textfile collector.
+
+    Parameters:
+        source (Recorder, optional): Metrics to write; the current batch's by default.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write((source or recorder).to_prometheus())
+    os.replace(tmp_path, path)
+
+
+def start_metrics_server(port=9464, host='127.0.0.1'):
+    """
+    Serves /metrics for a Prometheus scraper from a daemon thread and returns the server.
+    Its counters and histograms cover the life of the process, not one batch.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = totals.to_prometheus().encode('utf-8')
+            self.send_response(200 if self.path == '/metrics' else 404)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
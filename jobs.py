@@ -0,0 +1,333 @@
+"""
+Durable background extraction: a SQLite job queue and the worker processes that drain it.
+
+The Streamlit app only enqueues uploads and polls their status; workers run each job through
+app.process_document (dedup, OCR, LLM, reconcile, validate) and store the result.
+
+Usage (from the repository root, alongside `streamlit run app.py`):
+    python -m jobs worker --processes 4
+    python -m jobs status <batch_id>
+    python -m jobs retry <batch_id>
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# ===========================
+# 1. Configuration
+# ===========================
+
+JOBS_DB = "invoice_jobs.sqlite3"
+UPLOAD_DIR = "job_uploads"
+
+# A worker that stops heartbeating (crash, kill, OOM) loses its job after the lease expires
+LEASE_SECONDS = 300
+HEARTBEAT_SECONDS = LEASE_SECONDS / 3
+MAX_ATTEMPTS = 3
+# Failed attempts wait 30 s, 60 s, ... before they are picked up again (rate limits, API outages)
+RETRY_BACKOFF_SECONDS = 30
+POLL_SECONDS = 1.0
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+FINISHED_STATES = (DONE, FAILED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    skip_duplicates INTEGER NOT NULL DEFAULT 1,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_expires REAL,
+    worker TEXT,
+    error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (batch_id, sha256)
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, available_at);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id);
+"""
+
+# ===========================
+# 2. Job Queue
+# ===========================
+
+
+class JobQueue:
+    """
+    SQLite-backed job queue shared by the app and any number of worker processes.
+
+    Jobs move queued -> running -> done | failed. A running job holds a lease that its worker
+    renews; if the worker dies, the job is claimed again once the lease expires. Every state
+    change is guarded by the worker id, so a worker that lost its lease cannot overwrite the
+    result of the worker that took over.
+
+    Usage:
+        queue = JobQueue()
+        job_id = queue.enqueue(batch_id, file.name, file.getvalue())
+        ...
+        queue.batch_jobs(batch_id)
+    """
+
+    def __init__(self, path=JOBS_DB, upload_dir=UPLOAD_DIR):
+        self.upload_dir = upload_dir
+        # Autocommit; transactions are opened explicitly where reads and writes must be atomic
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def enqueue(self, batch_id, file_name, data, skip_duplicates=True, max_attempts=MAX_ATTEMPTS):
+        """
+        Stores the upload and queues it. Enqueueing the same file twice in a batch returns the existing job.
+
+        Returns:
+            int: The job id.
+        """
+        sha = hashlib.sha256(data).hexdigest()
+        os.makedirs(self.upload_dir, exist_ok=True)
+        file_path = os.path.join(self.upload_dir, f"{sha}.pdf")
+        if not os.path.exists(file_path):
+            # Written under a temporary name first so a worker never reads a partial upload
+            tmp_path = f"{file_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, file_path)
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR IGNORE INTO jobs (batch_id, file_name, file_path, sha256, skip_duplicates, max_attempts,"
+            " available_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (batch_id, file_name, file_path, sha, int(skip_duplicates), max_attempts, now, now, now))
+        return self.conn.execute("SELECT id FROM jobs WHERE batch_id = ? AND sha256 = ?",
+                                 (batch_id, sha)).fetchone()['id']
+
+    def claim(self, worker_id, lease_seconds=LEASE_SECONDS):
+        """
+        Takes the oldest runnable job: a queued one that is due, or a running one whose lease expired.
+
+        Returns:
+            dict or None: The job row, now running under worker_id.
+        """
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs that keep killing their worker are given up on instead of being retried forever
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, error = 'lease expired on the last attempt', updated_at = ?"
+                " WHERE state = ? AND lease_expires < ? AND attempts >= max_attempts",
+                (FAILED, now, RUNNING, now))
+            row = self.conn.execute(
+                "SELECT id FROM jobs WHERE (state = ? AND available_at <= ?) OR (state = ? AND lease_expires < ?)"
+                " ORDER BY id LIMIT 1", (QUEUED, now, RUNNING, now)).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, worker = ?, attempts = attempts + 1, lease_expires = ?, updated_at = ?"
+                " WHERE id = ?", (RUNNING, worker_id, now + lease_seconds, now, row['id']))
+            job = dict(self.conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone())
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return job
+
+    def heartbeat(self, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        """
+        Renews the lease; returns False if the job is no longer held by this worker.
+        """
+        now = time.time()
+        cursor = self.conn.execute(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND worker = ? AND state = ?",
+            (now + lease_seconds, now, job_id, worker_id, RUNNING))
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, result):
+        cursor = self.conn.execute(
+            "UPDATE jobs SET state = ?, result = ?, error = NULL, lease_expires = NULL, updated_at = ?"
+            " WHERE id = ? AND worker = ? AND state = ?",
+            (DONE, json.dumps(result, default=str), time.time(), job_id, worker_id, RUNNING))
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, worker_id, error):
+        """
+        Records a failed attempt: the job is queued again with backoff, or failed for good after max_attempts.
+        """
+        now = time.time()
+        cursor = self.conn.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts >= max_attempts THEN ? ELSE ? END,"
+            " available_at = ? + ? * (1 << (attempts - 1)), error = ?, lease_expires = NULL, updated_at = ?"
+            " WHERE id = ? AND worker = ? AND state = ?",
+            (FAILED, QUEUED, now, RETRY_BACKOFF_SECONDS, str(error), now, job_id, worker_id, RUNNING))
+        return cursor.rowcount == 1
+
+    def retry(self, batch_id):
+        """
+        Queues the failed jobs of a batch again with a fresh set of attempts.
+        """
+        now = time.time()
+        cursor = self.conn.execute(
+            "UPDATE jobs SET state = ?, attempts = 0, available_at = ?, updated_at = ? WHERE batch_id = ? AND state = ?",
+            (QUEUED, now, now, batch_id, FAILED))
+        return cursor.rowcount
+
+    def batch_jobs(self, batch_id):
+        jobs = [dict(row) for row in self.conn.execute("SELECT * FROM jobs WHERE batch_id = ? ORDER BY id", (batch_id,))]
+        for job in jobs:
+            job['result'] = json.loads(job['result']) if job['result'] else None
+        return jobs
+
+    def batch_counts(self, batch_id):
+        return {row['state']: row['n'] for row in self.conn.execute(
+            "SELECT state, COUNT(*) AS n FROM jobs WHERE batch_id = ? GROUP BY state", (batch_id,))}
+
+    def close(self):
+        self.conn.close()
+
+
+def batch_finished(counts):
+    return sum(counts.values()) > 0 and all(state in FINISHED_STATES for state in counts)
+
+# ===========================
+# 3. Workers
+# ===========================
+
+
+def _heartbeat(path, job_id, worker_id, lease_seconds, stop):
+    # SQLite connections stay in the thread that opened them
+    queue = JobQueue(path)
+    try:
+        while not stop.wait(HEARTBEAT_SECONDS):
+            if not queue.heartbeat(job_id, worker_id, lease_seconds):
+                logging.warning(f"Worker {worker_id} lost the lease on job {job_id}.")
+                return
+    finally:
+        queue.close()
+
+
+def run_job(queue, job, worker_id, path=JOBS_DB, lease_seconds=LEASE_SECONDS):
+    """
+    Runs one claimed job through the extraction pipeline and records the outcome.
+    """
+    from app import process_document
+    from dedup import DedupIndex
+    from document import Document
+
+    # A job claimed again after a crash may already be registered in the dedup index under its
+    # own batch id; that registration is not a duplicate, so reruns are idempotent
+    dedup_batch = f"job-{job['id']}"
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(path, job['id'], worker_id, lease_seconds, stop), daemon=True)
+    heartbeat.start()
+    dedup_index = DedupIndex(batch_id=dedup_batch)
+    try:
+        # Mapped rather than read, so the OCR processes map the same file instead of receiving copies
+        with Document.from_path(job['file_path'], job['file_name']) as document:
+            result = process_document(job['file_name'], document, dedup_index, bool(job['skip_duplicates']),
+                                      resume_batch=dedup_batch, cost_batch=job['batch_id'])
+    except Exception as e:
+        logging.error(f"Job {job['id']} ({job['file_name']}) failed on attempt {job['attempts']}: {e}")
+        queue.fail(job['id'], worker_id, e)
+        return
+    finally:
+        stop.set()
+        heartbeat.join()
+        dedup_index.close()
+
+    # A failed API call or unparseable answer is usually transient, so it is retried; a job paused by
+    # the batch budget waits out its attempts and is queued again with `retry` once the budget is raised
+    if result['status'] in ('failed', 'paused'):
+        queue.fail(job['id'], worker_id, result['message'])
+        return
+    result.pop('raw_text', None)
+    result.pop('raw_response', None)
+    if not queue.complete(job['id'], worker_id, result):
+        logging.warning(f"Job {job['id']} finished after its lease was taken over; result discarded.")
+
+
+def run_worker(path=JOBS_DB, worker_id=None, lease_seconds=LEASE_SECONDS, poll_seconds=POLL_SECONDS,
+               idle_exit=None):
+    """
+    Claims and runs jobs until stopped.
+
+    Parameters:
+        path (str): Job database.
+        worker_id (str, optional): Name recorded on claimed jobs; defaults to host:pid.
+        lease_seconds (float): Lease length, renewed while a job runs.
+        poll_seconds (float): Wait between polls when the queue is empty.
+        idle_exit (float, optional): Exit after this many idle seconds instead of waiting for work forever.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    queue = JobQueue(path)
+    idle_since = time.time()
+    try:
+        while True:
+            job = queue.claim(worker_id, lease_seconds)
+            if job is None:
+                if idle_exit is not None and time.time() - idle_since >= idle_exit:
+                    return
+                time.sleep(poll_seconds)
+                continue
+            logging.info(f"Worker {worker_id} running job {job['id']} ({job['file_name']}), attempt {job['attempts']}.")
+            run_job(queue, job, worker_id, path, lease_seconds)
+            idle_since = time.time()
+    finally:
+        queue.close()
+
+
+def start_workers(processes, path=JOBS_DB, **kwargs):
+    """
+    Starts worker processes; OCR is CPU-bound, so one process per core is a good default.
+    """
+    workers = [multiprocessing.Process(target=run_worker, args=(path,), kwargs=kwargs, daemon=False)
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Background invoice extraction workers and job status.")
+    parser.add_argument('--db', default=JOBS_DB)
+    commands = parser.add_subparsers(dest='command', required=True)
+    worker_parser = commands.add_parser('worker', help='Run worker processes until interrupted')
+    worker_parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    worker_parser.add_argument('--idle-exit', type=float, default=None,
+                               help='Exit after this many seconds without work (e.g. for batch jobs)')
+    status_parser = commands.add_parser('status', help='Show the jobs of a batch')
+    status_parser.add_argument('batch_id')
+    retry_parser = commands.add_parser('retry', help='Queue the failed jobs of a batch again')
+    retry_parser.add_argument('batch_id')
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        workers = start_workers(args.processes, args.db, idle_exit=args.idle_exit)
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # Interrupted jobs keep their lease until it expires, then run again
+            for worker in workers:
+                worker.terminate()
+    elif args.command == 'status':
+        queue = JobQueue(args.db)
+        for job in queue.batch_jobs(args.batch_id):
+            outcome = job['result']['message'] if job['result'] else job['error'] or ''
+            print(f"{job['id']:>6}  {job['state']:<8} {job['attempts']}/{job['max_attempts']}  {job['file_name']}  {outcome}")
+        print(queue.batch_counts(args.batch_id))
+    else:
+        print(f"{JobQueue(args.db).retry(args.batch_id)} jobs queued again")
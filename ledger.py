@@ -0,0 +1,269 @@
+"""
+Token and cost ledger for LLM calls, with a per-batch budget guard.
+
+Every API call is recorded with its batch, document, stage and model: prompt, completion and
+cached tokens, latency, retry number, outcome and estimated cost (config.MODEL_PRICES). Batches
+can then be compared in cost per 1,000 invoices, not just in docs/s.
+
+The budget guard sits in front of each call of a batch. When the batch spends past a share of
+its budget, it moves the rest of the batch to the cheapest model tier. At the budget it pauses the
+batch: no further calls are made. It also holds calls back while the batch runs above its
+tokens-per-minute limit.
+
+Usage:
+    guard = BudgetGuard(shared_ledger(), batch_id, [("gpt-4o", endpoint), ("gpt-4o-mini", cheap_endpoint)],
+                        max_cost=25.0, max_tokens_per_minute=200_000)
+    model, endpoint = guard.tier()       # raises BudgetExceeded once the batch is out of budget
+    ...
+    guard.record(doc, "extract_fields", model, response.json()["usage"], latency_s)
+
+    python -m ledger <batch_id>
+"""
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from config import MODEL_PRICES
+
+# ===========================
+# 1. Pricing
+# ===========================
+
+LEDGER_DB = "invoice_ledger.sqlite3"
+
+# Share of the budget after which the batch moves to the cheapest tier
+DOWNGRADE_AT = 0.8
+TOKEN_WINDOW_SECONDS = 60
+
+
+def model_price(model):
+    """
+    Price entry of a model; dated or suffixed names ("gpt-4o-2024-08-06") use their base model's.
+    """
+    if model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    matches = [name for name in MODEL_PRICES if model and model.startswith(name)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def estimate_cost(prompt_tokens, completion_tokens, model, cached_tokens=0):
+    """
+    USD for one call; cached prompt tokens are billed at the model's cached rate where it has one.
+    """
+    price = model_price(model)
+    if price is None:
+        return 0.0
+    cached_rate = price.get('cached', price['prompt'])
+    return ((prompt_tokens - cached_tokens) / 1000 * price['prompt'] + cached_tokens / 1000 * cached_rate
+            + completion_tokens / 1000 * price['completion'])
+
+
+def usage_tokens(usage):
+    """
+    (prompt, completion, cached) tokens from an OpenAI-style usage block.
+    """
+    usage = usage or {}
+    details = usage.get('prompt_tokens_details') or {}
+    return usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0), details.get('cached_tokens', 0)
+
+# ===========================
+# 2. Ledger
+# ===========================
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id TEXT,
+    doc TEXT,
+    stage TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    latency_s REAL NOT NULL,
+    retry INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    cost_usd REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calls_batch ON calls (batch_id, created_at);
+"""
+
+
+class Ledger:
+    """
+    SQLite record of LLM calls, shared by the threads of one process and by the processes of a host.
+    """
+
+    def __init__(self, path=LEDGER_DB):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def record(self, batch_id, doc, stage, model, usage=None, latency_s=0.0, retry=0, status='ok'):
+        """
+        Records one call and returns its estimated cost in USD.
+
+        Parameters:
+            usage (dict, optional): The response's usage block; None for calls that failed.
+            retry (int): 0 for the first attempt, 1 for the first retry, ...
+            status (str): "ok", "rate_limited" or "error".
+        """
+        prompt_tokens, completion_tokens, cached_tokens = usage_tokens(usage)
+        cost = estimate_cost(prompt_tokens, completion_tokens, model, cached_tokens)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO calls (batch_id, doc, stage, model, prompt_tokens, completion_tokens, cached_tokens,"
+                " latency_s, retry, status, cost_usd, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (batch_id, doc, stage, model, prompt_tokens, completion_tokens, cached_tokens, latency_s, retry,
+                 status, cost, time.time()))
+        return cost
+
+    def spend(self, batch_id):
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(SUM(cost_usd), 0) FROM calls WHERE batch_id = ?",
+                                     (batch_id,)).fetchone()[0]
+
+    def tokens_per_minute(self, batch_id, window_seconds=TOKEN_WINDOW_SECONDS):
+        with self.lock:
+            tokens = self.conn.execute(
+                "SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) FROM calls"
+                " WHERE batch_id = ? AND created_at >= ?", (batch_id, time.time() - window_seconds)).fetchone()[0]
+        return tokens * 60 / window_seconds
+
+    def batch_summary(self, batch_id, documents=None):
+        """
+        Totals of a batch and its breakdown per stage and model.
+
+        Parameters:
+            documents (int, optional): Documents in the batch, including those that needed no call
+                (duplicates, empty files); defaults to the documents with calls.
+
+        Returns:
+            dict: calls, documents, tokens, retries, cost_usd, cost_per_1k_documents and "by_stage",
+                a list of per (stage, model) totals.
+        """
+        with self.lock:
+            totals = dict(self.conn.execute(
+                "SELECT COUNT(*) AS calls, COUNT(DISTINCT doc) AS documents_called,"
+                " COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,"
+                " COALESCE(SUM(completion_tokens), 0) AS completion_tokens,"
+                " COALESCE(SUM(cached_tokens), 0) AS cached_tokens, COALESCE(SUM(retry > 0), 0) AS retries,"
+                " COALESCE(SUM(cost_usd), 0) AS cost_usd, COALESCE(AVG(latency_s), 0) AS mean_latency_s"
+                " FROM calls WHERE batch_id = ?", (batch_id,)).fetchone())
+            by_stage = [dict(row) for row in self.conn.execute(
+                "SELECT stage, model, COUNT(*) AS calls, SUM(prompt_tokens) AS prompt_tokens,"
+                " SUM(completion_tokens) AS completion_tokens, SUM(cached_tokens) AS cached_tokens,"
+                " SUM(retry > 0) AS retries, SUM(cost_usd) AS cost_usd, AVG(latency_s) AS mean_latency_s"
+                " FROM calls WHERE batch_id = ? GROUP BY stage, model ORDER BY stage, model", (batch_id,))]
+        totals['documents'] = documents if documents is not None else totals['documents_called']
+        totals['cost_per_1k_documents'] = (1000 * totals['cost_usd'] / totals['documents']
+                                           if totals['documents'] else 0.0)
+        totals['by_stage'] = by_stage
+        return totals
+
+    def batches(self, limit=20):
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(
+                "SELECT batch_id, COUNT(*) AS calls, SUM(cost_usd) AS cost_usd, MAX(created_at) AS last_call"
+                " FROM calls GROUP BY batch_id ORDER BY last_call DESC LIMIT ?", (limit,))]
+
+    def close(self):
+        self.conn.close()
+
+
+@lru_cache(maxsize=None)
+def shared_ledger(path=LEDGER_DB):
+    """
+    One Ledger per process and path.
+    """
+    return Ledger(path)
+
+# ===========================
+# 3. Budget Guard
+# ===========================
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class BudgetGuard:
+    """
+    Chooses the model tier for each call of a batch and records the calls in the ledger.
+
+    Parameters:
+        ledger (Ledger): Where calls are recorded and spend is read from.
+        batch_id (str): The batch the calls are charged to.
+        tiers (list): (model, endpoint) pairs from the preferred tier to the cheapest.
+        max_cost (float, optional): Budget in USD; None for no limit.
+        max_tokens_per_minute (int, optional): Calls wait while the batch runs above this rate.
+        downgrade_at (float): Share of max_cost after which the batch moves to the cheapest tier.
+    """
+
+    def __init__(self, ledger, batch_id, tiers, max_cost=None, max_tokens_per_minute=None,
+                 downgrade_at=DOWNGRADE_AT, poll_seconds=1.0):
+        self.ledger = ledger
+        self.batch_id = batch_id
+        self.tiers = tiers
+        self.max_cost = max_cost
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.downgrade_at = downgrade_at
+        self.poll_seconds = poll_seconds
+        self.level = 0
+        self.lock = threading.Lock()
+
+    def tier(self, deadline=None):
+        """
+        (model, endpoint) for the next call, after waiting out the tokens-per-minute limit.
+
+        Parameters:
+            deadline (float, optional): time.monotonic() past which the caller stops waiting.
+
+        Raises:
+            BudgetExceeded: The batch has spent its budget.
+            TimeoutError: The batch was still above its tokens-per-minute limit at the deadline.
+        """
+        if self.max_tokens_per_minute:
+            while self.ledger.tokens_per_minute(self.batch_id) >= self.max_tokens_per_minute:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"Batch {self.batch_id} stayed above {self.max_tokens_per_minute} "
+                                       "tokens per minute until the deadline.")
+                time.sleep(self.poll_seconds if remaining is None else min(self.poll_seconds, remaining))
+        if self.max_cost is None:
+            return self.tiers[self.level]
+        spend = self.ledger.spend(self.batch_id)
+        if spend >= self.max_cost:
+            raise BudgetExceeded(f"Batch {self.batch_id} has spent ${spend:.2f} of its ${self.max_cost:.2f} budget.")
+        # Worked out from the ledger rather than remembered, so every process of the batch agrees
+        level = len(self.tiers) - 1 if spend >= self.max_cost * self.downgrade_at else 0
+        with self.lock:
+            if level > self.level:
+                self.level = level
+                logging.warning(f"Batch {self.batch_id} has spent ${spend:.2f}; switching to {self.tiers[level][0]}.")
+            return self.tiers[self.level]
+
+    def record(self, doc, stage, model, usage=None, latency_s=0.0, retry=0, status='ok'):
+        return self.ledger.record(self.batch_id, doc, stage, model, usage, latency_s, retry, status)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Token and cost totals of extraction batches.")
+    parser.add_argument('batch_id', nargs='?', help='Batch to summarise; the latest batches when omitted')
+    parser.add_argument('--db', default=LEDGER_DB)
+    parser.add_argument('--documents', type=int, default=None, help='Documents in the batch, for cost per 1k')
+    args = parser.parse_args()
+
+    ledger = Ledger(args.db)
+    if args.batch_id:
+        print(json.dumps(ledger.batch_summary(args.batch_id, args.documents), indent=2))
+    else:
+        for batch in ledger.batches():
+            print(f"{batch['batch_id']}  {batch['calls']:>6} calls  ${batch['cost_usd']:.4f}")
@@ -0,0 +1,136 @@
+import pandas as pd
+import pyarrow as pa
+
+# ===========================
+# 1. Column Groups
+# ===========================
+
+AMOUNT_COLUMNS = [
+    'Amount', 'Total', 'Taxable Value', 'SGST Amount', 'CGST Amount',
+    'IGST Amount', 'Tax Amount', 'Final Amount',
+]
+RATE_COLUMNS = ['SGST Rate', 'CGST Rate', 'IGST Rate', 'Tax Rate']
+QUANTITY_COLUMNS = ['Quantity']
+DATE_COLUMNS = ['Date', 'Invoice Date']
+GSTIN_COLUMNS = ['GSTIN Supplier', 'GSTIN Recipient']
+
+# Tried in order; each format is parsed for the whole column at once
+DATE_FORMATS = ('%d/%m/%Y', '%d %b %Y', '%d %B %Y', '%d-%m-%Y', '%Y-%m-%d', '%d.%m.%Y', '%d-%b-%Y', '%b %d, %Y')
+
+RATE_LIST_TYPE = pa.list_(pa.float64())
+
+# ===========================
+# 2. Vectorised Converters
+# ===========================
+
+
+def _numeric_text(series):
+    """
+    Strips currency markers ("₹", "Rs.", "INR") as a string column; lists ([6, 9]) are joined with commas.
+    """
+    text = series.map(lambda value: ','.join(map(str, value)) if isinstance(value, (list, tuple)) else value)
+    text = text.astype('string[pyarrow]')
+    return text.str.replace(r'(?i)(₹|\bRs\.?|\bINR)', '', regex=True)
+
+
+def _single_number_text(series):
+    """
+    _numeric_text without digit-group commas ("1,483.32", "1,00,000"), for values holding one
+    number such as amounts and quantities. Never used on rates, where "9,14" is two rates.
+    """
+    return _numeric_text(series).str.replace(r'(?<=\d),(?=\d{2,3}\b)', '', regex=True)
+
+
+def to_paise(series):
+    """
+    Converts amounts to exact integer paise (nullable Int64), rounding half up at the third decimal.
+    Unparseable values become <NA>.
+    """
+    parts = _single_number_text(series).str.extract(r'(-?)(\d+)(?:\.(\d+))?')
+    whole = pd.to_numeric(parts[1], errors='coerce').astype('Int64')
+    fraction = pd.to_numeric(parts[2].fillna('').str[:3].str.ljust(3, '0'), errors='coerce').astype('Int64')
+    paise = whole * 100 + fraction // 10 + (fraction % 10 >= 5).astype('Int64')
+    return paise.where(parts[0] != '-', -paise).rename(series.name)
+
+
+def to_number(series):
+    """
+    First number in each value as float64 (NaN when there is none).
+    """
+    return pd.to_numeric(_single_number_text(series).str.extract(r'(-?\d+(?:\.\d+)?)', expand=False),
+                         errors='coerce').astype('float64').rename(series.name)
+
+
+def to_rates(series):
+    """
+    Converts rates to float lists; line items with different rates arrive as [6, 9], "6,9" or "9, 14".
+    Every comma separates two rates: no rate has a thousands separator.
+    """
+    found = _numeric_text(series).str.findall(r'\d+(?:\.\d+)?')
+    found = found.where(found.str.len() > 0)
+    values = pa.array(found.tolist(), type=pa.list_(pa.string()), from_pandas=True).cast(RATE_LIST_TYPE)
+    return pd.Series(pd.arrays.ArrowExtensionArray(values), index=series.index, name=series.name)
+
+
+def to_dates(series):
+    """
+    Parses dates in the formats invoices and LLMs use into datetime64; day comes before month.
+    """
+    text = series.astype('string[pyarrow]').str.replace(r'\s+', ' ', regex=True).str.strip()
+    parsed = pd.Series(pd.NaT, index=series.index, dtype='datetime64[ns]', name=series.name)
+    for fmt in DATE_FORMATS:
+        missing = parsed.isna() & text.notna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(text[missing], format=fmt, errors='coerce')
+    return parsed
+
+
+def to_gstin(series):
+    """
+    Upper-cases GSTINs and drops inner whitespace; stored as a categorical since a batch
+    repeats a handful of supplier and recipient numbers.
+    """
+    text = series.astype('string[pyarrow]').str.replace(r'\s+', '', regex=True).str.upper()
+    return text.where(text != '').astype('category')
+
+# ===========================
+# 3. Normalisation Stage
+# ===========================
+
+
+def normalize_invoices(df):
+    """
+    Converts an extracted-invoice frame to compact typed columns.
+
+    Parameters:
+        df (pd.DataFrame): One row per invoice with the schema fields as extracted (strings, numbers or lists).
+
+    Returns:
+        pd.DataFrame: A copy where amounts are Int64 paise, quantities float64, rates float lists,
+            dates datetime64 and GSTINs categorical. Other columns are kept as they are.
+    """
+    normalized = df.copy()
+    converters = (
+        (AMOUNT_COLUMNS, to_paise),
+        (QUANTITY_COLUMNS, to_number),
+        (RATE_COLUMNS, to_rates),
+        (DATE_COLUMNS, to_dates),
+        (GSTIN_COLUMNS, to_gstin),
+    )
+    for columns, converter in converters:
+        for column in columns:
+            if column in normalized.columns:
+                normalized[column] = converter(normalized[column])
+    return normalized
+
+
+def paise_to_rupees(series):
+    return series.astype('Float64') / 100
+
+
+def memory_saving(df, normalized):
+    """
+    Returns (bytes before, bytes after) for the raw and normalised frames, counting string payloads.
+    """
+    return int(df.memory_usage(deep=True).sum()), int(normalized.memory_usage(deep=True).sum())
@@ -0,0 +1,142 @@
+"""
+Per-page memoisation of text, OCR and vision-model output.
+
+Pages are keyed by a fingerprint of what they draw: the page's content stream plus every resource
+it uses (fonts, images, forms). The fingerprint is taken from the PDF without rendering, so a
+scanned page is recognised from its embedded image. A page that reappears, such as a shared cover
+page or the unchanged pages of a re-uploaded bundle, is never OCR'd or sent to a model twice.
+
+Usage:
+    keys = page_fingerprints(pdf_bytes)
+    cache = shared_cache()
+    cached = cache.get_many("ocr", keys)
+    ...
+    cache.put("ocr", key, text)
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+# ===========================
+# 1. Page Fingerprints
+# ===========================
+
+PAGE_CACHE_DB = "page_cache.sqlite3"
+
+# Bumped when the fingerprint changes, so old entries are never matched against new keys
+FINGERPRINT_VERSION = b"page-v1"
+
+
+def _digest(obj, hasher, seen):
+    from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+    if isinstance(obj, IndirectObject):
+        # Shared resources (a font used on every page) are hashed once per page, and cycles end here
+        if obj.idnum in seen:
+            hasher.update(b"ref")
+            return
+        seen.add(obj.idnum)
+        obj = obj.get_object()
+    if isinstance(obj, StreamObject):
+        hasher.update(obj.get_data())
+    if isinstance(obj, DictionaryObject):
+        for key in sorted(obj):
+            # /Parent leads back up to the page tree and every other page
+            if key == '/Parent':
+                continue
+            hasher.update(key.encode('utf-8'))
+            _digest(obj.raw_get(key), hasher, seen)
+    elif isinstance(obj, ArrayObject):
+        for value in obj:
+            _digest(value, hasher, seen)
+    elif not isinstance(obj, StreamObject):
+        hasher.update(repr(obj).encode('utf-8'))
+
+
+def page_fingerprint(page):
+    """
+    SHA-256 of a pypdf page's content stream(s), resources and size.
+    """
+    hasher = hashlib.sha256(FINGERPRINT_VERSION)
+    contents = page.get_contents()
+    hasher.update(contents.get_data() if contents is not None else b"")
+    _digest(page.get('/Resources'), hasher, set())
+    hasher.update(repr([float(value) for value in page.mediabox]).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def page_fingerprints(pdf_bytes):
+    from io import BytesIO
+    from pypdf import PdfReader
+
+    return [page_fingerprint(page) for page in PdfReader(BytesIO(pdf_bytes)).pages]
+
+# ===========================
+# 2. Cache Store
+# ===========================
+
+
+class PageCache:
+    """
+    SQLite store of per-page results, keyed by (kind, page fingerprint).
+
+    Kinds name both the producer and its settings, e.g. "text" or "ocr:psm6", so changing a setting
+    never returns stale output. Results that depend on more than the page (a vision model's answer
+    to a prompt) fold the rest into the key instead.
+    Safe to share between the threads of one process.
+    """
+
+    def __init__(self, path=PAGE_CACHE_DB):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages (kind TEXT NOT NULL, page_key TEXT NOT NULL, value TEXT NOT NULL,"
+            " created_at REAL NOT NULL, PRIMARY KEY (kind, page_key))")
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, kind, keys):
+        """
+        Returns {key: value} for the keys already cached.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self.lock:
+            # SQLite caps bound parameters; invoices rarely have more pages than this anyway
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                found.update(self.conn.execute(
+                    f"SELECT page_key, value FROM pages WHERE kind = ? AND page_key IN ({','.join('?' * len(chunk))})",
+                    [kind, *chunk]).fetchall())
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, kind, key):
+        return self.get_many(kind, [key]).get(key)
+
+    def put(self, kind, key, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)", (kind, key, value, time.time()))
+
+    def prune(self, max_age_days):
+        """
+        Drops entries older than max_age_days; returns how many.
+        """
+        with self.lock, self.conn:
+            return self.conn.execute("DELETE FROM pages WHERE created_at < ?",
+                                     (time.time() - max_age_days * 86400,)).rowcount
+
+    def close(self):
+        self.conn.close()
+
+
+@lru_cache(maxsize=None)
+def shared_cache(path=PAGE_CACHE_DB):
+    """
+    One PageCache per process and path, shared by the pipeline stages.
+    """
+    return PageCache(path)
@@ -0,0 +1,394 @@
+"""
+Streaming document pipeline: pluggable stages connected by bounded queues.
+
+Every stage runs on its own workers, so each gets the concurrency its bottleneck needs:
+
+    Stage("pdf_text", extract_page_text, workers=2)                  # pypdf, cheap
+    Stage("ocr_pages", ocr_missing_pages, workers=2, processes=4)    # Tesseract, CPU-bound: a process pool
+    Stage("extract_fields", call_api, workers=8)                     # API calls, I/O-bound: threads on the network
+    Stage("llama", run_local_llm, workers=1, setup=load_model)       # a local model: one slot, loaded once
+
+Queues between stages hold at most queue_size items, so a slow stage holds back the ones before it
+instead of letting rendered pages or extracted text pile up in memory.
+
+Items are dicts. A stage finishes an item early (duplicate, no text, failed call) by setting its
+"status"; the remaining stages are then skipped, except those marked final (sinks, bookkeeping).
+An exception in a stage finishes the item with status "failed" instead of stopping the batch.
+
+Usage:
+    pipeline = Pipeline([Stage("load", load), Stage("llm", extract, workers=8), ...])
+    for item in pipeline.run({'name': f.name, 'file': f} for f in files):
+        ...
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from instrumentation import captured_spans, record_spans, recorder, span
+
+# ===========================
+# 1. Stages
+# ===========================
+
+QUEUE_SIZE = 8
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Parameters:
+        name (str): Stage name, also the timing span recorded for every item.
+        func (callable): func(item, resource) -> item; updates the item in place or returns a new dict.
+        workers (int): Items this stage works on at once.
+        processes (int): Size of a process pool shared by the stage's workers (0 = none). When set,
+            resource is the ProcessPoolExecutor and func submits its CPU-bound work to it.
+        setup (callable, optional): Called once in each worker thread; its result is the resource.
+            Use it for anything that must not be shared between threads (SQLite connections, models).
+        teardown (callable, optional): Called with the resource when the worker exits.
+        final (bool): Also run for items an earlier stage has finished.
+    """
+
+    def __init__(self, name, func, workers=1, processes=0, setup=None, teardown=None, final=False):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.processes = processes
+        self.setup = setup
+        self.teardown = teardown
+        self.final = final
+
+    def apply(self, item, resource):
+        """
+        Runs the stage on one item, turning an exception into a failed item.
+        """
+        if 'status' in item and not self.final:
+            return item
+        try:
+            with span(self.name, doc=item.get('name')):
+                result = self.func(item, resource)
+            return item if result is None else result
+        except Exception as e:
+            logging.error(f"Stage {self.name} failed for {item.get('name')}: {e}")
+            item['status'] = 'failed'
+            item['message'] = f"{self.name} failed for `{item.get('name')}`: {e}"
+            return item
+
+# ===========================
+# 2. Scheduler
+# ===========================
+
+
+class Pipeline:
+    """
+    Runs items through the stages as a streaming pipeline with bounded queues.
+
+    Parameters:
+        stages (list): Stage objects in order.
+        queue_size (int): Capacity of each queue between stages.
+    """
+
+    def __init__(self, stages, queue_size=QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(self, items):
+        """
+        Streams items through all stages.
+
+        Items are yielded as they finish, so the order may differ from the input; each one carries
+        the "index" of its position in the input.
+        """
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        cancelled = threading.Event()
+        # Spawned rather than forked: the pipeline runs inside multi-threaded hosts such as Streamlit
+        pools = [ProcessPoolExecutor(stage.processes, mp_context=get_context('spawn')) if stage.processes else None
+                 for stage in self.stages]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], cancelled), daemon=True)]
+        for position, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(stage, pools[position], queues[position], queues[position + 1], remaining, lock, cancelled),
+                    daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            # Also reached when the caller stops early: workers blocked on a full queue give up
+            cancelled.set()
+            for thread in threads:
+                thread.join()
+            for pool in pools:
+                if pool is not None:
+                    pool.shutdown()
+
+    def run_inline(self, item, resources=None):
+        """
+        Runs one item through every stage in the calling thread, e.g. in a worker process that is
+        already one of many.
+
+        Parameters:
+            item (dict): The item.
+            resources (dict, optional): stage name -> resource, for stages whose setup the caller provides.
+        """
+        resources = resources or {}
+        for stage in self.stages:
+            owned = stage.name not in resources and stage.setup is not None
+            resource = stage.setup() if owned else resources.get(stage.name)
+            try:
+                item = stage.apply(item, resource)
+            finally:
+                if owned and stage.teardown is not None:
+                    stage.teardown(resource)
+        return item
+
+    @staticmethod
+    def _put(target, item, cancelled):
+        while not cancelled.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _get(source, cancelled):
+        while not cancelled.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _feed(self, items, target, cancelled):
+        try:
+            for index, item in enumerate(items):
+                item.setdefault('index', index)
+                if not self._put(target, item, cancelled):
+                    return
+        except Exception as e:
+            logging.error(f"Pipeline input failed: {e}")
+        finally:
+            self._put(target, _DONE, cancelled)
+
+    def _work(self, stage, pool, source, target, remaining, lock, cancelled):
+        resource = stage.setup() if stage.setup is not None else pool
+        try:
+            while True:
+                item = self._get(source, cancelled)
+                if item is _DONE:
+                    # Hand the end marker on to the other workers of this stage
+                    self._put(source, _DONE, cancelled)
+                    break
+                if not self._put(target, stage.apply(item, resource), cancelled):
+                    break
+        finally:
+            if stage.setup is not None and stage.teardown is not None:
+                stage.teardown(resource)
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            # The last worker out tells the next stage that no more items are coming
+            if last:
+                self._put(target, _DONE, cancelled)
+
+# ===========================
+# 3. Text and OCR Stages
+# ===========================
+
+# Pages with less text than this in their text layer are scanned or image-only and go to OCR
+MIN_PAGE_CHARS = 50
+MIN_OCR_CHARS = 10
+
+# Text and OCR output are memoised per page (page_cache.py); the OCR kind names its Tesseract settings
+USE_PAGE_CACHE = True
+TEXT_KIND = "text"
+OCR_KIND = "ocr:psm6"
+
+# Pages OCR'd per process-pool task; an in-memory document is sent to the pool once per task
+OCR_PAGES_PER_TASK = 4
+# OCR tasks in the pool at once start at one per core and back off (concurrency.py) while the tasks
+# are starved of CPU, e.g. by other workers on the host
+OCR_MAX_IN_FLIGHT = os.cpu_count() or 1
+
+
+def page_texts(document, cache=None):
+    """
+    Text of each page from the PDF's text layer; None for pages that need OCR.
+
+    Parameters:
+        document (Document): The PDF.
+        cache (PageCache, optional): Page cache to read and fill.
+
+    Returns:
+        tuple: (texts, page keys), the keys being page_cache fingerprints (None without a cache).
+    """
+    from page_cache import page_fingerprint
+
+    doc = document.name
+    with span("pdf_open", doc=doc):
+        pdf_reader = document.pdf_reader()
+    keys = [page_fingerprint(page) for page in pdf_reader.pages] if cache is not None else [None] * len(pdf_reader.pages)
+    cached = cache.get_many(TEXT_KIND, keys) if cache is not None else {}
+    texts = []
+    for page_number, (page, key) in enumerate(zip(pdf_reader.pages, keys), start=1):
+        if key in cached:
+            extracted_text = cached[key]
+        else:
+            with span("text_extract", doc=doc) as s:
+                extracted_text = page.extract_text() or ""
+                s.set(chars=len(extracted_text))
+            if cache is not None:
+                cache.put(TEXT_KIND, key, extracted_text)
+        if len(extracted_text.strip()) > MIN_PAGE_CHARS:
+            texts.append(extracted_text)
+            logging.info(f"Text extracted from page {page_number} using PdfReader.")
+        else:
+            texts.append(None)
+            logging.info(f"Insufficient text on page {page_number}. Applying OCR.")
+    return texts, keys
+
+
+def ocr_pages(document, page_numbers):
+    """
+    Renders the given pages from the open document and runs Tesseract on each.
+
+    Returns:
+        dict: page number -> OCR text ("" when the page has none).
+    """
+    import pytesseract
+
+    texts = {}
+    for number in page_numbers:
+        # Rendered in process straight to a grayscale array, a third of the RGB pixels Tesseract would gray anyway
+        with span("page_render", doc=document.name):
+            _, image = next(document.render_arrays([number], colorspace='gray'))
+        with span("ocr", doc=document.name, pixels=image.size) as s:
+            ocr_text = pytesseract.image_to_string(image, config='--psm 6')  # Assume a single uniform block of text
+            s.set(chars=len(ocr_text or ""))
+        texts[number] = ""
+        if ocr_text and len(ocr_text.strip()) > MIN_OCR_CHARS:
+            texts[number] = ocr_text + "\n"
+            logging.info(f"OCR text extracted from page {number}.")
+    return texts
+
+
+def ocr_pages_from_source(source, page_numbers, doc=None):
+    """
+    ocr_pages for a process pool: the worker maps the file (or takes the bytes) once per call
+    rather than once per page. A module-level function so the pool can run it.
+
+    Returns:
+        tuple: (ocr_pages result, share of a core the task got while it ran, the task's spans for
+            the parent to record; the worker's own recorder is never read).
+    """
+    from concurrency import CpuMeter
+    from document import Document
+
+    meter = CpuMeter()
+    with captured_spans() as spans, Document.open_source(source, doc) as document:
+        texts = ocr_pages(document, page_numbers)
+    return texts, meter.share(), spans
+
+
+def _release_ocr_slot(limiter, slot, future):
+    from concurrency import MIN_CPU_SHARE
+
+    if not future.cancelled() and future.exception() is None and future.result()[1] < MIN_CPU_SHARE:
+        slot.pushed_back()
+    limiter.release(slot)
+
+
+def _page_cache():
+    if not USE_PAGE_CACHE:
+        return None
+    from page_cache import shared_cache
+
+    return shared_cache()
+
+
+def extract_page_text(item, resource=None):
+    """
+    Stage: item["document"] -> item["pages"], the text layer of each page (None where OCR is needed),
+    and item["page_keys"], their fingerprints.
+    """
+    item['pages'], item['page_keys'] = page_texts(item['document'], _page_cache())
+
+
+def ocr_missing_pages(item, pool=None):
+    """
+    Stage: OCRs the pages the text layer did not cover and has not seen before, in the stage's
+    process pool when it has one, and joins the pages into item["raw_text"].
+    Items without any text are finished as "no_text".
+    """
+    document = item['document']
+    pages, keys = item['pages'], item.get('page_keys') or [None] * len(item['pages'])
+    cache = _page_cache() if item.get('page_keys') else None
+    missing = {number: keys[number - 1] for number, text in enumerate(pages, start=1) if text is None}
+    cached = cache.get_many(OCR_KIND, list(missing.values())) if cache is not None else {}
+    ocr_texts = {number: cached[key] for number, key in missing.items() if key in cached}
+    todo = [number for number in missing if number not in ocr_texts]
+    recorder.record("page_cache", 0.0, item.get('name'), ocr_hits=len(ocr_texts), ocr_misses=len(todo))
+    if pool is not None and todo:
+        from concurrency import shared_limiter
+
+        limiter = shared_limiter("ocr", OCR_MAX_IN_FLIGHT, maximum=OCR_MAX_IN_FLIGHT)
+        source = document.source()
+        deadline = item.get('deadline')
+        futures = []
+        for start in range(0, len(todo), OCR_PAGES_PER_TASK):
+            slot = limiter.acquire(timeout=None if deadline is None else deadline - time.monotonic())
+            if slot is None:
+                # Tasks still queued are dropped; running ones release their slots when they finish
+                for future in futures:
+                    future.cancel()
+                logging.error(f"{item.get('name')} ran out of its time budget waiting for OCR.")
+                item['status'] = 'failed'
+                item['message'] = f"`{item.get('name')}` timed out waiting for OCR."
+                return
+            try:
+                future = pool.submit(ocr_pages_from_source, source, todo[start:start + OCR_PAGES_PER_TASK],
+                                     item.get('name'))
+            except Exception:
+                limiter.release(slot)
+                raise
+            future.add_done_callback(lambda done, slot=slot: _release_ocr_slot(limiter, slot, done))
+            futures.append(future)
+        for future in futures:
+            texts, _, spans = future.result()
+            ocr_texts.update(texts)
+            record_spans(spans)
+    elif todo:
+        ocr_texts.update(ocr_pages(document, todo))
+    if cache is not None:
+        for number in todo:
+            cache.put(OCR_KIND, missing[number], ocr_texts[number])
+    item['raw_text'] = "".join(
+        (text + "\n" if text is not None else ocr_texts[number]) for number, text in enumerate(pages, start=1))
+    if not item['raw_text'].strip():
+        logging.warning(f"No text extracted from {item.get('name')}.")
+        item['status'] = 'no_text'
+        item['message'] = f"No text extracted from `{item.get('name')}`."
+
+
+def close_document(item, resource=None):
+    """
+    Final stage: releases the item's document buffer as soon as the item is done with it.
+    """
+    if 'document' in item:
+        item['document'].close()
@@ -0,0 +1,128 @@
+"""
+Prompt registry: the extraction prompts of every extractor, versioned and compiled once per process.
+
+Templates live in prompts.yaml and are filled in from config.INVOICE_FIELDS, so every prompt asks
+for the same fields the validation, export and evaluation expect. Each is split once, at load time,
+into the static prefix before the document and the suffix after it; a request is then two string
+concatenations rather than a str.format of the whole template. The prefix's token count is worked
+out once too, to check it against the provider's minimum for prompt caching.
+
+Every prompt has an id, e.g. "invoice_extraction/v2-3f1c09ab": the name, the version from
+prompts.yaml and a hash of the compiled text, so a changed field list gives a new id even when
+nobody bumped the version. Results are stamped with it and response caches are keyed by it.
+
+Usage:
+    prompt = get_prompt("invoice_extraction")
+    messages = prompt.messages(pages_text)
+    record['Prompt Version'] = prompt.id
+"""
+import hashlib
+import json
+import math
+import os
+from functools import lru_cache
+
+from config import INVOICE_FIELDS
+
+# ===========================
+# 1. Token Counting
+# ===========================
+
+PROMPTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts.yaml')
+
+# Placeholders filled when a template is loaded; {document} splits it into prefix and suffix
+DOCUMENT_PLACEHOLDER = "{document}"
+FIELDS_PLACEHOLDER = "{fields}"
+JSON_FIELDS_PLACEHOLDER = "{json_fields}"
+
+# Characters per token of English prose, for when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text):
+    """
+    Tokens of text for the GPT-4 family; estimated from its length without tiktoken.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(tiktoken.get_encoding("cl100k_base").encode(text))
+
+# ===========================
+# 2. Prompts
+# ===========================
+
+
+def _compile(text, fields):
+    return (text.replace(FIELDS_PLACEHOLDER, "\n".join(f"- {field}" for field in fields))
+                .replace(JSON_FIELDS_PLACEHOLDER, json.dumps({field: "" for field in fields}, indent=4)))
+
+
+class Prompt:
+    """
+    One compiled template.
+
+    Parameters:
+        name (str): Key in prompts.yaml.
+        version (int): Version from prompts.yaml.
+        template (str): Template text; everything after {document} is the suffix.
+        system (str, optional): System message for chat models.
+        fields (list): Fields the prompt asks for.
+    """
+
+    def __init__(self, name, version, template, system=None, fields=INVOICE_FIELDS):
+        before, _, after = template.partition(DOCUMENT_PLACEHOLDER)
+        self.name = name
+        self.version = version
+        self.system = system
+        self.fields = list(fields)
+        self.prefix = _compile(before, self.fields)
+        self.suffix = _compile(after, self.fields)
+        digest = hashlib.sha256(f"{system or ''}\0{self.prefix}\0{self.suffix}".encode('utf-8')).hexdigest()
+        self.id = f"{name}/v{version}-{digest[:8]}"
+        # What every request of this prompt starts with, and so what a provider-side prompt cache can serve
+        self.prefix_tokens = count_tokens((system or "") + self.prefix)
+
+    def render(self, document=""):
+        return self.prefix + document + self.suffix
+
+    def messages(self, document, extra=""):
+        """
+        Chat messages for one document; extra (e.g. feedback on a previous answer) goes last,
+        after the document, so it never breaks the cached prefix.
+        """
+        messages = [{"role": "system", "content": self.system}] if self.system else []
+        messages.append({"role": "user", "content": self.render(document) + extra})
+        return messages
+
+    def __repr__(self):
+        return f"Prompt({self.id!r}, prefix_tokens={self.prefix_tokens})"
+
+
+@lru_cache(maxsize=None)
+def load_prompts(path=PROMPTS_FILE):
+    """
+    Every prompt in the file, compiled; read once per process.
+
+    Returns:
+        dict: name -> Prompt.
+    """
+    import yaml
+
+    with open(path, encoding='utf-8') as f:
+        entries = yaml.safe_load(f)
+    return {name: Prompt(name, entry['version'], entry['template'], entry.get('system'))
+            for name, entry in entries.items()}
+
+
+def get_prompt(name, path=PROMPTS_FILE):
+    try:
+        return load_prompts(path)[name]
+    except KeyError:
+        raise KeyError(f"No prompt named {name!r} in {path}") from None
+
+
+if __name__ == "__main__":
+    for prompt in load_prompts().values():
+        print(f"{prompt.id:<48} {prompt.prefix_tokens:>5} prefix tokens")
@@ -0,0 +1,229 @@
+"""
+Arithmetic and GST consistency checks over a whole batch of extracted invoices.
+
+Usage (on an export written by app.py):
+    python -m reconcile extracted_invoice_data.parquet
+"""
+import argparse
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from normalize import normalize_invoices, to_paise, to_rates
+
+# ===========================
+# 1. GST Reference Data
+# ===========================
+
+# GST state codes, used when Place of Supply carries only the state name
+STATE_CODES = {
+    'JAMMU AND KASHMIR': '01', 'HIMACHAL PRADESH': '02', 'PUNJAB': '03', 'CHANDIGARH': '04',
+    'UTTARAKHAND': '05', 'HARYANA': '06', 'DELHI': '07', 'RAJASTHAN': '08', 'UTTAR PRADESH': '09',
+    'BIHAR': '10', 'SIKKIM': '11', 'ARUNACHAL PRADESH': '12', 'NAGALAND': '13', 'MANIPUR': '14',
+    'MIZORAM': '15', 'TRIPURA': '16', 'MEGHALAYA': '17', 'ASSAM': '18', 'WEST BENGAL': '19',
+    'JHARKHAND': '20', 'ODISHA': '21', 'CHHATTISGARH': '22', 'MADHYA PRADESH': '23', 'GUJARAT': '24',
+    'DADRA AND NAGAR HAVELI AND DAMAN AND DIU': '26', 'MAHARASHTRA': '27', 'KARNATAKA': '29', 'GOA': '30',
+    'LAKSHADWEEP': '31', 'KERALA': '32', 'TAMIL NADU': '33', 'PUDUCHERRY': '34',
+    'ANDAMAN AND NICOBAR ISLANDS': '35', 'TELANGANA': '36', 'ANDHRA PRADESH': '37', 'LADAKH': '38',
+}
+
+GSTIN_PATTERN = r'^\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]$'
+GSTIN_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# Rounding slack in paise: invoices round each tax line separately
+TOLERANCE_PAISE = 100
+
+# Relative weight of each check in the confidence score; totals and the GSTIN checksum are
+# the strongest signals that the extraction, not the invoice, is wrong
+CHECK_WEIGHTS = {
+    'total_reconciles': 3.0,
+    'tax_sum_matches': 2.0,
+    'cgst_equals_sgst': 1.0,
+    'supply_type_consistent': 1.0,
+    'tax_matches_rate': 1.0,
+    'gstin_checksum_valid': 2.0,
+}
+
+# Rows scoring below this are sent back for re-extraction
+REVIEW_THRESHOLD = 0.8
+
+
+def gstin_checksum_valid(gstin):
+    """
+    Verifies the 15th character of a GSTIN (mod-36 Luhn variant).
+    """
+    if not isinstance(gstin, str) or not re.fullmatch(GSTIN_PATTERN, gstin):
+        return False
+    total = 0
+    for i, char in enumerate(gstin[:14]):
+        product = GSTIN_ALPHABET.index(char) * (2 if i % 2 else 1)
+        total += product // 36 + product % 36
+    return GSTIN_ALPHABET[(36 - total % 36) % 36] == gstin[14]
+
+
+def supply_state_code(place_of_supply):
+    """
+    State code from "23-MADHYA PRADESH" or "Madhya Pradesh", as a string column (NA when unknown).
+    """
+    text = place_of_supply.astype('string[pyarrow]').str.strip().str.upper()
+    code = text.str.extract(r'^(\d{2})', expand=False)
+    name = text.str.replace(r'^\d{2}\s*-?\s*', '', regex=True).str.replace('&', 'AND').str.strip()
+    return code.fillna(name.map(STATE_CODES).astype('string[pyarrow]'))
+
+# ===========================
+# 2. Vectorised Checks
+# ===========================
+
+
+def _amount(frame, column, default=None):
+    if column not in frame.columns:
+        return pd.Series(default if default is not None else pd.NA, index=frame.index, dtype='Int64')
+    amounts = frame[column]
+    # Columns normalize_invoices does not know, such as a discount, arrive as extracted
+    amounts = amounts.astype('Int64') if pd.api.types.is_integer_dtype(amounts.dtype) else to_paise(amounts)
+    return amounts if default is None else amounts.fillna(default)
+
+
+def _rate_bounds(frame, column):
+    """
+    Count, lowest and highest of the rates listed per row (count 0 when the column is missing or empty).
+    """
+    bounds = pd.DataFrame({'count': 0, 'min': np.nan, 'max': np.nan}, index=frame.index)
+    if column not in frame.columns:
+        return bounds
+    rates = frame[column]
+    if not isinstance(rates.dtype, pd.ArrowDtype):
+        rates = to_rates(rates)
+    lists = pa.array(rates.array)
+    flat = pd.Series(pc.list_flatten(lists).to_numpy(zero_copy_only=False), dtype='float64')
+    grouped = flat.groupby(pc.list_parent_indices(lists).to_numpy()).agg(['count', 'min', 'max'])
+    positions = grouped.index.to_numpy()
+    for name in ('count', 'min', 'max'):
+        bounds.iloc[positions, bounds.columns.get_loc(name)] = grouped[name].to_numpy()
+    return bounds
+
+
+def _effective_rate(frame):
+    """
+    The GST rate the Tax Amount should follow, NaN where no single rate explains it.
+
+    A rate is split across tax heads, so "9,9" is CGST 9% + SGST 9% = 18%: when per-head rates were
+    extracted they are summed, each head counting once however many line items repeat it. Without
+    them Tax Rate is used, but only when it lists one rate; several could be heads or line items
+    taxed at different rates, and mixed-rate invoices cannot be checked against a single rate.
+    """
+    heads = [_rate_bounds(frame, column) for column in ('CGST Rate', 'SGST Rate', 'IGST Rate')]
+    # A head with no rate charged nothing; one with differing rates leaves the total unknown
+    head_total = sum(head['min'].where(head['min'] == head['max']).where(head['count'] > 0, 0.0)
+                     for head in heads)
+    heads_listed = sum(head['count'] for head in heads) > 0
+    tax_rate = _rate_bounds(frame, 'Tax Rate')
+    return head_total.where(heads_listed, tax_rate['min'].where(tax_rate['count'] == 1))
+
+
+def reconcile_invoices(df, discount_column=None, tolerance_paise=TOLERANCE_PAISE, normalized=False):
+    """
+    Runs the invoice identities over every row at once.
+
+    Checks (NA when the inputs are missing, so they neither pass nor fail the row):
+        total_reconciles:       Taxable + CGST + SGST + IGST - discount = Final Amount
+        tax_sum_matches:        CGST + SGST + IGST = Tax Amount
+        cgst_equals_sgst:       CGST = SGST on intra-state invoices
+        supply_type_consistent: intra-state has no IGST, inter-state has no CGST/SGST
+                                (intra-state: Place of Supply state code = GSTIN Supplier state code)
+        tax_matches_rate:       Tax Amount = Taxable Value x (CGST + SGST + IGST Rate, else a single Tax Rate)
+        gstin_checksum_valid:   GSTIN Supplier format and check digit
+
+    Parameters:
+        df (pd.DataFrame): Extracted invoices, raw or already passed through normalize_invoices.
+        discount_column (str, optional): Column with a discount taken after tax, if the extractor has one.
+        tolerance_paise (int): Allowed rounding difference for the amount identities.
+        normalized (bool): Skip normalisation when df already holds paise / rate lists / categoricals.
+
+    Returns:
+        pd.DataFrame: Same index as df, one nullable boolean column per check plus
+            "confidence" (weighted share of applicable checks that pass) and "needs_review".
+    """
+    frame = df if normalized else normalize_invoices(df)
+    taxable = _amount(frame, 'Taxable Value')
+    # A missing tax line means none of that tax was charged, e.g. IGST on an intra-state invoice
+    cgst, sgst, igst = (_amount(frame, column, default=0) for column in ('CGST Amount', 'SGST Amount', 'IGST Amount'))
+    tax = _amount(frame, 'Tax Amount')
+    final = _amount(frame, 'Final Amount')
+    discount = _amount(frame, discount_column, default=0) if discount_column else 0
+
+    checks = pd.DataFrame(index=frame.index)
+    checks['total_reconciles'] = ((taxable + cgst + sgst + igst - discount - final).abs() <= tolerance_paise)
+    checks['tax_sum_matches'] = ((cgst + sgst + igst - tax).abs() <= tolerance_paise)
+
+    if {'Place of Supply', 'GSTIN Supplier'} <= set(frame.columns):
+        supplier_state = frame['GSTIN Supplier'].astype('string[pyarrow]').str[:2]
+        intra_state = (supply_state_code(frame['Place of Supply']) == supplier_state).astype('boolean')
+    else:
+        intra_state = pd.Series(pd.NA, index=frame.index, dtype='boolean')
+    checks['cgst_equals_sgst'] = ((cgst - sgst).abs() <= tolerance_paise).where(intra_state.fillna(False))
+    checks['supply_type_consistent'] = ((igst == 0) & (cgst + sgst > 0)).where(
+        intra_state.fillna(False), (igst > 0) & (cgst + sgst == 0)).where(intra_state.notna())
+
+    rate = _effective_rate(frame)
+    expected_tax = (taxable.astype('Float64') * rate / 100).round()
+    checks['tax_matches_rate'] = ((expected_tax - tax.astype('Float64')).abs() <= tolerance_paise)
+
+    if 'GSTIN Supplier' in frame.columns:
+        gstin = frame['GSTIN Supplier'].astype('category')
+        # Checksums are computed once per distinct GSTIN; batches repeat a few suppliers
+        valid = pd.Series([gstin_checksum_valid(code) for code in gstin.cat.categories], dtype='boolean')
+        checks['gstin_checksum_valid'] = pd.Series(
+            valid.to_numpy()[gstin.cat.codes.to_numpy()], index=frame.index, dtype='boolean'
+        ).where(gstin.notna())
+    else:
+        checks['gstin_checksum_valid'] = pd.Series(pd.NA, index=frame.index, dtype='boolean')
+
+    checks = checks.astype('boolean')
+    weights = pd.Series(CHECK_WEIGHTS)[checks.columns]
+    applicable = checks.notna().astype(float) @ weights
+    passed = checks.fillna(False).astype(float) @ weights
+    checks['confidence'] = (passed / applicable.replace(0, np.nan)).fillna(0.0)
+    checks['needs_review'] = checks['confidence'] < REVIEW_THRESHOLD
+    return checks
+
+
+def failed_checks(checks):
+    """
+    Names of the failed checks per row, e.g. for a re-extraction prompt or a review table.
+    """
+    names = [column for column in CHECK_WEIGHTS if column in checks.columns]
+    failed = checks[names].fillna(True).eq(False)
+    return failed.apply(lambda row: [name for name in names if row[name]], axis=1)
+
+
+def summarise(checks):
+    """
+    Pass rate of each check over the rows where it applies, plus the share of rows flagged.
+    """
+    names = [column for column in CHECK_WEIGHTS if column in checks.columns]
+    summary = pd.DataFrame({
+        'applicable': checks[names].notna().sum(),
+        'pass_rate': checks[names].astype('Float64').mean(),
+    })
+    summary.loc['needs_review', ['applicable', 'pass_rate']] = [len(checks), checks['needs_review'].mean()]
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile the amounts and GST fields of an invoice export.")
+    parser.add_argument('path', help='Parquet export, e.g. extracted_invoice_data.parquet')
+    parser.add_argument('--tolerance-paise', type=int, default=TOLERANCE_PAISE)
+    args = parser.parse_args()
+
+    data = pd.read_parquet(args.path, dtype_backend='pyarrow')
+    checks = reconcile_invoices(data, tolerance_paise=args.tolerance_paise, normalized=True)
+    print(summarise(checks).to_string())
+    flagged = data.loc[checks['needs_review']]
+    label = 'Source File' if 'Source File' in data.columns else 'Invoice No.'
+    print(f"\n{len(flagged)} of {len(data)} invoices need re-extraction")
+    for index, failures in failed_checks(checks)[checks['needs_review']].items():
+        print(f"  {data.at[index, label]}: {', '.join(failures)}")
@@ -0,0 +1,504 @@
+"""
+Sharded backfills across several machines that share a directory (NFS, SMB, a mounted volume).
+
+A manifest of PDF paths is cut into shards. Worker nodes claim shards through lease files in the
+shared work directory, run each shard through the extraction pipeline (app.document_pipeline),
+checkpoint every finished document, and the merge step compacts the per-shard checkpoints into
+one Parquet dataset. There is no coordinator process: the protocol needs nothing but atomic
+exclusive create and atomic rename, which local filesystems and NFSv3+ provide.
+
+- Claim: a shard is taken by creating its lease file exclusively; the file holds the worker id.
+- Heartbeat: the owner touches its lease three times per lease period.
+- Expiry: a lease untouched for LEASE_SECONDS belongs to a dead or stuck node. Any worker may take
+  the shard over by renaming the stale lease aside (only one rename wins) and claiming it again.
+- Work stealing: owners keep at most IN_FLIGHT_DOCUMENTS in their pipeline and publish how far
+  they have started. When nothing is left to claim, an idle worker cuts the unstarted rest of the
+  busiest live shard in two. It plans the second half as a new shard, then records the cut in a
+  split file. The owner checks for the split before starting each document and stops there.
+- Checkpoints: one JSON line per finished document, appended and fsynced. A worker that takes a
+  shard over skips what its checkpoint (or a parent shard's) already has, so a node lost halfway
+  through costs only its documents in flight.
+
+Documents are processed at least once: one can run twice when a slow owner loses its lease or
+races a split. The merge keeps one result per path, and one extracted record per identical file.
+
+Work directory:
+    manifest.txt              the planned PDF paths, one per line; every node must be able to open them
+    shards/<id>.json          the paths of each shard; stolen halves are "<parent id>.<cut index>"
+    leases/<id>               the worker running the shard
+    splits/<id>               index from which the rest of the shard was stolen
+    progress/<id>             index of the next document the owner starts
+    checkpoints/<id>.jsonl    one result per finished document
+    done/<id>                 written when the shard is finished
+
+Usage (from the repository root on each node; several processes on one machine work the same way):
+    python -m shards --work-dir /mnt/backfill plan manifest.txt --shard-size 50
+    python -m shards --work-dir /mnt/backfill worker --processes 2
+    python -m shards --work-dir /mnt/backfill status
+    python -m shards --work-dir /mnt/backfill retry
+    python -m shards --work-dir /mnt/backfill merge --output backfill.parquet
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+
+# ===========================
+# 1. Configuration
+# ===========================
+
+SHARD_SIZE = 50
+
+# A node that stops heartbeating loses its shard after the lease expires; leave room for clock skew
+LEASE_SECONDS = 300
+POLL_SECONDS = 5.0
+# Shards with fewer unstarted documents than this are not worth splitting
+MIN_STEAL_DOCUMENTS = 4
+# Documents a worker has in its pipeline at once; the rest of its shard stays stealable
+IN_FLIGHT_DOCUMENTS = 8
+# Outcomes that leave a document to be run again: failures, and documents a spent budget paused
+RETRY_STATUSES = ('failed', 'paused')
+
+SUBDIRECTORIES = ('shards', 'leases', 'splits', 'progress', 'checkpoints', 'done')
+
+
+def _write_atomic(path, text):
+    # Readers on other nodes see the old file or the new one, never half of it
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _create_exclusive(path, text):
+    """
+    Creates path with the given content; raises FileExistsError when another worker got there first.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+# ===========================
+# 2. Shard Board
+# ===========================
+
+
+class ShardBoard:
+    """
+    The shards of one backfill and their leases, splits, checkpoints and completion markers.
+
+    Parameters:
+        work_dir (str): Shared work directory.
+        lease_seconds (float): Age after which an untouched lease may be taken over.
+    """
+
+    def __init__(self, work_dir, lease_seconds=LEASE_SECONDS):
+        self.work_dir = work_dir
+        self.lease_seconds = lease_seconds
+
+    def _path(self, kind, shard_id, suffix=''):
+        return os.path.join(self.work_dir, kind, f"{shard_id}{suffix}")
+
+    def plan(self, paths, shard_size=SHARD_SIZE):
+        """
+        Writes the manifest and cuts it into shards; returns the number of shards.
+        """
+        if os.path.isdir(os.path.join(self.work_dir, 'shards')) and self.shard_ids():
+            raise ValueError(f"{self.work_dir} already holds a planned backfill; use a new work directory.")
+        for kind in SUBDIRECTORIES:
+            os.makedirs(os.path.join(self.work_dir, kind), exist_ok=True)
+        _write_atomic(os.path.join(self.work_dir, 'manifest.txt'), "".join(f"{path}\n" for path in paths))
+        shards = [paths[start:start + shard_size] for start in range(0, len(paths), shard_size)]
+        for number, shard_paths in enumerate(shards):
+            _write_atomic(self._path('shards', f"{number:05d}", '.json'), json.dumps(shard_paths))
+        return len(shards)
+
+    def shard_ids(self):
+        return sorted(name[:-len('.json')] for name in os.listdir(os.path.join(self.work_dir, 'shards'))
+                      if name.endswith('.json'))
+
+    def shard_paths(self, shard_id):
+        return json.loads(_read(self._path('shards', shard_id, '.json')))
+
+    def is_done(self, shard_id):
+        return os.path.exists(self._path('done', shard_id))
+
+    def split_index(self, shard_id):
+        text = _read(self._path('splits', shard_id))
+        return int(text) if text else None
+
+    def progress(self, shard_id):
+        text = _read(self._path('progress', shard_id))
+        return int(text) if text else 0
+
+    def set_progress(self, shard_id, index):
+        _write_atomic(self._path('progress', shard_id), str(index))
+
+    # Leases
+
+    def lease_owner(self, shard_id):
+        return _read(self._path('leases', shard_id))
+
+    def lease_age(self, shard_id):
+        try:
+            return time.time() - os.stat(self._path('leases', shard_id)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def owns(self, shard_id, worker_id):
+        return self.lease_owner(shard_id) == worker_id
+
+    def claim(self, shard_id, worker_id):
+        """
+        Takes the lease on a shard that has none, or whose owner stopped heartbeating.
+
+        Returns:
+            bool: Whether worker_id now holds the lease.
+        """
+        lease = self._path('leases', shard_id)
+        age = self.lease_age(shard_id)
+        if age is not None:
+            if age <= self.lease_seconds:
+                return False
+            aside = f"{lease}.stale.{uuid.uuid4().hex}"
+            try:
+                # Of several workers taking over at once, only one rename finds the lease
+                os.rename(lease, aside)
+            except FileNotFoundError:
+                return False
+            logging.warning(f"Worker {worker_id} took over shard {shard_id} from {_read(aside)}.")
+            os.remove(aside)
+        try:
+            _create_exclusive(lease, worker_id)
+        except FileExistsError:
+            return False
+        # The shard may have finished between the listing and the claim
+        if self.is_done(shard_id):
+            self.release(shard_id, worker_id)
+            return False
+        return True
+
+    def heartbeat(self, shard_id, worker_id):
+        if not self.owns(shard_id, worker_id):
+            return False
+        try:
+            os.utime(self._path('leases', shard_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, shard_id, worker_id):
+        if self.owns(shard_id, worker_id):
+            try:
+                os.remove(self._path('leases', shard_id))
+            except FileNotFoundError:
+                pass
+
+    def claim_next(self, worker_id):
+        """
+        Claims the first unfinished shard that is free or abandoned; returns its id or None.
+        """
+        for shard_id in self.shard_ids():
+            if not self.is_done(shard_id) and self.claim(shard_id, worker_id):
+                return shard_id
+        return None
+
+    # Work stealing
+
+    def steal(self, worker_id, min_documents=MIN_STEAL_DOCUMENTS):
+        """
+        Splits the live shard with the most documents left and claims its second half.
+
+        Returns:
+            str or None: Id of the new shard, when one was stolen and claimed.
+        """
+        candidates = []
+        for shard_id in self.shard_ids():
+            if self.is_done(shard_id) or self.split_index(shard_id) is not None or self.lease_age(shard_id) is None:
+                continue
+            done = self.finished_paths(shard_id)
+            paths = self.shard_paths(shard_id)
+            start = self.progress(shard_id)
+            pending = [index for index in range(start, len(paths)) if paths[index] not in done]
+            if len(pending) >= min_documents:
+                candidates.append((len(pending), shard_id, pending))
+        if not candidates:
+            return None
+        _, shard_id, pending = max(candidates)
+        # Cut halfway through what the owner has not started; it keeps the first half
+        cut = pending[len(pending) // 2]
+        new_id = f"{shard_id}.{cut}"
+        # The new shard is written before the split, so a crash in between duplicates work rather than losing it
+        _write_atomic(self._path('shards', new_id, '.json'), json.dumps(self.shard_paths(shard_id)[cut:]))
+        try:
+            _create_exclusive(self._path('splits', shard_id), str(cut))
+        except FileExistsError:
+            os.remove(self._path('shards', new_id, '.json'))
+            return None
+        logging.info(f"Worker {worker_id} stole documents {cut}+ of shard {shard_id} as shard {new_id}.")
+        return new_id if self.claim(new_id, worker_id) else None
+
+    # Checkpoints
+
+    def checkpoint(self, shard_id, result):
+        with open(self._path('checkpoints', shard_id, '.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def results(self, shard_id):
+        lines = (_read(self._path('checkpoints', shard_id, '.jsonl')) or "").splitlines()
+        results = []
+        for line in lines:
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                # The last line of a node that died mid-write
+                continue
+        return results
+
+    def finished_paths(self, shard_id):
+        """
+        Paths this shard or the shards it was stolen from have finished, other than failed or paused ones.
+        """
+        parts = shard_id.split('.')
+        lineage = ['.'.join(parts[:length]) for length in range(1, len(parts) + 1)]
+        return {result['path'] for ancestor in lineage for result in self.results(ancestor)
+                if result['status'] not in RETRY_STATUSES}
+
+    def finish(self, shard_id, worker_id):
+        _write_atomic(self._path('done', shard_id), worker_id)
+        self.release(shard_id, worker_id)
+
+    def all_done(self):
+        return all(self.is_done(shard_id) for shard_id in self.shard_ids())
+
+    def retry(self):
+        """
+        Reopens finished shards with failed or paused documents; their other documents are not run again.
+        """
+        reopened = 0
+        for shard_id in self.shard_ids():
+            if self.is_done(shard_id) and any(result['status'] in RETRY_STATUSES for result in self.results(shard_id)):
+                os.remove(self._path('done', shard_id))
+                reopened += 1
+        return reopened
+
+    def status(self):
+        shards = {'done': 0, 'running': 0, 'abandoned': 0, 'pending': 0}
+        documents = {}
+        for shard_id in self.shard_ids():
+            age = self.lease_age(shard_id)
+            if self.is_done(shard_id):
+                shards['done'] += 1
+            elif age is None:
+                shards['pending'] += 1
+            else:
+                shards['running' if age <= self.lease_seconds else 'abandoned'] += 1
+            for result in self.results(shard_id):
+                documents[result['status']] = documents.get(result['status'], 0) + 1
+        return {'shards': shards, 'documents': documents}
+
+# ===========================
+# 3. Workers
+# ===========================
+
+
+def _heartbeat(board, shard_id, worker_id, stop, lost):
+    while not stop.wait(board.lease_seconds / 3):
+        if not board.heartbeat(shard_id, worker_id):
+            logging.warning(f"Worker {worker_id} lost the lease on shard {shard_id}.")
+            lost.set()
+            return
+
+
+def run_shard(board, shard_id, worker_id, skip_duplicates=True):
+    """
+    Streams the unfinished documents of a claimed shard through the extraction pipeline,
+    checkpointing each result, and marks the shard done unless it lost its lease on the way.
+    """
+    from app import document_pipeline, document_result
+    from document import Document
+
+    # Registrations of an earlier attempt at this shard are not duplicates of its own documents
+    batch_id = f"shard-{shard_id}"
+    finished = board.finished_paths(shard_id)
+    stop, lost = threading.Event(), threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(board, shard_id, worker_id, stop, lost), daemon=True)
+    heartbeat.start()
+
+    # Released as results come out, so the owner never starts more than IN_FLIGHT_DOCUMENTS ahead
+    slots = threading.Semaphore(IN_FLIGHT_DOCUMENTS)
+
+    def items():
+        in_batch = {}
+        for index, path in enumerate(board.shard_paths(shard_id)):
+            if path in finished:
+                continue
+            while not slots.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            if lost.is_set() or not board.owns(shard_id, worker_id):
+                # Taken over between heartbeats: the new owner finishes the shard, not this worker
+                lost.set()
+                return
+            split = board.split_index(shard_id)
+            if split is not None and index >= split:
+                return
+            board.set_progress(shard_id, index + 1)
+            yield {'name': os.path.basename(path), 'path': path, 'document': Document.from_path(path),
+                   'skip_duplicates': skip_duplicates, 'resume_batch': batch_id, 'in_batch': in_batch}
+
+    # Every shard of the backfill is charged to one ledger batch, so its budget covers the whole backfill
+    cost_batch = f"backfill-{os.path.basename(os.path.abspath(board.work_dir))}"
+    results = document_pipeline(batch_id, cost_batch).run(items())
+    try:
+        for item in results:
+            slots.release()
+            result = document_result(item)
+            result.pop('raw_text', None)
+            result.pop('raw_response', None)
+            result.update(path=item['path'], sha=item.get('sha'), worker=worker_id, finished_at=time.time())
+            board.checkpoint(shard_id, result)
+    finally:
+        # Stops the feeder before the pipeline waits for its threads
+        stop.set()
+        results.close()
+        heartbeat.join()
+    # The lease can also go while the last documents drain, after the feeder has stopped looking
+    if lost.is_set() or not board.owns(shard_id, worker_id):
+        return False
+    board.finish(shard_id, worker_id)
+    return True
+
+
+def run_node_worker(work_dir, worker_id=None, lease_seconds=LEASE_SECONDS, poll_seconds=POLL_SECONDS,
+                    skip_duplicates=True):
+    """
+    Claims, takes over or steals shards until every shard of the backfill is done.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    board = ShardBoard(work_dir, lease_seconds)
+    while True:
+        shard_id = board.claim_next(worker_id) or board.steal(worker_id)
+        if shard_id is None:
+            if board.all_done():
+                return
+            # Shards are still running elsewhere; wait in case their node dies or one becomes worth splitting
+            time.sleep(poll_seconds)
+            continue
+        logging.info(f"Worker {worker_id} running shard {shard_id}.")
+        try:
+            run_shard(board, shard_id, worker_id, skip_duplicates)
+        except Exception as e:
+            # The lease is given up so another worker (or this one) retries the shard from its checkpoint
+            logging.error(f"Shard {shard_id} failed on {worker_id}: {e}")
+            board.release(shard_id, worker_id)
+            time.sleep(poll_seconds)
+
+
+def start_node_workers(processes, work_dir, **kwargs):
+    workers = [multiprocessing.Process(target=run_node_worker, args=(work_dir,), kwargs=kwargs, daemon=False)
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+# ===========================
+# 4. Merge
+# ===========================
+
+
+def merge(work_dir, output_path):
+    """
+    Compacts the shard checkpoints into one dataset: one result per path (an extraction wins over a
+    failure), and one record per identical file, however many shards or nodes processed it.
+
+    Returns:
+        dict: Documents per final status, and "written" records.
+    """
+    from export import InvoiceWriter
+
+    board = ShardBoard(work_dir)
+    best = {}
+    for shard_id in board.shard_ids():
+        for result in board.results(shard_id):
+            current = best.get(result['path'])
+            if current is None or (current['status'] != 'extracted' and result['status'] == 'extracted'):
+                best[result['path']] = result
+
+    counts = {}
+    written_shas = set()
+    # Written next to the output and moved into place, so a failed merge leaves the last good dataset
+    root, extension = os.path.splitext(output_path)
+    temp_path = f"{root}.{uuid.uuid4().hex}.partial{extension}"
+    with InvoiceWriter(temp_path) as writer:
+        for path in sorted(best):
+            result = best[path]
+            status = result['status']
+            if status == 'extracted' and result.get('sha') in written_shas:
+                status = 'duplicate'
+            counts[status] = counts.get(status, 0) + 1
+            if status == 'extracted':
+                written_shas.add(result.get('sha'))
+                writer.write(result['record'])
+    os.replace(temp_path, output_path)
+    counts['written'] = writer.rows_written
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded multi-node backfills over a shared directory.")
+    parser.add_argument('--work-dir', required=True, help='Directory shared by all nodes')
+    commands = parser.add_subparsers(dest='command', required=True)
+    plan_parser = commands.add_parser('plan', help='Cut a manifest of PDF paths into shards')
+    plan_parser.add_argument('manifest', help='Text file with one PDF path per line')
+    plan_parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    worker_parser = commands.add_parser('worker', help='Process shards until the backfill is done')
+    worker_parser.add_argument('--processes', type=int, default=1,
+                               help='Worker processes on this node; each already runs a parallel pipeline')
+    worker_parser.add_argument('--lease-seconds', type=float, default=LEASE_SECONDS)
+    worker_parser.add_argument('--keep-duplicates', action='store_true', help='Extract duplicates too')
+    commands.add_parser('status', help='Show shard and document counts')
+    commands.add_parser('retry', help='Reopen shards with failed documents')
+    merge_parser = commands.add_parser('merge', help='Compact the checkpoints into one dataset')
+    merge_parser.add_argument('--output', default='backfill.parquet', help='.parquet, .arrow or .arrows')
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        with open(args.manifest, 'r', encoding='utf-8') as f:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        print(f"{ShardBoard(args.work_dir).plan(paths, args.shard_size)} shards of up to {args.shard_size} documents")
+    elif args.command == 'worker':
+        workers = start_node_workers(args.processes, args.work_dir, lease_seconds=args.lease_seconds,
+                                     skip_duplicates=not args.keep_duplicates)
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # Interrupted shards keep their lease until it expires, then resume from their checkpoint
+            for worker in workers:
+                worker.terminate()
+    elif args.command == 'status':
+        print(json.dumps(ShardBoard(args.work_dir).status(), indent=2))
+    elif args.command == 'retry':
+        print(f"{ShardBoard(args.work_dir).retry()} shards reopened")
+    else:
+        print(merge(args.work_dir, args.output))
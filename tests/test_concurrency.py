@@ -0,0 +1,70 @@
+import threading
+
+from concurrency import MIN_ROUND, AdaptiveLimiter
+
+
+def run_round(limiter, calls, latency=0.1, pushed_back=False):
+    slots = [limiter.acquire(timeout=0) for _ in range(calls)]
+    assert None not in slots
+    for slot in slots:
+        if pushed_back:
+            slot.pushed_back()
+        limiter.release(slot, latency)
+
+
+def test_a_burst_of_429s_halves_the_limit_once():
+    limiter = AdaptiveLimiter("test", initial=8)
+    run_round(limiter, 8, pushed_back=True)
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+
+def test_a_concurrent_burst_of_429s_halves_the_limit_once():
+    limiter = AdaptiveLimiter("test", initial=16)
+    # Every call is in flight before the first 429 comes back, as with a provider that starts refusing
+    started = threading.Barrier(16)
+
+    def call():
+        slot = limiter.acquire(timeout=5)
+        started.wait(timeout=5)
+        slot.pushed_back()
+        limiter.release(slot, 0.1)
+
+    threads = [threading.Thread(target=call) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert limiter.limit == 8
+
+
+def test_healthy_rounds_add_one():
+    limiter = AdaptiveLimiter("test", initial=MIN_ROUND, maximum=MIN_ROUND + 1)
+    run_round(limiter, MIN_ROUND)
+    assert limiter.limit == MIN_ROUND + 1
+    run_round(limiter, MIN_ROUND + 1)
+    assert limiter.limit == MIN_ROUND + 1
+
+
+def test_a_latency_spike_halves_the_limit():
+    limiter = AdaptiveLimiter("test", initial=8)
+    run_round(limiter, 8, latency=0.1)
+    assert limiter.limit == 9
+    run_round(limiter, 9, latency=1.0)
+    assert limiter.limit == 4.5
+
+
+def test_acquire_waits_for_room_under_the_limit():
+    limiter = AdaptiveLimiter("test", initial=1)
+    slot = limiter.acquire()
+    assert limiter.acquire(timeout=0.05) is None
+    assert limiter.try_acquire() is None
+    threading.Timer(0.05, limiter.release, args=(slot, 0.1)).start()
+    assert limiter.acquire(timeout=5) is not None
+
+
+def test_limit_stays_within_bounds():
+    limiter = AdaptiveLimiter("test", initial=2, minimum=1)
+    for _ in range(3):
+        run_round(limiter, int(limiter.limit), pushed_back=True)
+    assert limiter.limit == 1
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from dedup import NEAR_DUPLICATE_THRESHOLD, DedupIndex, invoice_key, minhash
+
+TEMPLATE = """
+ACME TRADING COMPANY PRIVATE LIMITED
+Plot 14, MIDC Industrial Area, Andheri East, Mumbai, Maharashtra
+GSTIN: {gstin}   Email: accounts@acmetrading.example
+TAX INVOICE
+Invoice No: {number}        Invoice Date: {date}
+Bill To: Globex Retail LLP, Station Road, Thane, Maharashtra
+Place of Supply: 27-Maharashtra
+Description of goods            HSN     Qty     Rate      Amount
+Industrial fasteners, steel     7318    {quantity}     {rate}    {taxable}
+Taxable Value                                            {taxable}
+CGST @ 9%                                                {tax}
+SGST @ 9%                                                {tax}
+Total Invoice Value                                      {total}
+Terms: payment due within 30 days of the invoice date. Goods once sold will not be taken back.
+Subject to Mumbai jurisdiction. This is a computer generated invoice and needs no signature.
+Bank: State Bank of India, Andheri East branch, IFSC SBIN0001234, Account 30012345678
+"""
+
+FIRST = dict(gstin='27AAPFU0939F1ZV', number='ACME/2024/0117', date='01/02/2024', quantity='120',
+             rate='12.50', taxable='1500.00', tax='135.00', total='1770.00')
+SECOND = dict(gstin='27AAPFU0939F1ZV', number='ACME/2024/0342', date='19/07/2024', quantity='48',
+              rate='31.75', taxable='1524.00', tax='137.16', total='1798.32')
+
+
+def rescan(text):
+    # What OCR makes of the same page: O for 0 in words, l for I, dropped punctuation, other spacing
+    return (text.replace('PRIVATE', 'PR1VATE').replace('Industrial', 'lndustrial').replace('Terms:', 'Terms')
+            .replace('jurisdiction.', 'jurisdlction').replace('  ', ' '))
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite3"), batch_id="test")
+    yield index
+    index.close()
+
+
+def test_rescan_is_a_near_duplicate(index):
+    original = TEMPLATE.format(**FIRST)
+    index.add("sha-first", "first.pdf", text=original)
+    duplicate = index.check_text(rescan(original), sha="sha-rescan")
+    assert duplicate['kind'] == 'near-duplicate text'
+    assert duplicate['duplicate_of'] == 'first.pdf'
+    assert NEAR_DUPLICATE_THRESHOLD <= duplicate['similarity'] < 1
+
+
+def test_same_template_different_invoice_is_not_a_duplicate(index):
+    first, second = TEMPLATE.format(**FIRST), TEMPLATE.format(**SECOND)
+    # The shared template alone is enough for MinHash to call them near-duplicates...
+    assert np.mean(minhash(first) == minhash(second)) >= NEAR_DUPLICATE_THRESHOLD
+    index.add("sha-first", "first.pdf", text=first)
+    # ...which the invoice number, date and amounts then overrule
+    assert index.check_text(second, sha="sha-second") is None
+
+
+def test_a_file_does_not_match_its_own_registration(index):
+    text = TEMPLATE.format(**FIRST)
+    index.add("sha-first", "first.pdf", text=text)
+    assert index.check_text(text, sha="sha-first") is None
+    assert index.check_text(text, sha="sha-copy")['similarity'] == 1.0
+
+
+def test_identical_file_and_same_invoice(index):
+    sha, duplicate = index.check_file(b"%PDF-1.4 first")
+    assert duplicate is None
+    record = {'GSTIN Supplier': '27AAPFU0939F1ZV', 'Invoice No.': 'ACME/2024/0117', 'Invoice Date': '01/02/2024',
+              'Final Amount': '₹1,770.00'}
+    index.add(sha, "first.pdf", record=record)
+    assert index.check_file(b"%PDF-1.4 first")[1] == {'kind': 'identical file', 'duplicate_of': 'first.pdf',
+                                                      'batch': 'test'}
+    # Another file of the same invoice, written differently
+    other = dict(record, **{'GSTIN Supplier': '27aapfu0939f1zv ', 'Final Amount': '1770'})
+    assert invoice_key(other) == invoice_key(record)
+    assert index.check_invoice(other, sha="sha-other") == {'kind': 'same invoice', 'duplicate_of': 'first.pdf'}
+    assert index.check_invoice(record, sha=sha) is None
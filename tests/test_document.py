@@ -0,0 +1,115 @@
+import io
+import os
+import tempfile
+
+import pytest
+
+from document import Document
+
+fitz = pytest.importorskip("fitz")
+
+
+def make_pdf(pages=2):
+    pdf = fitz.open()
+    for number in range(1, pages + 1):
+        pdf.new_page().insert_text((72, 72), f"Invoice INV-{number}")
+    data = pdf.tobytes()
+    pdf.close()
+    return data
+
+
+class CountingUpload(io.RawIOBase):
+    """
+    A file object that is not a BytesIO and counts how often it is read.
+    """
+
+    def __init__(self, data, name="invoice.pdf"):
+        self.data = data
+        self.name = name
+        self.reads = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return self.data
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    # Anything that spills to a temporary file would land here
+    directory = tmp_path / "tmp"
+    directory.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(directory))
+    return directory
+
+
+def test_from_upload_reads_the_upload_once():
+    upload = CountingUpload(make_pdf())
+    with Document.from_upload(upload) as document:
+        assert document.name == "invoice.pdf"
+        assert len(document.pdf_reader().pages) == 2
+        assert document.page_count == 2
+        assert len(list(document.render())) == 2
+        assert document.stream().read() == upload.data
+        assert document.sha256
+    assert upload.reads == 1
+
+
+def test_from_upload_shares_a_bytesio_buffer():
+    upload = io.BytesIO(make_pdf())
+    with Document.from_upload(upload, "invoice.pdf") as document:
+        # Same memory, not a copy: a change to the upload shows through
+        upload.getbuffer()[:1] = b"X"
+        assert document.buffer[:1].tobytes() == b"X"
+        # The buffer is exported, so the upload cannot be resized underneath the document
+        with pytest.raises(BufferError):
+            upload.write(b"more")
+
+
+def test_reading_creates_no_temporary_files(temp_dir):
+    with Document.from_bytes(make_pdf(), "invoice.pdf") as document:
+        document.fitz()
+        document.stream().read()
+        document.pdf_reader().pages[0].extract_text()
+        images = list(document.render(dpi=72))
+        arrays = list(document.render_arrays(dpi=72, colorspace="gray"))
+    assert [number for number, _ in images] == [1, 2]
+    assert arrays[0][1].ndim == 2
+    assert os.listdir(tempfile.gettempdir()) == []
+
+
+def test_close_releases_the_upload_buffer():
+    upload = io.BytesIO(make_pdf())
+    document = Document.from_upload(upload, "invoice.pdf")
+    view = document.buffer
+    pdf = document.fitz()
+    document.close()
+    assert document.buffer is None
+    assert pdf.is_closed
+    with pytest.raises(ValueError):
+        view.tobytes()
+    # No export left, so the upload can be written to again
+    upload.write(b"more")
+    document.close()
+
+
+def test_close_unmaps_the_file(tmp_path):
+    path = tmp_path / "invoice.pdf"
+    path.write_bytes(make_pdf())
+    document = Document.from_path(str(path))
+    view = document.buffer
+    mapping = view.obj
+    assert document.page_count == 2
+    document.close()
+    assert document.buffer is None
+    assert mapping.closed
+    with pytest.raises(ValueError):
+        view.tobytes()
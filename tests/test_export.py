@@ -0,0 +1,57 @@
+import datetime
+
+import pyarrow as pa
+import pytest
+
+from export import INVOICE_SCHEMA, InvoiceWriter, iter_batches, read_schema, spreadsheet_batch
+
+RECORDS = [
+    {'Source File': 'a.pdf', 'Invoice No.': 'INV-1', 'Taxable Value': '₹1,000.00', 'CGST Amount': '90',
+     'SGST Amount': 'Rs. 90.00', 'Final Amount': '1,00,000.50', 'Tax Rate': '9,9', 'CGST Rate': '9%',
+     'Invoice Date': '01 Feb 2024', 'GSTIN Supplier': '27AAPFU0939F1ZV', 'Consistency Score': '0.875',
+     'Prompt Version': 'invoice_extraction@1'},
+    {'Source File': 'b.pdf', 'Invoice No.': 'INV-2', 'Taxable Value': '-5.00', 'Tax Rate': '14,14',
+     'IGST Rate': [9, 14], 'Invoice Date': '2024-03-15', 'Prompt Version': 'invoice_extraction@1'},
+    # An older record: unparseable values and no Prompt Version become nulls
+    {'Source File': 'c.pdf', 'Taxable Value': 'n/a', 'Invoice Date': 'sometime', 'Tax Rate': None},
+]
+
+
+@pytest.mark.parametrize('name', ['invoices.parquet', 'invoices.arrows'])
+def test_records_round_trip(tmp_path, name):
+    path = str(tmp_path / name)
+    # A row group smaller than the batch, so the rows are read back from several groups
+    with InvoiceWriter(path, row_group_size=2) as writer:
+        for record in RECORDS:
+            writer.write(record)
+    assert writer.rows_written == 3
+    assert read_schema(path).names == INVOICE_SCHEMA.names
+
+    table = pa.Table.from_batches(list(iter_batches(path)))
+    assert table.schema.field('Taxable Value').type == pa.int64()
+    assert table.schema.field('Invoice Date').type == pa.date32()
+    rows = table.to_pylist()
+    assert [row['Source File'] for row in rows] == ['a.pdf', 'b.pdf', 'c.pdf']
+    # Amounts in paise
+    assert [row['Taxable Value'] for row in rows] == [100000, -500, None]
+    assert rows[0]['SGST Amount'] == 9000
+    assert rows[0]['Final Amount'] == 10000050
+    # Rates as lists: "9,9" is two rates, not 99
+    assert [row['Tax Rate'] for row in rows] == [[9.0, 9.0], [14.0, 14.0], None]
+    assert rows[0]['CGST Rate'] == [9.0]
+    assert rows[1]['IGST Rate'] == [9.0, 14.0]
+    assert [row['Invoice Date'] for row in rows] == [datetime.date(2024, 2, 1), datetime.date(2024, 3, 15), None]
+    assert rows[0]['GSTIN Supplier'] == '27AAPFU0939F1ZV'
+    assert rows[0]['Consistency Score'] == 0.875
+    assert [row['Prompt Version'] for row in rows] == ['invoice_extraction@1', 'invoice_extraction@1', None]
+
+
+def test_spreadsheet_batch_shows_rupees_and_joined_rates(tmp_path):
+    path = str(tmp_path / "invoices.parquet")
+    with InvoiceWriter(path) as writer:
+        writer.write(RECORDS[0])
+    row = spreadsheet_batch(next(iter_batches(path))).to_pylist()[0]
+    assert row['Taxable Value'] == 1000.0
+    assert row['Final Amount'] == 100000.5
+    assert row['Tax Rate'] == '9,9'
+    assert row['GSTIN Supplier'] == '27AAPFU0939F1ZV'
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+import app
+import jobs
+from pipeline import Pipeline, Stage, close_document
+
+INVOICE = b"%PDF-1.4 invoice ACME/2024/0117"
+
+
+def read_text(item, resource=None):
+    item['raw_text'] = "TAX INVOICE ACME/2024/0117 dated 01/02/2024, GSTIN 27AAPFU0939F1ZV, total 1770.00"
+
+
+def extract_fields(item, resource=None):
+    item['record'] = {'GSTIN Supplier': '27AAPFU0939F1ZV', 'Invoice No.': 'ACME/2024/0117',
+                      'Invoice Date': '01/02/2024', 'Final Amount': '1770.00'}
+
+
+def fake_pipeline(batch_id=None, cost_batch=None):
+    # The real dedup and registration stages, with the OCR and the API calls left out
+    return Pipeline([
+        Stage("dedup_file", app.check_file_stage),
+        Stage("pdf_text", read_text),
+        Stage("dedup_text", app.check_text_stage),
+        Stage("extract_fields", extract_fields),
+        Stage("register", app.register_stage),
+        Stage("close_document", close_document, final=True),
+    ])
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    # The dedup index run_job opens lives in the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, 'document_pipeline', fake_pipeline)
+    queue = jobs.JobQueue(str(tmp_path / "jobs.sqlite3"), str(tmp_path / "uploads"))
+    yield queue
+    queue.close()
+
+
+def test_enqueue_is_idempotent_within_a_batch(queue):
+    job_id = queue.enqueue("batch-1", "a.pdf", INVOICE)
+    assert queue.enqueue("batch-1", "a-copy.pdf", INVOICE) == job_id
+    assert queue.enqueue("batch-2", "a.pdf", INVOICE) != job_id
+    assert queue.batch_counts("batch-1") == {jobs.QUEUED: 1}
+
+
+def test_reclaimed_lease_reruns_without_a_self_dedup_hit(queue, tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    job_id = queue.enqueue("batch-1", "a.pdf", INVOICE)
+    stalled = queue.claim("slow-node", lease_seconds=0.05)
+    time.sleep(0.1)
+    # The lease expired: the job is handed to another worker as a second attempt
+    rerun = queue.claim("new-owner")
+    assert (rerun['id'], rerun['attempts']) == (job_id, 2)
+    assert queue.heartbeat(job_id, "slow-node") is False
+
+    # The slow node still finishes and registers the file in the dedup index, but cannot complete the job
+    jobs.run_job(queue, stalled, "slow-node", path)
+    assert queue.batch_jobs("batch-1")[0]['state'] == jobs.RUNNING
+
+    # Its registration is the same job's, so the rerun extracts instead of reporting a duplicate of itself
+    jobs.run_job(queue, rerun, "new-owner", path)
+    job = queue.batch_jobs("batch-1")[0]
+    assert (job['state'], job['worker'], job['result']['status']) == (jobs.DONE, "new-owner", 'extracted')
+
+    # Another job with the same file is a duplicate
+    other_id = queue.enqueue("batch-2", "a.pdf", INVOICE)
+    jobs.run_job(queue, queue.claim("new-owner"), "new-owner", path)
+    other = queue.batch_jobs("batch-2")[0]
+    assert other['id'] == other_id
+    assert other['result']['duplicate'] == {'kind': 'identical file', 'duplicate_of': 'a.pdf',
+                                            'batch': f"job-{job_id}"}
+
+
+def test_failed_attempts_back_off_then_fail(queue):
+    job_id = queue.enqueue("batch-1", "a.pdf", INVOICE, max_attempts=2)
+    job = queue.claim("worker")
+    start = time.time()
+    assert queue.fail(job_id, "worker", "rate limited")
+    job = queue.batch_jobs("batch-1")[0]
+    assert job['state'] == jobs.QUEUED
+    assert job['available_at'] - start == pytest.approx(jobs.RETRY_BACKOFF_SECONDS, abs=1)
+    # Not due yet
+    assert queue.claim("worker") is None
+
+    # Due again: the second and last attempt fails for good
+    queue.conn.execute("UPDATE jobs SET available_at = 0 WHERE id = ?", (job_id,))
+    assert queue.claim("worker")['attempts'] == 2
+    assert queue.fail(job_id, "worker", "rate limited")
+    assert queue.batch_counts("batch-1") == {jobs.FAILED: 1}
+    assert jobs.batch_finished(queue.batch_counts("batch-1"))
+
+    assert queue.retry("batch-1") == 1
+    assert queue.claim("worker")['attempts'] == 1
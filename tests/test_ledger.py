@@ -0,0 +1,37 @@
+import time
+
+import pytest
+
+from ledger import BudgetExceeded, BudgetGuard, Ledger
+
+TIERS = [("gpt-4o", "https://example.invalid/gpt-4o"), ("gpt-4o-mini", "https://example.invalid/gpt-4o-mini")]
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = Ledger(str(tmp_path / "ledger.sqlite3"))
+    yield ledger
+    ledger.close()
+
+
+def test_tokens_per_minute_wait_stops_at_the_deadline(ledger):
+    ledger.record("batch", "a.pdf", "extract_fields", "gpt-4o", {'prompt_tokens': 900, 'completion_tokens': 100})
+    guard = BudgetGuard(ledger, "batch", TIERS, max_tokens_per_minute=500, poll_seconds=0.05)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        guard.tier(deadline=start + 0.2)
+    assert time.monotonic() - start < 1
+
+
+def test_tier_below_the_rate_limit_does_not_wait(ledger):
+    guard = BudgetGuard(ledger, "batch", TIERS, max_tokens_per_minute=500, poll_seconds=10)
+    assert guard.tier(deadline=time.monotonic() + 0.1) == TIERS[0]
+
+
+def test_budget_downgrades_then_pauses(ledger):
+    guard = BudgetGuard(ledger, "batch", TIERS, max_cost=1.0)
+    ledger.record("batch", "a.pdf", "extract_fields", "gpt-4o", {'prompt_tokens': 180_000})
+    assert guard.tier() == TIERS[-1]
+    ledger.record("batch", "b.pdf", "extract_fields", "gpt-4o", {'prompt_tokens': 200_000})
+    with pytest.raises(BudgetExceeded):
+        guard.tier()
@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from normalize import normalize_invoices, to_number, to_paise, to_rates
+
+
+def rates(values):
+    return [None if value is pd.NA else list(value) for value in to_rates(pd.Series(values))]
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("9,14", [9.0, 14.0]),
+    ("14,14", [14.0, 14.0]),
+    ("12,18", [12.0, 18.0]),
+    ([9, 14], [9.0, 14.0]),
+    ("6,9", [6.0, 9.0]),
+    ("9, 14", [9.0, 14.0]),
+    ("18%", [18.0]),
+    ("2.5", [2.5]),
+])
+def test_rates_keep_every_listed_rate(value, expected):
+    assert rates([value]) == [expected]
+
+
+def test_missing_rates_are_null():
+    assert rates([None, "", "n/a"]) == [None, None, None]
+
+
+@pytest.mark.parametrize("value, paise", [
+    ("₹1,483.32", 148332),
+    ("1,00,000.50", 10000050),
+    ("-5.00", -500),
+    ("Rs. 12,345", 1234500),
+    ("INR 99.995", 10000),
+    (1483.3, 148330),
+])
+def test_amounts_to_paise(value, paise):
+    assert to_paise(pd.Series([value])).iat[0] == paise
+
+
+def test_unparseable_amount_is_na():
+    assert to_paise(pd.Series(["n/a", None])).isna().all()
+
+
+def test_quantities_drop_digit_group_commas():
+    assert to_number(pd.Series(["1,200", "3 pcs", None])).tolist()[:2] == [1200.0, 3.0]
+
+
+def test_normalize_invoices_types_each_column_group():
+    frame = normalize_invoices(pd.DataFrame({
+        'Taxable Value': ["1,000.00"], 'CGST Rate': ["9,14"], 'Invoice Date': ["05/03/2024"],
+        'GSTIN Supplier': [" 27aapfu0939f1zv "], 'Address': ["Pune"],
+    }))
+    assert frame['Taxable Value'].iat[0] == 100000
+    assert list(frame['CGST Rate'].iat[0]) == [9.0, 14.0]
+    assert frame['Invoice Date'].iat[0] == pd.Timestamp(2024, 3, 5)
+    assert frame['GSTIN Supplier'].iat[0] == "27AAPFU0939F1ZV"
+    assert frame['Address'].iat[0] == "Pune"
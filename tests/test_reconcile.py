@@ -0,0 +1,90 @@
+import pandas as pd
+import pytest
+
+from reconcile import REVIEW_THRESHOLD, failed_checks, gstin_checksum_valid, reconcile_invoices
+
+SUPPLIER = "27AAPFU0939F1ZV"
+
+
+def invoice(**fields):
+    row = {
+        'Taxable Value': "1000.00", 'CGST Amount': "", 'SGST Amount': "", 'IGST Amount': "",
+        'Tax Amount': "", 'Final Amount': "", 'Tax Rate': "", 'CGST Rate': "", 'SGST Rate': "",
+        'IGST Rate': "", 'Place of Supply': "27-MAHARASHTRA", 'GSTIN Supplier': SUPPLIER,
+    }
+    row.update(fields)
+    return row
+
+
+def check(*rows):
+    return reconcile_invoices(pd.DataFrame(list(rows)))
+
+
+def test_gstin_checksum():
+    assert gstin_checksum_valid(SUPPLIER)
+    assert not gstin_checksum_valid(SUPPLIER[:-1] + "X")
+
+
+def test_two_digit_component_rates_in_tax_rate():
+    # CGST 14% + SGST 14% listed together in Tax Rate, no per-head rates
+    checks = check(invoice(**{'Tax Rate': "14,14", 'CGST Amount': "140.00", 'SGST Amount': "140.00",
+                              'Tax Amount': "280.00", 'Final Amount': "1280.00"}))
+    assert checks['tax_matches_rate'].isna().iat[0] or checks['tax_matches_rate'].iat[0]
+    assert checks['confidence'].iat[0] == 1.0
+    assert not checks['needs_review'].iat[0]
+
+
+def test_per_head_rates_are_summed():
+    checks = check(invoice(**{'CGST Rate': "14", 'SGST Rate': "14", 'Tax Rate': "28",
+                              'CGST Amount': "140.00", 'SGST Amount': "140.00",
+                              'Tax Amount': "280.00", 'Final Amount': "1280.00"}))
+    assert checks['tax_matches_rate'].iat[0]
+    assert checks['confidence'].iat[0] == 1.0
+
+
+def test_per_head_rate_repeated_per_line_item():
+    # Two line items at 9% each: the head rate is 9, not 18 or 99
+    checks = check(invoice(**{'CGST Rate': "9,9", 'SGST Rate': "9, 9", 'CGST Amount': "90.00",
+                              'SGST Amount': "90.00", 'Tax Amount': "180.00", 'Final Amount': "1180.00"}))
+    assert checks['tax_matches_rate'].iat[0]
+
+
+def test_mixed_rate_invoice_skips_the_rate_check():
+    # Items at 9% and 14% CGST/SGST: no single rate explains the tax, so the check does not apply
+    checks = check(invoice(**{'CGST Rate': "9,14", 'SGST Rate': "9,14", 'CGST Amount': "115.00",
+                              'SGST Amount': "115.00", 'Tax Amount': "230.00", 'Final Amount': "1230.00"}))
+    assert checks['tax_matches_rate'].isna().iat[0]
+    assert checks['confidence'].iat[0] == 1.0
+
+
+def test_inter_state_igst():
+    checks = check(invoice(**{'Place of Supply': "29-KARNATAKA", 'IGST Rate': "18", 'IGST Amount': "180.00",
+                              'Tax Amount': "180.00", 'Final Amount': "1180.00"}))
+    assert checks['supply_type_consistent'].iat[0]
+    assert checks['cgst_equals_sgst'].isna().iat[0]
+    assert checks['tax_matches_rate'].iat[0]
+
+
+def test_wrong_tax_is_flagged():
+    checks = check(invoice(**{'Tax Rate': "18", 'CGST Amount': "90.00", 'SGST Amount': "90.00",
+                              'Tax Amount': "280.00", 'Final Amount': "1180.00"}))
+    assert not checks['tax_sum_matches'].iat[0]
+    assert not checks['tax_matches_rate'].iat[0]
+    assert checks['needs_review'].iat[0]
+    assert checks['confidence'].iat[0] < REVIEW_THRESHOLD
+    assert set(failed_checks(checks).iat[0]) == {'tax_sum_matches', 'tax_matches_rate'}
+
+
+def test_discount_column_enters_the_total():
+    row = invoice(**{'Tax Rate': "18", 'CGST Amount': "90.00", 'SGST Amount': "90.00", 'Tax Amount': "180.00",
+                     'Final Amount': "1130.00", 'Discount': "50.00"})
+    assert not reconcile_invoices(pd.DataFrame([row]))['total_reconciles'].iat[0]
+    assert reconcile_invoices(pd.DataFrame([row]), discount_column='Discount')['total_reconciles'].iat[0]
+
+
+def test_regex_extractor_subtracts_the_discount():
+    utils = pytest.importorskip("Model_2_OCR.utils")
+    text = ("Taxable Amount ₹1,000.00\nCGST 9% ₹90.00\nSGST 9% ₹90.00\n"
+            "Total Discount - ₹50.00\nTotal ₹1,130.00\n")
+    _, scores = utils.process_invoice_text(text)
+    assert scores['tax_amount'] == 1
@@ -0,0 +1,98 @@
+import multiprocessing
+import os
+import time
+
+import pyarrow.parquet as pq
+import pytest
+
+import app
+import shards
+from pipeline import Pipeline, Stage, close_document
+
+# Short enough for a test, long enough that a heartbeat (every third of it) is never late
+LEASE_SECONDS = 3
+SECONDS_PER_DOCUMENT = 0.05
+
+
+def record(name):
+    return {'Source File': name, 'Invoice No.': name, 'Prompt Version': 'invoice_extraction@test'}
+
+
+def fake_extract(item, resource=None):
+    time.sleep(SECONDS_PER_DOCUMENT)
+    item['status'] = 'extracted'
+    item['sha'] = item['name']
+    item['record'] = record(item['name'])
+
+
+def fake_pipeline(batch_id=None, cost_batch=None, extract=fake_extract):
+    # The real pipeline's bookkeeping without the OCR and the API calls
+    return Pipeline([Stage("extract_fields", extract, workers=2), Stage("close_document", close_document, final=True)])
+
+
+def run_worker(work_dir, worker_id):
+    app.document_pipeline = fake_pipeline
+    shards.run_node_worker(work_dir, worker_id, lease_seconds=LEASE_SECONDS, poll_seconds=0.1)
+
+
+def plan(tmp_path, documents, shard_size):
+    paths = []
+    for number in range(documents):
+        path = tmp_path / "pdfs" / f"invoice-{number:03d}.pdf"
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b"%PDF-1.4\n")
+        paths.append(str(path))
+    board = shards.ShardBoard(str(tmp_path / "work"), LEASE_SECONDS)
+    board.plan(paths, shard_size)
+    return board, paths
+
+
+def test_two_workers_take_over_steal_and_merge(tmp_path):
+    # A long shard 00000 to steal from, and a short 00001 held by a node that died after its first document
+    board, paths = plan(tmp_path, 44, shard_size=40)
+    board.claim('00001', 'dead-node')
+    board.checkpoint('00001', {'path': paths[40], 'status': 'extracted', 'sha': 'invoice-040.pdf', 'worker': 'dead-node',
+                               'record': record('invoice-040.pdf')})
+    stale = time.time() - 10 * LEASE_SECONDS
+    os.utime(board._path('leases', '00001'), (stale, stale))
+
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=run_worker, args=(board.work_dir, f"worker-{number}")) for number in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    assert board.all_done()
+    # Taken over from the dead node, which keeps the document it finished
+    assert board.lease_owner('00001') is None
+    assert shards._read(board._path('done', '00001')) in {'worker-0', 'worker-1'}
+    assert [result['worker'] for shard_id in board.shard_ids() for result in board.results(shard_id)
+            if result['path'] == paths[40]] == ['dead-node']
+    # The worker that finished the short shard split the long one and ran its second half
+    assert board.split_index('00000') is not None
+    stolen = [shard_id for shard_id in board.shard_ids() if shard_id.startswith('00000.')]
+    assert stolen and all(board.is_done(shard_id) for shard_id in stolen)
+
+    output = str(tmp_path / "backfill.parquet")
+    counts = shards.merge(board.work_dir, output)
+    names = pq.read_table(output).column('Source File').to_pylist()
+    assert counts == {'extracted': 44, 'written': 44}
+    assert sorted(names) == [os.path.basename(path) for path in paths]
+
+
+def test_a_worker_that_lost_its_lease_leaves_the_shard_to_the_new_owner(tmp_path, monkeypatch):
+    board, _ = plan(tmp_path, 6, shard_size=6)
+    assert board.claim('00000', 'slow-node')
+
+    def extract_while_taken_over(item, resource=None):
+        # Another worker takes the shard over between two heartbeats
+        shards._write_atomic(board._path('leases', '00000'), 'new-owner')
+        fake_extract(item)
+
+    monkeypatch.setattr(app, 'document_pipeline',
+                        lambda *args: fake_pipeline(extract=extract_while_taken_over))
+    assert shards.run_shard(board, '00000', 'slow-node') is False
+    assert not board.is_done('00000')
+    assert board.lease_owner('00000') == 'new-owner'
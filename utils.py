@@ -2,21 +2,12 @@ import os
 import json
 import re
 import logging
-import requests
 import time
 import pandas as pd
-from pypdf import PdfReader
-from pdf2image import convert_from_bytes
-import pytesseract
 import streamlit as st
-import yaml
 
-# Load prompt template from YAML file
-def load_prompts():
-    with open('prompts.yaml') as file:
-        return yaml.safe_load(file)
-
-prompts = load_prompts()
+# Prompt templates are compiled once per process by the registry (prompts.py, prompts.yaml)
+from prompts import get_prompt
 
 def get_pdf_text(pdf_doc):
     """
@@ -28,29 +19,19 @@ def get_pdf_text(pdf_doc):
     Returns:
         str: The extracted text from the PDF.
     """
-    text = ""
+    from document import Document
+    from pipeline import extract_page_text, ocr_missing_pages
+
     try:
-        pdf_reader = PdfReader(pdf_doc)
-        num_pages = len(pdf_reader.pages)
-        for page_number, page in enumerate(pdf_reader.pages, start=1):
-            extracted_text = page.extract_text()
-            if extracted_text and len(extracted_text.strip()) > 50:
-                text += extracted_text + "\n"
-                logging.info(f"Text extracted from page {page_number} using PdfReader.")
-            else:
-                logging.info(f"Insufficient text on page {page_number}. Applying OCR.")
-                pdf_doc.seek(0)
-                pdf_bytes = pdf_doc.read()
-                images = convert_from_bytes(pdf_bytes, first_page=page_number, last_page=page_number)
-                for image in images:
-                    ocr_text = pytesseract.image_to_string(image, config='--psm 6')
-                    if ocr_text and len(ocr_text.strip()) > 10:
-                        text += ocr_text + "\n"
-                        logging.info(f"OCR text extracted from page {page_number}.")
+        with Document.from_upload(pdf_doc) as document:
+            item = {'name': document.name, 'document': document}
+            extract_page_text(item)
+            ocr_missing_pages(item)
     except Exception as e:
         logging.error(f"Error extracting text from PDF: {e}")
         st.error(f"Error extracting text from PDF: {e}")
-    return text
+        return ""
+    return item['raw_text']
 
 def call_openai_api(pages_data):
     """
@@ -62,6 +43,8 @@ def call_openai_api(pages_data):
     Returns:
         str or None: The raw extracted data from the API if successful; otherwise, None.
     """
+    import requests
+
     GPT4V_KEY = os.getenv("GPT4V_KEY")
     GPT4V_ENDPOINT = os.getenv("GPT4V_ENDPOINT")
     
@@ -70,19 +53,15 @@ def call_openai_api(pages_data):
         "api-key": GPT4V_KEY,
     }
 
-    prompt = prompts['invoice_extraction_prompt'].format(pages=pages_data)
-
     data = {
-        "messages": [
-            {"role": "system", "content": "You are a helpful and accurate assistant."},
-            {"role": "user", "content": prompt}
-        ],
+        "messages": get_prompt("invoice_extraction").messages(pages_data),
         "max_tokens": 1000,
         "temperature": 0.3
     }
 
     try:
-        response = requests.post(GPT4V_ENDPOINT, headers=headers, json=data)
+        # Never wait on a stuck connection for longer than a slow answer takes
+        response = requests.post(GPT4V_ENDPOINT, headers=headers, json=data, timeout=(10, 120))
         if response.status_code == 200:
             response_json = response.json()
             llm_extracted_data = response_json.get("choices", [])[0].get("message", {}).get("content", "")